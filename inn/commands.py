@@ -0,0 +1,58 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-room-night-index")
+@click.option("--from-date", help="Only rebuild nights on or after this date (YYYY-MM-DD)")
+@pass_context
+def rebuild_room_night_index(context, from_date=None):
+    "Rebuild Inn Room Night from Inn Room Booking"
+    from inn.inn_hotels.doctype.inn_room_night.inn_room_night import rebuild_room_nights
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        count = rebuild_room_nights(from_date)
+        click.echo("Rebuilt room nights of {0} booking(s)".format(count))
+    finally:
+        frappe.destroy()
+
+
+@click.command("backfill-daily-kpi")
+@click.option("--from-date", required=True, help="First day to rebuild (YYYY-MM-DD)")
+@click.option("--to-date", required=True, help="Last day to rebuild (YYYY-MM-DD)")
+@pass_context
+def backfill_daily_kpi(context, from_date, to_date):
+    "Rebuild Inn Daily KPI of historical days"
+    from inn.inn_hotels.doctype.inn_daily_kpi.inn_daily_kpi import backfill_daily_kpi
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        days = backfill_daily_kpi(from_date, to_date)
+        click.echo("Rebuilt daily KPI of {0} day(s)".format(days))
+    finally:
+        frappe.destroy()
+
+
+@click.command("rebuild-gl-monthly-balance")
+@click.option("--fiscal-year", help="Only rebuild the months of this fiscal year")
+@pass_context
+def rebuild_gl_monthly_balance(context, fiscal_year=None):
+    "Rebuild Inn GL Monthly Balance from GL Entry"
+    from inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance import rebuild_gl_monthly_balance
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        months = rebuild_gl_monthly_balance(fiscal_year)
+        click.echo("Rebuilt GL balance of {0} month(s)".format(months))
+    finally:
+        frappe.destroy()
+
+
+commands = [rebuild_room_night_index, backfill_daily_kpi, rebuild_gl_monthly_balance]
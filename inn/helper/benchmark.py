@@ -0,0 +1,157 @@
+"""Latency benchmarks for the hot paths of the front desk, run against a site with
+
+    bench --site <site> execute inn.helper.benchmark.<function>
+
+Every benchmark writes its synthetic rows inside the current transaction and rolls
+them back at the end, so it can be pointed at a copy of a production site.
+"""
+import time
+
+import frappe
+from frappe.utils import add_days
+
+from inn.helper.bulk import bulk_insert_docs
+from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
+
+
+def _timed(func, *args, repeat: int = 5, **kwargs) -> float:
+    """Best wall clock time of `repeat` calls, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _make_open_guest_folios(count: int, prefix: str) -> None:
+    """Insert `count` In House reservations, each with an Open Guest folio and without room charge."""
+    audit_date = get_last_audit_date()
+    reservations = []
+    folios = []
+    for i in range(count):
+        reservation_id = "{0}-RSV-{1:05d}".format(prefix, i)
+        reservations.append({
+            "name": reservation_id,
+            "naming_series": "RSV-",
+            "status": "In House",
+            "type": "Individual",
+            "customer_id": "Benchmark Customer",
+            "expected_arrival": audit_date,
+            "expected_departure": add_days(audit_date, 1),
+            "room_id": "{0}-ROOM-{1:05d}".format(prefix, i),
+            "actual_room_id": "{0}-ROOM-{1:05d}".format(prefix, i),
+            "room_rate": "Benchmark Rate",
+            "actual_room_rate": 500000,
+            "init_actual_room_rate": 500000,
+        })
+        folios.append({
+            "name": "{0}-FO-{1:05d}".format(prefix, i),
+            "naming_series": "FO-",
+            "type": "Guest",
+            "status": "Open",
+            "reservation_id": reservation_id,
+            "customer_id": "Benchmark Customer",
+        })
+    bulk_insert_docs("Inn Reservation", [f for f in reservations[0] if f != "name"], reservations)
+    bulk_insert_docs("Inn Folio", [f for f in folios[0] if f != "name"], folios)
+
+
+def populate_tobe_posted(folio_counts=(50, 500, 2000), repeat: int = 5) -> dict:
+    """Latency of populate_tobe_posted for the given numbers of open guest folios (on top of the site's own)."""
+    from inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting import populate_tobe_posted
+
+    result = {}
+    try:
+        created = 0
+        for count in sorted(folio_counts):
+            _make_open_guest_folios(count - created, "BENCH{0}".format(count))
+            created = count
+            result[count] = _timed(populate_tobe_posted, repeat=repeat)
+            print("populate_tobe_posted, {0} open folios: {1:.1f} ms".format(count, result[count]))
+    finally:
+        frappe.db.rollback()
+
+    return result
+
+
+def insert_folio_transactions(count: int = 10000) -> dict:
+    """Latency of inserting `count` Inn Folio Transaction with the audit date read from the
+    database on every insert (before) and from the site cache (after)."""
+    from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import query_last_audit_date
+    from inn.inn_hotels.doctype.inn_folio_transaction import inn_folio_transaction
+
+    _make_open_guest_folios(1, "BENCHTRX")
+    folio_id = "BENCHTRX-FO-00000"
+
+    def insert_all():
+        for i in range(count):
+            frappe.get_doc({
+                "doctype": "Inn Folio Transaction",
+                "parent": folio_id,
+                "parenttype": "Inn Folio",
+                "parentfield": "folio_transaction",
+                "idx": i + 1,
+                "flag": "Debit",
+                "transaction_type": "Room Charge",
+                "amount": 1000,
+                "remark": "Benchmark",
+            }).insert(ignore_permissions=True)
+
+    result = {}
+    cached_get_last_audit_date = inn_folio_transaction.get_last_audit_date
+    try:
+        # before: the add_audit_date hook goes to the database like the uncached implementation did
+        inn_folio_transaction.get_last_audit_date = query_last_audit_date
+        result["before"] = _timed(insert_all, repeat=1)
+        inn_folio_transaction.get_last_audit_date = cached_get_last_audit_date
+        result["after"] = _timed(insert_all, repeat=1)
+    finally:
+        inn_folio_transaction.get_last_audit_date = cached_get_last_audit_date
+        frappe.db.rollback()
+
+    print("insert {0} folio transactions, before: {1:.0f} ms, after: {2:.0f} ms".format(count, result["before"], result["after"]))
+    return result
+
+
+def room_occupancy(spans=(31, 365, 1825), bookings_per_day: int = 60, repeat: int = 3) -> dict:
+    """Latency of the Room Occupancy report over 1 month, 1 year and 5 years of synthetic bookings."""
+    import random
+    from datetime import datetime, timedelta
+
+    from inn.inn_hotels.report.room_occupancy.room_occupancy import get_data
+
+    rooms = frappe.get_all("Inn Room", pluck="name")
+    if not rooms:
+        print("room_occupancy needs at least one Inn Room")
+        return {}
+
+    start = get_last_audit_date() or frappe.utils.getdate()
+    result = {}
+    try:
+        created_until = start
+        for span in sorted(spans):
+            bookings = []
+            while created_until < start + timedelta(days=span):
+                for i in range(bookings_per_day):
+                    nights = random.randint(1, 5)
+                    bookings.append({
+                        "name": frappe.generate_hash(length=10),
+                        "room_id": random.choice(rooms),
+                        "start": created_until,
+                        "end": created_until + timedelta(days=nights),
+                        "status": "Booked",
+                        "room_availability": "Room Sold",
+                    })
+                created_until = created_until + timedelta(days=1)
+            bulk_insert_docs("Inn Room Booking", ["room_id", "start", "end", "status", "room_availability"], bookings)
+
+            start_date = datetime.combine(start, datetime.min.time())
+            end_date = start_date + timedelta(days=span - 1)
+            result[span] = _timed(get_data, start_date, end_date, end_date - start_date, repeat=repeat)
+            print("room_occupancy, {0} days: {1:.1f} ms".format(span, result[span]))
+    finally:
+        frappe.db.rollback()
+
+    return result
@@ -0,0 +1,56 @@
+import frappe
+from frappe.utils import now
+
+
+def reserve_series(key: str, digits: int, count: int) -> list[str]:
+    """Reserve `count` consecutive numbers of naming series `key` in one round trip
+    and return the generated names, formatted the same way as frappe's getseries.
+
+    Parameters
+    ----
+    key : str
+        Series key as stored in tabSeries (e.g. "FTB-")
+    digits : int
+        Zero padding of the numeric part
+    count : int
+        Number of names to reserve
+    """
+    if count <= 0:
+        return []
+
+    current = frappe.db.sql("select `current` from `tabSeries` where `name`=%s for update", (key,))
+    if current and current[0][0] is not None:
+        start = int(current[0][0])
+        frappe.db.sql("update `tabSeries` set `current` = `current` + %s where `name`=%s", (count, key))
+    else:
+        start = 0
+        frappe.db.sql("insert into `tabSeries` (`name`, `current`) values (%s, %s)", (key, count))
+
+    return [key + ("%0" + str(digits) + "d") % n for n in range(start + 1, start + count + 1)]
+
+
+def bulk_insert_docs(doctype: str, fields: list[str], rows: list[dict]) -> None:
+    """Insert plain dict rows into `doctype` with one multi-row INSERT per chunk.
+
+    Standard columns (creation, modified, owner, modified_by, docstatus) are filled
+    in when the row does not carry them. Document hooks and validations are NOT run,
+    callers are responsible for setting every value the controller would set.
+    """
+    if not rows:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    standard = {
+        "creation": timestamp,
+        "modified": timestamp,
+        "owner": user,
+        "modified_by": user,
+        "docstatus": 0,
+    }
+    columns = ["name"] + [f for f in standard if f not in fields] + [f for f in fields if f != "name"]
+    values = []
+    for row in rows:
+        values.append(tuple(row.get(col, standard.get(col)) for col in columns))
+
+    frappe.db.bulk_insert(doctype, columns, values)
@@ -0,0 +1,64 @@
+from functools import partial
+
+import frappe
+
+
+class VersionedCache:
+    """
+    redis hash of `key` holding one value per document name, with a copy local to the process in front of it.
+
+    the local copy is dropped whenever the version kept in redis under `key`_version moves, which invalidate does,
+    so every worker sees a change without a round trip to redis for each value.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.version_key = key + '_version'
+        self.local = {}
+        self.local_version = None
+
+    def get_many(self, names, load):
+        """
+        :param names iterable of document names
+        :param load called with the list of names found in neither cache, returns dict of name to value
+        :return dict of name to value, names `load` left out are left out too
+        """
+        version = frappe.cache().get_value(self.version_key)
+        if version != self.local_version:
+            self.local = {}
+            self.local_version = version
+
+        values = {}
+        missing = []
+        for name in set(names):
+            if name in self.local:
+                values[name] = self.local[name]
+                continue
+            cached = frappe.cache().hget(self.key, name)
+            if cached is not None:
+                values[name] = self.local[name] = cached
+            else:
+                missing.append(name)
+
+        if missing:
+            for name, value in load(missing).items():
+                frappe.cache().hset(self.key, name, value)
+                values[name] = self.local[name] = value
+
+        return values
+
+    def invalidate(self, name=None):
+        """
+        drop the value of `name`, every value when not given. dropped at once for the current request, and again after
+        commit: a worker reading the document before the commit would have put the old value back in redis.
+        """
+        self.clear(name)
+        frappe.db.after_commit.add(partial(self.clear, name))
+
+    def clear(self, name=None):
+        if name:
+            frappe.cache().hdel(self.key, name)
+        else:
+            frappe.cache().delete_value(self.key)
+        # moving the version drops the process local copies on every worker
+        frappe.cache().set_value(self.version_key, frappe.generate_hash(length=10))
@@ -0,0 +1,241 @@
+"""Client of the door-lock card encoder API (TESA and DOWS) used by Inn Key Card.
+
+Every worker process keeps one pooled keep-alive session per provider. Calls are bounded
+by connect/read timeouts, retried with exponential backoff when it is safe to, and fail
+fast while the encoder is known to be down (circuit breaker), so a stalled encoder can
+not hold the front desk workers. The latency of every operation is counted in a
+histogram kept in the site cache, read it with get_door_lock_latency.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import frappe
+import requests
+from frappe.utils import cint
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+CONNECT_TIMEOUT = 3
+# the encoder only answers once a card has been put on it
+READ_TIMEOUT = 20
+POOL_SIZE = 4
+MAX_RETRIES = 2
+BACKOFF_SECONDS = 0.5
+# consecutive failures opening the circuit, and how long calls fail fast afterwards
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 30
+LATENCY_CACHE_KEY = "inn_door_lock_latency"
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000)
+# the DOWS encoder rejects requests carrying these default headers of requests
+STRIPPED_HEADERS = {
+    "DOWS": ("Connection", "Accept-Encoding", "Accept"),
+}
+
+DoorLockSettings = namedtuple("DoorLockSettings", ["provider", "url", "auth"])
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_door_lock_settings() -> DoorLockSettings:
+    """Door lock part of Inn Hotels Setting, read from the cached single (cleared when the setting is saved)"""
+    setting = frappe.get_cached_doc("Inn Hotels Setting")
+    auth = (setting.card_api_user, setting.card_api_password) if cint(setting.card_use_auth) else None
+    return DoorLockSettings(setting.door_lock_api_provider, setting.card_api_url, auth)
+
+
+class CircuitBreaker:
+    """Open after `threshold` consecutive failures, then let a single trial call through
+    every `open_seconds` until one succeeds."""
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.open_seconds:
+                # half open, the other callers keep failing fast until the trial is done
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class DoorLockClient:
+    """Pooled session and circuit breaker of one provider"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.stripped_headers = STRIPPED_HEADERS.get(provider, ())
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def connections_opened(self, url: str) -> int:
+        """Number of connections opened so far by the pool serving `url`, unchanged when a pooled one is reused"""
+        return self.session.get_adapter(url).poolmanager.connection_from_url(url).num_connections
+
+    def request(self, operation: str, method: str, path: str = "", idempotent: bool = False, **kwargs):
+        """Send one request to the encoder API and return the response, None when the encoder can not be reached
+        or answers with an error (a message is shown to the user then).
+
+        Parameters
+        ----
+        operation : str
+            Name the latency is recorded under, e.g. "tesa_checkin"
+        method : str
+            HTTP method
+        path : str
+            Appended to card_api_url
+        idempotent : bool
+            Whether the request can be sent again after it may have reached the encoder. Requests encoding a card
+            are only retried when the connection could not be made, or when a reused keep-alive connection had
+            been closed by the encoder.
+        kwargs
+            json, data and headers of the request
+        """
+        settings = get_door_lock_settings()
+        if not settings.url:
+            frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+            return None
+
+        if not self.breaker.allow():
+            frappe.msgprint("Error. CardEncoder is not responding. Please wait a moment and try again.")
+            return None
+
+        prepped = self.session.prepare_request(requests.Request(method, settings.url + path, auth=settings.auth, **kwargs))
+        for header in self.stripped_headers:
+            prepped.headers.pop(header, None)
+
+        started = time.perf_counter()
+        attempt = 0
+        stale_connections = 0
+        while True:
+            response = None
+            opened = self.connections_opened(prepped.url)
+            try:
+                response = self.session.send(prepped, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if not is_not_connected(error) and is_connection_reset(error) \
+                        and self.connections_opened(prepped.url) == opened and stale_connections < POOL_SIZE:
+                    # an idle keep-alive socket closed by the encoder, sent again at once on a new connection
+                    stale_connections += 1
+                    continue
+                retry = idempotent or is_not_connected(error)
+            else:
+                retry = idempotent and response.status_code >= 500
+            if not retry or attempt >= MAX_RETRIES:
+                break
+            attempt += 1
+            time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+        record_latency(operation, (time.perf_counter() - started) * 1000, ok=response is not None and response.ok)
+        if response is None or response.status_code >= 500:
+            self.breaker.record_failure()
+            frappe.msgprint("Error. Fail to Connect to CardEncoder. Please wait a moment and try again.")
+            return None
+
+        self.breaker.record_success()
+        if not response.ok:
+            return None
+        return response
+
+
+def is_not_connected(error: Exception) -> bool:
+    """Whether the connection to the encoder could not be made (refused or timed out), the request was not sent"""
+    return isinstance(error, requests.ConnectTimeout) or any(
+        isinstance(cause, (NewConnectionError, ConnectTimeoutError, ConnectionRefusedError)) for cause in iter_causes(error))
+
+
+def is_connection_reset(error: Exception) -> bool:
+    """Whether the encoder closed the connection without answering"""
+    return any(isinstance(cause, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)) for cause in iter_causes(error))
+
+
+def iter_causes(error: Exception):
+    """The error and the exceptions it wraps: requests wraps the urllib3 error, which wraps the socket error"""
+    seen = set()
+    pending = [error]
+    while pending:
+        cause = pending.pop()
+        if not isinstance(cause, BaseException) or id(cause) in seen:
+            continue
+        seen.add(id(cause))
+        yield cause
+        pending.extend(cause.args)
+        pending.extend((getattr(cause, "reason", None), cause.__cause__, cause.__context__))
+
+
+def get_door_lock_client(provider: str = None) -> DoorLockClient:
+    """Client of the given provider, the one of Inn Hotels Setting by default, shared by the whole process"""
+    provider = provider or get_door_lock_settings().provider
+    client = _clients.get(provider)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = _clients[provider] = DoorLockClient(provider)
+    return client
+
+
+def record_latency(operation: str, elapsed_ms: float, ok: bool = True) -> None:
+    """Count one call in the latency histogram of `operation`"""
+    bucket = next((str(le) for le in LATENCY_BUCKETS_MS if elapsed_ms <= le), "inf")
+    key = frappe.cache().make_key(LATENCY_CACHE_KEY)
+    pipeline = frappe.cache().pipeline()
+    pipeline.hincrby(key, "{0}|{1}".format(operation, bucket), 1)
+    pipeline.hincrby(key, "{0}|count".format(operation), 1)
+    pipeline.hincrbyfloat(key, "{0}|sum_ms".format(operation), elapsed_ms)
+    if not ok:
+        pipeline.hincrby(key, "{0}|errors".format(operation), 1)
+    pipeline.execute()
+
+
+@frappe.whitelist()
+def get_door_lock_latency(reset=False) -> dict:
+    """Latency histogram of every door lock operation since the last reset:
+    {operation: {"count", "errors", "avg_ms", "buckets": {upper bound in ms: count}}}"""
+    frappe.only_for("System Manager")
+    # the counters are raw redis integers, not the pickled values hget/hgetall of frappe.cache() expect
+    key = frappe.cache().make_key(LATENCY_CACHE_KEY)
+    pipeline = frappe.cache().pipeline()
+    pipeline.hgetall(key)
+    if cint(reset):
+        pipeline.delete(key)
+    fields = pipeline.execute()[0]
+
+    histograms = {}
+    for field, value in fields.items():
+        operation, _, name = frappe.safe_decode(field).rpartition("|")
+        histogram = histograms.setdefault(operation, {"count": 0, "errors": 0, "sum_ms": 0.0, "buckets": {}})
+        if name in ("count", "errors"):
+            histogram[name] = int(value)
+        elif name == "sum_ms":
+            histogram[name] = float(value)
+        else:
+            histogram["buckets"][name] = int(value)
+
+    for histogram in histograms.values():
+        histogram["avg_ms"] = round(histogram.pop("sum_ms") / histogram["count"], 1) if histogram["count"] else 0
+        histogram["buckets"] = {le: histogram["buckets"].get(le, 0) for le in [str(le) for le in LATENCY_BUCKETS_MS] + ["inf"]}
+
+    return histograms
@@ -0,0 +1,137 @@
+"""Local stand-in for the TESA and DOWS card encoder APIs, to exercise inn.helper.door_lock
+without an encoder. Point card_api_url of Inn Hotels Setting at it, or start it from a test
+
+    server = start_mock_encoder("DOWS", latency=0.2, failure_rate=0.1)
+    ...
+    server.shutdown()
+
+It can also be run on its own
+
+    python -m inn.helper.door_lock_mock --provider TESA --port 8099 --latency 0.2
+
+It only depends on the standard library, card numbers are a counter of the server.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROVIDERS = ("TESA", "DOWS")
+
+
+def tesa_raw_message(card_number: str) -> str:
+    """rawMsgHex as returned by the TESA checkin, the card number is the field before the last B3 separator"""
+    return "B3".join(["02", "CI".encode().hex().upper(), card_number.encode().hex().upper(), "03"])
+
+
+class MockEncoderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # an idle keep-alive connection is closed by the server after idle_timeout seconds
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def reply(self, status: int, payload: dict = None) -> None:
+        content = json.dumps(payload or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle_call(self, method: str) -> None:
+        body = self.read_body() if method in ("POST", "PUT") else {}
+        server = self.server
+        server.requests.append((method, self.path, self.headers))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.failure_rate and random.random() < server.failure_rate:
+            return self.reply(503, {"error": "encoder busy"})
+
+        card_number = str(next(server.card_numbers))
+        path = self.path.rstrip("/")
+        if server.provider == "TESA" and method == "POST":
+            if path == "/checkin":
+                return self.reply(200, {"rawMsgHex": tesa_raw_message(card_number)})
+            if path in ("/verify", ""):
+                return self.reply(200, {"user": "MOCK", "expiryDate": "01/01/2030", "expiryTime": "12:00",
+                                        "info": "room {0}".format(body.get("room", "101")), "returnCardId": card_number})
+        elif server.provider == "DOWS":
+            if method == "POST" and path == "/checkin":
+                return self.reply(200, {"cardNo": card_number})
+            if method == "GET" and path == "/verify":
+                return self.reply(200, {"room": "0101", "departure": "2030-01-01 12:00:00"})
+            if method == "DELETE" and path.startswith("/erase/"):
+                return self.reply(200, {"cardNo": card_number})
+        self.reply(404, {"error": "unknown endpoint"})
+
+    def do_GET(self):
+        self.handle_call("GET")
+
+    def do_POST(self):
+        self.handle_call("POST")
+
+    def do_DELETE(self):
+        self.handle_call("DELETE")
+
+
+class MockEncoderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, provider: str, port: int = 0, latency: float = 0, failure_rate: float = 0, verbose: bool = False,
+                 idle_timeout: float = None):
+        if provider not in PROVIDERS:
+            raise ValueError("provider must be one of {0}".format(", ".join(PROVIDERS)))
+        super().__init__(("127.0.0.1", port), MockEncoderHandler)
+        self.provider = provider
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.idle_timeout = idle_timeout
+        self.card_numbers = itertools.count(1000)
+        # (method, path, headers) of every request received
+        self.requests = []
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{0}".format(self.server_address[1])
+
+
+def start_mock_encoder(provider: str, port: int = 0, latency: float = 0, failure_rate: float = 0,
+                       idle_timeout: float = None) -> MockEncoderServer:
+    """Serve the mock encoder from a daemon thread, port 0 picks a free port (see server.url)"""
+    server = MockEncoderServer(provider, port, latency, failure_rate, idle_timeout=idle_timeout)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--provider", choices=PROVIDERS, default="TESA")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0, help="seconds slept before every answer")
+    parser.add_argument("--failure-rate", type=float, default=0, help="share of calls answered with 503")
+    args = parser.parse_args()
+
+    server = MockEncoderServer(args.provider, args.port, args.latency, args.failure_rate, verbose=True)
+    print("mock {0} encoder on {1}".format(args.provider, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,37 @@
+import csv
+from io import TextIOWrapper
+from tempfile import SpooledTemporaryFile
+
+import frappe
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+# exports larger than this go to disk instead of memory
+EXPORT_SPOOL_SIZE = 4 * 1024 * 1024
+
+
+def spooled_file() -> SpooledTemporaryFile:
+    """Temporary file an export is written into, kept in memory up to EXPORT_SPOOL_SIZE"""
+    return SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+
+
+def send_spooled_file(content: SpooledTemporaryFile, filename: str, mimetype: str) -> Response:
+    """Stream a spooled export to the client as an attachment"""
+    content.seek(0)
+    return Response(wrap_file(frappe.local.request.environ, content), mimetype=mimetype, direct_passthrough=True,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def stream_csv(filename: str, header: list, rows) -> Response:
+    """Write `rows` as they are produced into a spooled CSV file, then stream it to the client.
+
+    The rows are consumed before returning: the database connection is closed by the time the response is sent.
+    """
+    content = spooled_file()
+    text = TextIOWrapper(content, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(header)
+    writer.writerows(rows)
+    text.flush()
+    text.detach()
+    return send_spooled_file(content, filename, "text/csv")
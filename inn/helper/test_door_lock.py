@@ -0,0 +1,132 @@
+import socket
+import time
+import unittest
+from unittest.mock import patch
+
+import requests
+
+from inn.helper import door_lock
+from inn.helper.door_lock import DoorLockClient, DoorLockSettings
+from inn.helper.door_lock_mock import start_mock_encoder
+
+
+def get_closed_port() -> int:
+    """A local port nothing listens on, connecting to it is refused"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestDoorLockClient(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.patches = [
+            patch.object(door_lock, "BACKOFF_SECONDS", 0),
+            patch.object(door_lock, "record_latency"),
+            patch("frappe.msgprint"),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        for server in self.servers:
+            server.shutdown()
+
+    def client(self, provider: str = "DOWS", url: str = None, **server_options) -> DoorLockClient:
+        if url is None:
+            server = start_mock_encoder(provider, **server_options)
+            self.servers.append(server)
+            url = server.url
+        settings_patch = patch.object(door_lock, "get_door_lock_settings", return_value=DoorLockSettings(provider, url, None))
+        settings_patch.start()
+        self.patches.append(settings_patch)
+        return DoorLockClient(provider)
+
+    def test_refused_connection_is_retried_when_not_idempotent(self):
+        client = self.client(url="http://127.0.0.1:{0}".format(get_closed_port()))
+        with patch.object(client.session, "send", wraps=client.session.send) as send:
+            self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertEqual(send.call_count, door_lock.MAX_RETRIES + 1)
+
+    def test_connect_timeout_is_retried_when_not_idempotent(self):
+        client = self.client()
+        with patch.object(client.session, "send", side_effect=requests.ConnectTimeout()) as send:
+            self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertEqual(send.call_count, door_lock.MAX_RETRIES + 1)
+        self.assertEqual(self.servers[0].requests, [])
+
+    def test_read_timeout_is_only_retried_when_idempotent(self):
+        client = self.client(latency=0.5)
+        with patch.object(door_lock, "READ_TIMEOUT", 0.1):
+            self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+            self.assertEqual(len(self.servers[0].requests), 1)
+
+            self.assertIsNone(client.request("dows_verify", "GET", "/verify", idempotent=True))
+            self.assertEqual(len(self.servers[0].requests), 1 + door_lock.MAX_RETRIES + 1)
+
+    def test_server_error_is_only_retried_when_idempotent(self):
+        client = self.client(failure_rate=1)
+        self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertEqual(len(self.servers[0].requests), 1)
+
+        self.assertIsNone(client.request("dows_verify", "GET", "/verify", idempotent=True))
+        self.assertEqual(len(self.servers[0].requests), 1 + door_lock.MAX_RETRIES + 1)
+
+    def test_stale_keep_alive_connection_is_sent_again(self):
+        client = self.client(idle_timeout=0.1)
+        self.assertIsNotNone(client.request("dows_verify", "GET", "/verify", idempotent=True))
+        time.sleep(0.3)
+
+        # the socket closed by the encoder is taken from the pool as if it was still open
+        with patch("urllib3.connectionpool.is_connection_dropped", return_value=False):
+            response = client.request("dows_checkin", "POST", "/checkin", json={})
+        self.assertIsNotNone(response)
+        self.assertEqual(response.json(), {"cardNo": "1001"})
+        self.assertEqual([method for method, path, headers in self.servers[0].requests], ["GET", "POST"])
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        client = self.client(failure_rate=1)
+        for i in range(door_lock.CIRCUIT_FAILURE_THRESHOLD):
+            self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertEqual(len(self.servers[0].requests), door_lock.CIRCUIT_FAILURE_THRESHOLD)
+
+        # open, the encoder is not called at all
+        self.assertIsNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertEqual(len(self.servers[0].requests), door_lock.CIRCUIT_FAILURE_THRESHOLD)
+
+    def test_circuit_half_opens_after_open_seconds(self):
+        client = self.client(failure_rate=1)
+        for i in range(door_lock.CIRCUIT_FAILURE_THRESHOLD):
+            client.request("dows_checkin", "POST", "/checkin", json={})
+        self.servers[0].failure_rate = 0
+
+        opened_at = client.breaker.opened_at
+        with patch("time.monotonic", return_value=opened_at + door_lock.CIRCUIT_OPEN_SECONDS - 1):
+            self.assertFalse(client.breaker.allow())
+        with patch("time.monotonic", return_value=opened_at + door_lock.CIRCUIT_OPEN_SECONDS):
+            # a single trial call goes through, the others keep failing fast until it is done
+            self.assertTrue(client.breaker.allow())
+            self.assertFalse(client.breaker.allow())
+
+        client.breaker.opened_at = time.monotonic() - door_lock.CIRCUIT_OPEN_SECONDS
+        self.assertIsNotNone(client.request("dows_checkin", "POST", "/checkin", json={}))
+        self.assertIsNone(client.breaker.opened_at)
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_dows_default_headers_are_stripped(self):
+        client = self.client("DOWS")
+        client.request("dows_verify", "GET", "/verify", idempotent=True)
+        headers = self.servers[0].requests[0][2]
+        self.assertNotIn("Accept", headers)
+        self.assertNotIn("Connection", headers)
+        self.assertNotIn("gzip", headers.get("Accept-Encoding", ""))
+
+    def test_tesa_keeps_default_headers(self):
+        client = self.client("TESA")
+        client.request("tesa_verify", "POST", "/verify", idempotent=True, json={})
+        headers = self.servers[0].requests[0][2]
+        self.assertEqual(headers.get("Accept"), "*/*")
+        self.assertIn("gzip", headers.get("Accept-Encoding", ""))
@@ -103,6 +103,16 @@ doc_events = {
 	"Inn Folio Transaction": {
 		"validate": "inn.inn_hotels.doctype.inn_folio_transaction.inn_folio_transaction.add_audit_date"
 	},
+	"GL Entry": {
+		"on_submit": "inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance.mark_gl_month_dirty",
+		"on_cancel": "inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance.mark_gl_month_dirty",
+		"on_trash": "inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance.mark_gl_month_dirty"
+	},
+	"Account": {
+		"on_update": "inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close_helper.clear_account_type_cache",
+		"on_trash": "inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close_helper.clear_account_type_cache",
+		"after_rename": "inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close_helper.clear_account_type_cache"
+	},
 }
 
 # Scheduled Tasks
@@ -118,6 +128,14 @@ scheduler_events = {
 # 	"hourly": [
 # 		"inn.tasks.hourly"
 # 	],
+	"hourly": [
+		"inn.inn_hotels.doctype.inn_folio.inn_folio.reconcile_open_folio_balances"
+	],
+	"cron": {
+		"*/5 * * * *": [
+			"inn.inn_hotels.doctype.inn_key_card_job.inn_key_card_job.sweep_key_card_jobs"
+		]
+	},
 	"weekly": [
 		"inn.inn_hotels.doctype.inn_hotels_setting.inn_hotels_setting.generate_supervisor_passcode"
 	]
@@ -5,14 +5,39 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from frappe.utils import getdate
+
+LAST_AUDIT_DATE_CACHE_KEY = 'inn_last_audit_date'
 
 class InnAuditLog(Document):
-	pass
+	# the cached audit date only moves once the change is committed, a rolled back dayend must not publish it
+	def on_update(self):
+		frappe.db.after_commit.add(refresh_last_audit_date)
+
+	def on_trash(self):
+		frappe.db.after_commit.add(refresh_last_audit_date)
 
 @frappe.whitelist()
 def get_last_audit_date():
-	d = frappe.get_all('Inn Audit Log', order_by='creation desc', limit_page_length=1)
+	audit_date = frappe.cache().get_value(LAST_AUDIT_DATE_CACHE_KEY)
+	if audit_date:
+		return getdate(audit_date)
+	return refresh_last_audit_date()
+
+def query_last_audit_date():
+	d = frappe.get_all('Inn Audit Log', fields=['audit_date'], order_by='creation desc', limit_page_length=1)
 	if d:
-		return frappe.get_doc('Inn Audit Log', d[0].name).audit_date
+		return d[0].audit_date
 	else:
-		return None
\ No newline at end of file
+		return None
+
+def refresh_last_audit_date():
+	audit_date = query_last_audit_date()
+	if audit_date:
+		frappe.cache().set_value(LAST_AUDIT_DATE_CACHE_KEY, str(audit_date))
+	else:
+		clear_last_audit_date_cache()
+	return audit_date
+
+def clear_last_audit_date_cache():
+	frappe.cache().delete_value(LAST_AUDIT_DATE_CACHE_KEY)
\ No newline at end of file
@@ -5,9 +5,24 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from inn.helper.cache import VersionedCache
+
+# profit sharing rule of every Inn Channel, the only fields commission calculation needs
+CHANNEL_FIELDS = ['name', 'profit_sharing', 'sharing_type', 'profit_sharing_amount']
+
+CHANNEL_CACHE_KEY = 'inn_channel_commission'
+_channel_cache = VersionedCache(CHANNEL_CACHE_KEY)
 
 class InnChannel(Document):
-	pass
+	def on_update(self):
+		clear_channel_cache(self.name)
+
+	def on_trash(self):
+		clear_channel_cache(self.name)
+
+	def after_rename(self, old, new, merge=False):
+		clear_channel_cache(old)
+		clear_channel_cache(new)
 
 
 PROFIT_SHARING_ENABLED = 1
@@ -16,7 +31,25 @@ PROFIT_SHARING_DISABLED = 0
 PROFIT_SHARING_TYPE_PERCENTAGE = "Percentage"
 PROFIT_SHARING_TYPE_FLAT = "Flat"
 
-def check_channel_commission(reservation_doc, room_rate = None, reservation_price: int = None) -> Document:
+def get_channel(channel_name):
+	return get_channels([channel_name]).get(channel_name)
+
+def get_channels(channel_names):
+	'''
+	:param channel_names list of Inn Channel name
+	:return dict of Inn Channel name to row with CHANNEL_FIELDS, unknown channels are left out
+
+	rules are looked up in the process local cache, then redis, and the remaining ones are loaded with a single query.
+	'''
+	return _channel_cache.get_many([channel_name for channel_name in channel_names if channel_name], load_channels)
+
+def load_channels(channel_names):
+	return {channel.name: channel for channel in frappe.get_all('Inn Channel', filters={'name': ['in', channel_names]}, fields=CHANNEL_FIELDS)}
+
+def clear_channel_cache(channel_name=None):
+	_channel_cache.invalidate(channel_name)
+
+def check_channel_commission(reservation_doc, room_rate = None, reservation_price: int = None) -> frappe._dict:
 	'''
 	:param reservation_doc to get channel_name and actual_room_rate
 	:param reservation_price if document is not saved yet and want to update the price (case happen when in Check In Process or when you want to change room with different price)
@@ -28,37 +61,88 @@ def check_channel_commission(reservation_doc, room_rate = None, reservation_pric
 
 	'''
 
-	channel_doc = frappe.get_doc("Inn Channel", reservation_doc.channel)
-	if channel_doc == None:
+	channel = get_channel(reservation_doc.channel)
+	if channel == None:
 		raise NameError("no channel with such name")
-	
-	if channel_doc.profit_sharing == PROFIT_SHARING_DISABLED:
-		return channel_doc
-	
-	if channel_doc.sharing_type == PROFIT_SHARING_TYPE_FLAT:
-		room_cashback = channel_doc.profit_sharing_amount
-		channel_doc.room_cashback = room_cashback
-		channel_doc.breakfast_cashback = 0
-
-	elif channel_doc.sharing_type == PROFIT_SHARING_TYPE_PERCENTAGE:
-		if room_rate == None:
-			room_rate = frappe.get_doc("Inn Room Rate", reservation_doc.room_rate)
-
-		if reservation_price:
-			room_price = reservation_price
-		else:
-			room_price = reservation_doc.actual_room_rate
-			if room_price == 0:
-				room_price = reservation_doc.init_actual_room_rate
-   
-		room_cashback = (room_price - room_rate.final_breakfast_rate_amount) * channel_doc.profit_sharing_amount / 100
-		channel_doc.room_cashback = room_cashback
-		
-		breakfast_cashback = room_rate.final_breakfast_rate_amount * channel_doc.profit_sharing_amount /100
-		channel_doc.breakfast_cashback = breakfast_cashback
-	
+	# copy, the cached rule is shared with every other caller
+	channel = frappe._dict(channel)
+
+	if channel.profit_sharing == PROFIT_SHARING_DISABLED:
+		return channel
+
+	if channel.sharing_type == PROFIT_SHARING_TYPE_PERCENTAGE and room_rate == None:
+		from inn.inn_hotels.doctype.inn_room_rate.inn_room_rate import get_room_rate_plan
+		room_rate = get_room_rate_plan(reservation_doc.room_rate)
+
+	channel.room_cashback, channel.breakfast_cashback = calculate_channel_cashback(
+		channel, room_rate, get_reservation_price(reservation_doc, reservation_price))
+
+	return channel
+
+def get_reservation_price(reservation, reservation_price=None):
+	# price the commission is calculated on: the given price, else the actual room rate, else the initial one
+	if reservation_price:
+		return reservation_price
+	return reservation.actual_room_rate or reservation.init_actual_room_rate
+
+def calculate_channel_cashback(channel, room_rate, room_price) -> tuple[float, float]:
+	'''
+	:param channel Inn Channel doc or row with profit_sharing, sharing_type and profit_sharing_amount
+	:param room_rate Inn Room Rate doc or row with final_breakfast_rate_amount, only used by percentage sharing
+	:param room_price price paid for the room (including breakfast)
+	:return (room_cashback, breakfast_cashback)
+
+	same calculation as check_channel_commission, without touching the database.
+	'''
+	if channel.profit_sharing == PROFIT_SHARING_DISABLED:
+		return 0, 0
+
+	if channel.sharing_type == PROFIT_SHARING_TYPE_FLAT:
+		return channel.profit_sharing_amount, 0
+
+	elif channel.sharing_type == PROFIT_SHARING_TYPE_PERCENTAGE:
+		room_cashback = (room_price - room_rate.final_breakfast_rate_amount) * channel.profit_sharing_amount / 100
+		breakfast_cashback = room_rate.final_breakfast_rate_amount * channel.profit_sharing_amount /100
+		return room_cashback, breakfast_cashback
+
 	else:
 		raise NotImplementedError("other than percentage profit sharing is not implemented yet")
 
+def calculate_reservation_cashbacks(reservations) -> dict:
+	'''
+	:param reservations list of Inn Reservation rows with name, channel, room_rate, actual_room_rate and init_actual_room_rate
+	:return dict of reservation name to (room_cashback, breakfast_cashback)
+
+	batch form of check_channel_commission: channel rules and room rates are resolved once per distinct value.
+	'''
+	from inn.inn_hotels.doctype.inn_room_rate.inn_room_rate import get_room_rate_plan
+
+	channels = get_channels([r.channel for r in reservations])
+	room_rates = {}
+	cashbacks = {}
+	for reservation in reservations:
+		channel = channels.get(reservation.channel)
+		if channel is None:
+			raise NameError("no channel with such name")
+		room_rate = None
+		if channel.profit_sharing != PROFIT_SHARING_DISABLED and channel.sharing_type == PROFIT_SHARING_TYPE_PERCENTAGE:
+			if reservation.room_rate not in room_rates:
+				room_rates[reservation.room_rate] = get_room_rate_plan(reservation.room_rate)
+			room_rate = room_rates[reservation.room_rate]
+		cashbacks[reservation.name] = calculate_channel_cashback(channel, room_rate, get_reservation_price(reservation))
 
-	return channel_doc
\ No newline at end of file
+	return cashbacks
+
+@frappe.whitelist()
+def get_channel_cashbacks(reservation_ids):
+	'''
+	:param reservation_ids list (or JSON list) of Inn Reservation name
+	:return dict of reservation name to (room_cashback, breakfast_cashback), from one query on Inn Reservation
+	'''
+	reservation_ids = frappe.parse_json(reservation_ids)
+	if not reservation_ids:
+		return {}
+	frappe.has_permission('Inn Reservation', throw=True)
+	reservations = frappe.get_all('Inn Reservation', filters={'name': ['in', reservation_ids]},
+								  fields=['name', 'channel', 'room_rate', 'actual_room_rate', 'init_actual_room_rate'])
+	return calculate_reservation_cashbacks(reservations)
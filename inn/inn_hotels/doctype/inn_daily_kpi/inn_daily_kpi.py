@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and contributors
+# For license information, please see license.txt
+
+'''
+Inn Daily KPI is the daily fact table of the Daily Flash Report: one row per (date, kpi_type, kpi_key) holding
+the value of that day. Rows of a day are written by the dayend close of that day, days not closed yet are computed
+on the fly by get_daily_kpi.
+
+kpi_type Room: room nights per 'Total Room Out of Order', 'Total Room House Use', '<Room Type> Sold',
+	'<Room Type> Reserved', 'Total Day Use', 'Total In House', 'Total Walk In' and 'In House Room Rate' (sum of rate)
+kpi_type Revenue: credit - debit of GL Entry per account number (first 8 characters of the account)
+kpi_type Payment: amount of Credit Inn Folio Transaction per mode of payment
+'''
+
+from __future__ import unicode_literals
+import frappe
+from datetime import timedelta
+from frappe.model.document import Document
+from frappe.utils import getdate, flt
+from inn.helper.bulk import bulk_insert_docs
+
+KPI_FIELDS = ['date', 'kpi_type', 'kpi_key', 'value']
+
+class InnDailyKPI(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index('Inn Daily KPI', ['date', 'kpi_type'])
+
+def compute_daily_kpi(from_date, to_date):
+	'''
+	:return dict of (date, kpi_type, kpi_key) to value for every day in [from_date, to_date]
+	'''
+	from_date = getdate(from_date)
+	to_date = getdate(to_date)
+	kpi = {}
+
+	def add(date, kpi_type, kpi_key, value):
+		kpi[(date, kpi_type, kpi_key)] = kpi.get((date, kpi_type, kpi_key), 0) + value
+
+	room_nights = frappe.db.sql("""
+		select irn.date, irn.room_availability, irn.status, r.room_type, count(*) as nights
+		from `tabInn Room Night` as irn
+		left join `tabInn Room` as r on r.name = irn.room_id
+		where irn.date between %s and %s
+		group by irn.date, irn.room_availability, irn.status, r.room_type
+	""", (from_date, to_date), as_dict=True)
+	for rn in room_nights:
+		if rn.room_availability in ('Out of Order', 'House Use'):
+			add(rn.date, 'Room', 'Total Room ' + rn.room_availability, rn.nights)
+		elif rn.room_availability == 'Room Sold' and rn.status in ('Stayed', 'Finished'):
+			add(rn.date, 'Room', '{0} Sold'.format(rn.room_type), rn.nights)
+		elif rn.room_availability == 'Room Sold' and rn.status == 'Booked':
+			add(rn.date, 'Room', '{0} Reserved'.format(rn.room_type), rn.nights)
+
+	day_use = frappe.db.sql("""
+		select date(arrival) as date, count(*) as reservations
+		from `tabInn Reservation`
+		where date(arrival) = date(departure) and date(arrival) between %s and %s
+		group by date(arrival)
+	""", (from_date, to_date), as_dict=True)
+	for du in day_use:
+		add(du.date, 'Room', 'Total Day Use', du.reservations)
+
+	# only the reservations in house overlap many nights, expanding them stays small
+	in_house = frappe.db.sql("""
+		select date(arrival) as arrival, date(departure) as departure, channel, actual_room_rate
+		from `tabInn Reservation`
+		where status = 'In House' and date(departure) > %s and date(arrival) <= %s
+	""", (from_date, to_date), as_dict=True)
+	for r in in_house:
+		date = max(r.arrival, from_date)
+		while date < r.departure and date <= to_date:
+			add(date, 'Room', 'Total In House', 1)
+			add(date, 'Room', 'In House Room Rate', flt(r.actual_room_rate))
+			if r.channel == 'Walk In':
+				add(date, 'Room', 'Total Walk In', 1)
+			date = date + timedelta(days=1)
+
+	revenue = frappe.db.sql("""
+		select posting_date as date, left(account, 8) as account, sum(credit) - sum(debit) as amount
+		from `tabGL Entry`
+		where posting_date between %s and %s
+		group by posting_date, left(account, 8)
+	""", (from_date, to_date), as_dict=True)
+	for rv in revenue:
+		add(rv.date, 'Revenue', rv.account, flt(rv.amount))
+
+	payment = frappe.db.sql("""
+		select audit_date as date, mode_of_payment, sum(amount) as amount
+		from `tabInn Folio Transaction`
+		where flag = 'Credit' and audit_date between %s and %s and ifnull(mode_of_payment, '') != ''
+		group by audit_date, mode_of_payment
+	""", (from_date, to_date), as_dict=True)
+	for py in payment:
+		add(py.date, 'Payment', py.mode_of_payment, flt(py.amount))
+
+	return kpi
+
+def update_daily_kpi(from_date, to_date=None):
+	# (re)write the fact rows of every day in [from_date, to_date]
+	from_date = getdate(from_date)
+	to_date = getdate(to_date or from_date)
+	kpi = compute_daily_kpi(from_date, to_date)
+
+	frappe.db.sql("delete from `tabInn Daily KPI` where date between %s and %s", (from_date, to_date))
+	rows = [{
+		'name': frappe.generate_hash(length=10),
+		'date': date,
+		'kpi_type': kpi_type,
+		'kpi_key': kpi_key,
+		'value': value,
+	} for (date, kpi_type, kpi_key), value in kpi.items()]
+	bulk_insert_docs('Inn Daily KPI', KPI_FIELDS, rows)
+
+def backfill_daily_kpi(from_date, to_date, batch_days=31):
+	'''
+	rebuild the fact rows of historical days, one batch of days per transaction.
+	:return number of days rebuilt
+	'''
+	from_date = getdate(from_date)
+	to_date = getdate(to_date)
+	date = from_date
+	while date <= to_date:
+		batch_end = min(date + timedelta(days=batch_days - 1), to_date)
+		update_daily_kpi(date, batch_end)
+		frappe.db.commit()
+		date = batch_end + timedelta(days=1)
+
+	return (to_date - from_date).days + 1
+
+def get_daily_kpi(from_date, to_date):
+	'''
+	:return dict of (date, kpi_type, kpi_key) to value for every day in [from_date, to_date],
+	stored facts for days already closed by the dayend, computed for every day without stored facts
+	'''
+	from_date = getdate(from_date)
+	to_date = getdate(to_date)
+
+	kpi = {}
+	for row in frappe.db.sql("""
+		select date, kpi_type, kpi_key, value from `tabInn Daily KPI` where date between %s and %s
+	""", (from_date, to_date), as_dict=True):
+		kpi[(row.date, row.kpi_type, row.kpi_key)] = row.value
+
+	# days without any stored fact (not closed yet, or closed before the facts existed) are computed, one query set per run of days
+	stored_dates = set(date for date, kpi_type, kpi_key in kpi)
+	run_start = None
+	date = from_date
+	while date <= to_date + timedelta(days=1):
+		if date <= to_date and date not in stored_dates:
+			run_start = run_start or date
+		elif run_start:
+			kpi.update(compute_daily_kpi(run_start, date - timedelta(days=1)))
+			run_start = None
+		date = date + timedelta(days=1)
+
+	return kpi
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from unittest.mock import patch
+from frappe.utils import flt, getdate
+
+from inn.helper.bulk import bulk_insert_docs
+from inn.inn_hotels.doctype.inn_daily_kpi import inn_daily_kpi
+from inn.inn_hotels.doctype.inn_room_night.inn_room_night import ROOM_NIGHT_FIELDS
+
+KPI_DATE = '2031-05-10'
+
+class TestInnDailyKPI(unittest.TestCase):
+	def setUp(self):
+		self.rooms = frappe.get_all('Inn Room', pluck='name', limit=3)
+		self.accounts = frappe.get_all('Account', filters={'is_group': 0}, pluck='name', limit=2)
+		if not self.rooms or not self.accounts:
+			self.skipTest("needs Inn Room and Account")
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def seed(self):
+		nights = [('Room Sold', 'Stayed'), ('Room Sold', 'Booked'), ('House Use', 'Booked')]
+		bulk_insert_docs('Inn Room Night', ROOM_NIGHT_FIELDS, [{
+			'name': frappe.generate_hash(length=10),
+			'room_id': self.rooms[index % len(self.rooms)],
+			'date': KPI_DATE,
+			'room_availability': room_availability,
+			'status': status,
+			'room_booking': frappe.generate_hash(length=10),
+		} for index, (room_availability, status) in enumerate(nights)])
+
+		bulk_insert_docs('Inn Reservation', ['status', 'arrival', 'departure', 'channel', 'actual_room_rate'], [{
+			'name': frappe.generate_hash(length=10),
+			'status': status,
+			'arrival': arrival,
+			'departure': departure,
+			'channel': channel,
+			'actual_room_rate': actual_room_rate,
+		} for status, arrival, departure, channel, actual_room_rate in (
+			('In House', '2031-05-09 14:00:00', '2031-05-12 12:00:00', 'Walk In', 450000),
+			('In House', '2031-05-10 14:00:00', '2031-05-11 12:00:00', None, 325000.5),
+			('Finish', '2031-05-10 08:00:00', '2031-05-10 17:00:00', None, 150000),
+		)])
+
+		bulk_insert_docs('GL Entry', ['posting_date', 'fiscal_year', 'account', 'debit', 'credit'], [{
+			'name': frappe.generate_hash(length=10),
+			'posting_date': KPI_DATE,
+			'fiscal_year': '2031',
+			'account': account,
+			'debit': 1000.25 * index,
+			'credit': 5000.5,
+		} for index, account in enumerate(self.accounts)])
+
+		bulk_insert_docs('Inn Folio Transaction', ['parent', 'parenttype', 'parentfield', 'flag', 'amount',
+												   'mode_of_payment', 'audit_date'], [{
+			'name': frappe.generate_hash(length=10),
+			'parent': frappe.generate_hash(length=10),
+			'parenttype': 'Inn Folio',
+			'parentfield': 'folio_transaction',
+			'flag': 'Credit',
+			'amount': amount,
+			'mode_of_payment': 'Cash',
+			'audit_date': KPI_DATE,
+		} for amount in (200000, 125000.75)])
+
+	def facts(self, kpi):
+		return {key: flt(value, 2) for key, value in kpi.items()}
+
+	def test_stored_facts_match_computed_facts(self):
+		self.seed()
+		computed = self.facts(inn_daily_kpi.get_daily_kpi(KPI_DATE, KPI_DATE))
+		self.assertIn((getdate(KPI_DATE), 'Room', 'Total In House'), computed)
+		self.assertEqual(computed, self.facts(inn_daily_kpi.compute_daily_kpi(KPI_DATE, KPI_DATE)))
+
+		# once the day is closed the stored facts are read, nothing is computed again
+		inn_daily_kpi.update_daily_kpi(KPI_DATE)
+		with patch.object(inn_daily_kpi, 'compute_daily_kpi', side_effect=AssertionError("closed day computed again")):
+			stored = self.facts(inn_daily_kpi.get_daily_kpi(KPI_DATE, KPI_DATE))
+
+		self.assertEqual(stored, computed)
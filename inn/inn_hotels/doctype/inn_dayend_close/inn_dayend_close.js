@@ -11,6 +11,7 @@ frappe.ui.form.on('Inn Dayend Close', {
 		frm.get_field("closed_today").grid.only_sortable();
 	},
 	refresh: function (frm) {
+		listen_dayend_close_progress(frm);
 		if (frm.doc.__islocal === 1) {
 			frappe.call({
 				method: 'inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close.is_there_open_dayend_close',
@@ -102,25 +103,26 @@ function populate_child(frm) {
 						// frm.refresh_field('resto_order_finished_today');
 
 						frappe.call({
-							method: 'inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting.is_there_open_room_charge_posting',
+							method: 'inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close.get_dayend_readiness',
 							callback: (resp) => {
-								if (resp.message === 1) {
-									posting_still_open = true;
-								}
-								else {
-									posting_still_open = false;
-								}
+								let readiness = resp.message;
+								posting_still_open = readiness.open_room_charge_postings.length > 0;
+								show_dayend_readiness(frm, readiness);
 
-								if (r.message[0].length > 0 || r.message[1].length > 0 || r.message[2].length > 0) {
+								if (r.message[0].length > 0 || r.message[1].length > 0 || r.message[2].length > 0 || readiness.pending_void_requests.length > 0) {
 									show_button = false;
 								}
 								else {
 									show_button = true;
 								}
 
-								if (show_button && !posting_still_open) {
+								if (frm.doc.job_status === 'Queued' || frm.doc.job_status === 'Running') {
+									frm.set_intro(__("Dayend Close is being processed in the background."));
+								}
+								else if (show_button && !posting_still_open) {
 									if (frm.doc.__islocal !== 1) {
-										frm.add_custom_button(__('Process Dayend Close'), function () {
+										let button_label = frm.doc.job_status === 'Failed' ? __('Resume Dayend Close') : __('Process Dayend Close');
+										frm.add_custom_button(button_label, function () {
 											frappe.confirm(__("You are about to Close the day, Are you sure?"), function () {
 												frappe.call({
 													method: 'inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close.process_dayend_close',
@@ -128,9 +130,9 @@ function populate_child(frm) {
 														doc_id: frm.doc.name
 													},
 													callback: (response) => {
-														if (response.message === 'Closed') {
+														if (response.message === 'Queued') {
+															frappe.show_alert(__('Dayend Close queued.'));
 															frm.reload_doc();
-															frappe.msgprint('Day ' + frm.doc.audit_date + ' Closed');
 														}
 														else {
 															frappe.msgprint(response.message);
@@ -146,6 +148,9 @@ function populate_child(frm) {
 										frm.set_intro(__("There are still Room Charge Posting still Open, Close it First. " +
 											"Resolve the Reservation's and Folio's status before processing the Dayend Close"));
 									}
+									else if (readiness.pending_void_requests.length > 0) {
+										frm.set_intro(__("There are transaction requested to be voided not yet responded. Please resolve the request first."));
+									}
 									else {
 										frm.set_intro(__("Resolve the Reservation's and Folio's status before processing the Dayend Close"));
 									}
@@ -160,6 +165,29 @@ function populate_child(frm) {
 	});
 }
 
+function show_dayend_readiness(frm, readiness) {
+	// blockers and warnings of the dayend close, listed on the form dashboard
+	frm.dashboard.clear_headline();
+	let lines = [];
+	if (readiness.pending_void_requests.length > 0) {
+		lines.push(__('{0} void request(s) not responded: {1}', [readiness.pending_void_requests.length,
+			[...new Set(readiness.pending_void_requests.map(d => d.folio))].join(', ')]));
+	}
+	if (readiness.open_room_charge_postings.length > 0) {
+		lines.push(__('Open Room Charge Posting: {0}', [readiness.open_room_charge_postings.join(', ')]));
+	}
+	if (readiness.unposted_rooms.length > 0) {
+		lines.push(__('{0} In House room(s) without Room Charge: {1}', [readiness.unposted_rooms.length,
+			readiness.unposted_rooms.map(d => d.room_id).join(', ')]));
+	}
+	if (readiness.open_shifts.length > 0) {
+		lines.push(__('Open Shift: {0}', [readiness.open_shifts.map(d => d.name + ' (' + d.username + ')').join(', ')]));
+	}
+	if (lines.length > 0) {
+		frm.dashboard.set_headline_alert(lines.join('<br>'), readiness.ready ? 'orange' : 'red');
+	}
+}
+
 function set_audit_date(frm) {
 	frappe.call({
 		method: 'inn.inn_hotels.doctype.inn_audit_log.inn_audit_log.get_last_audit_date',
@@ -171,4 +199,30 @@ function set_audit_date(frm) {
 			}
 		}
 	});
-}
\ No newline at end of file
+}
+
+function listen_dayend_close_progress(frm) {
+	if (frm.dayend_close_progress_listener) {
+		return;
+	}
+	frm.dayend_close_progress_listener = true;
+	frappe.realtime.on('inn_dayend_close_progress', (data) => {
+		if (data.doc_id !== frm.doc.name) {
+			return;
+		}
+		if (data.phase === 'Completed') {
+			frm.dashboard.hide_progress();
+			frm.reload_doc();
+			frappe.msgprint('Day ' + frm.doc.audit_date + ' Closed');
+		}
+		else if (data.phase === 'Failed') {
+			frm.dashboard.hide_progress();
+			frm.reload_doc();
+			frappe.msgprint(__('Dayend Close failed, resolve the error and Resume it.'));
+		}
+		else {
+			frm.dashboard.show_progress(__('Dayend Close: {0}', [data.phase]), data.total ? data.progress * 100 / data.total : 0,
+				data.progress + ' / ' + data.total);
+		}
+	});
+}
@@ -7,9 +7,13 @@ from __future__ import unicode_literals
 import frappe
 import datetime
 from frappe.model.document import Document
+from frappe.utils import flt
 from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
-from inn.inn_hotels.doctype.inn_folio.inn_folio import check_void_request
-from inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close_helper import _fill_party_account
+from inn.inn_hotels.doctype.inn_folio.inn_folio import get_pending_void_requests
+from inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting import populate_tobe_posted
+from inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close_helper import _fill_party_account, PartyAccountResolver
+from inn.inn_hotels.doctype.inn_daily_kpi.inn_daily_kpi import update_daily_kpi
+from inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance import update_gl_monthly_balance
 
 class InnDayendClose(Document):
 	pass
@@ -21,159 +25,289 @@ def is_there_open_dayend_close():
 	else:
 		return 2
 
+DAYEND_CLOSE_PROGRESS_EVENT = 'inn_dayend_close_progress'
+
 @frappe.whitelist()
 def process_dayend_close(doc_id):
-	need_resolve_flag = False
+	"""
+	check the day can be closed, then hand the closing over to a background job (run_dayend_close).
+	calling it again on a Failed job resumes from the last checkpoint.
+	"""
+	status, job_status = frappe.db.get_value('Inn Dayend Close', doc_id, ['status', 'job_status'])
+	if status == 'Closed' or job_status == 'Completed':
+		return "Dayend Close is already closed."
+	# a worker killed by RQ (timeout, restart) leaves the job Running without any exception, it is resumed then
+	if job_status in ('Queued', 'Running') and is_dayend_close_job_alive(doc_id):
+		return "Dayend Close is already being processed."
+
+	# every folio the dayend close journals must be free of unanswered void request
+	if get_pending_void_requests():
+		return "There are transaction requested to be voided not yet responded. Please resolve the request first."
+	else:
+		frappe.db.set_value('Inn Dayend Close', doc_id, {'job_status': 'Queued', 'job_error': None})
+		frappe.enqueue('inn.inn_hotels.doctype.inn_dayend_close.inn_dayend_close.run_dayend_close',
+					   queue='long', timeout=3600, job_name=get_dayend_close_job_name(doc_id),
+					   enqueue_after_commit=True, doc_id=doc_id)
+		return 'Queued'
 
-	COMMISSION_TRANSACTION_TYPE = frappe.db.get_single_value("Inn Hotels Setting", fieldname="profit_sharing_transaction_type")
+def get_dayend_close_job_name(doc_id):
+	return 'Inn Dayend Close ' + doc_id
 
-	# Create Journal Entry Pairing for Every Eligible Inn Folio Transactions
-	folio_list = frappe.get_all('Inn Folio', filters={'status': ['in', ['Open', 'Closed']], 'journal_entry_id_closed': ['=', '']}, fields=["name", "reservation_id"])
-	for item in folio_list:
-		need_resolve_list = check_void_request(item.name)
-		if len(need_resolve_list) > 0:
-			need_resolve_flag = True
-			break
+def is_dayend_close_job_alive(doc_id):
+	"""whether a queued or started RQ job of the dayend close exists"""
+	from frappe.utils.background_jobs import get_jobs
 
-	if need_resolve_flag:
-		return "There are transaction requested to be voided not yet responded. Please resolve the request first."
-	else:
-		print('Folio List Size: ',len(folio_list))
-		for item in folio_list:
-			print(datetime.datetime.now(),': Folio ', item.name)
-			doc_folio = frappe.get_doc('Inn Folio', item.name)
-			if doc_folio.reservation_id:
-				reservation = frappe.get_doc('Inn Reservation', doc_folio.reservation_id)
-
-				if reservation.status == 'In House':
-					actual_room = frappe.get_doc('Inn Room', reservation.actual_room_id)
-					actual_room.room_status = 'Occupied Dirty'
-					actual_room.save()
-
-			trx_list : list[Document] = doc_folio.get('folio_transaction')
-			for trx in trx_list:
-				if trx.is_void == 0 and trx.journal_entry_id is None:
-					if trx.remark is None:
-						remark = trx.transaction_type + ' ' + trx.parent
-					elif trx.remark == '':
-						remark = trx.transaction_type + ' ' + trx.parent
-					else:
-						remark = trx.remark
-					customer_name = frappe.db.get_value('Inn Folio', trx.parent, 'customer_id')
-					doc_je = frappe.new_doc('Journal Entry')
-					doc_je.title = doc_folio.name
-					doc_je.voucher_type = 'Journal Entry'
-					doc_je.naming_series = 'ACC-JV-.YYYY.-'
-					doc_je.posting_date = get_last_audit_date()
-					doc_je.company = frappe.get_doc('Global Defaults').default_company
-					doc_je.total_amount_currency = frappe.get_doc('Global Defaults').default_currency
-					doc_je.remark = remark
-					doc_je.user_remark = remark
-
-					doc_jea_debit = frappe.new_doc('Journal Entry Account')
-					doc_jea_debit.account = trx.debit_account
-					doc_jea_debit.debit = trx.amount
-					doc_jea_debit.debit_in_account_currency = trx.amount
-					doc_jea_debit.party_type, doc_jea_debit.party = _fill_party_account(doc_jea_debit.account, customer_name)
-					doc_jea_debit.user_remark = remark
-
-					if trx.transaction_type == COMMISSION_TRANSACTION_TYPE and doc_jea_debit.party_type == "Supplier":
-						channel_id = frappe.db.get_value("Inn Reservation", item.reservation_id, fieldname="channel")
-						channel_vendor = frappe.db.get_value("Inn Channel", channel_id, channel_id)
-						doc_jea_debit.party = channel_vendor
-
-					doc_jea_credit = frappe.new_doc('Journal Entry Account')
-					doc_jea_credit.account = trx.credit_account
-					doc_jea_credit.credit = trx.amount
-					doc_jea_credit.credit_in_account_currency = trx.amount
-					doc_jea_credit.party_type, doc_jea_credit.party = _fill_party_account(doc_jea_credit.account, customer_name)
-					doc_jea_credit.user_remark = remark
-					
-					if trx.transaction_type == COMMISSION_TRANSACTION_TYPE and doc_jea_credit.party_type == "Supplier":
-						channel_id = frappe.db.get_value("Inn Reservation", item.reservation_id, fieldname="channel")
-						channel_vendor = frappe.db.get_value(doctype="Inn Channel", filters={"name": channel_id}, fieldname="supplier")
-						doc_jea_credit.party = channel_vendor
-
-					doc_je.append('accounts', doc_jea_debit)
-					doc_je.append('accounts', doc_jea_credit)
-
-					doc_je.save()
-					doc_je.submit()
-
-					trx.journal_entry_id = doc_je.name
-					trx.save()
-
-		# Create Journal Entry Pairing for Every Eligible Inn Folio
-		closed_folio_list = frappe.get_all('Inn Folio', filters={
-			'status': 'Closed',
-			'total_credit': ['!=', 0],
-			'total_debit': ['!=', 0],
-			'journal_entry_id_closed': ['=', '']
-		})
-		for item in closed_folio_list:
-			doc_folio = frappe.get_doc('Inn Folio', item.name)
-			cust_name = doc_folio.customer_id
-			# Get all Closed folio with close date == last audit date
-			if doc_folio.journal_entry_id_closed is None and doc_folio.close == get_last_audit_date():
-				closed_folio_remark = 'Closed Folio Transaction'
-				# Get all transactions that not void
-				closed_trx_list = frappe.get_all('Inn Folio Transaction',
-														filters={'parent': item.name,'is_void': 0},
-														fields=['*'])
-				# Folio must not be empty, Because Journal Entry Table Account not allowed to be empty
-				if len(closed_trx_list) > 0:
-					doc_je = frappe.new_doc('Journal Entry')
-					doc_je.title = doc_folio.name
-					doc_je.voucher_type = 'Journal Entry'
-					doc_je.naming_series = 'ACC-JV-.YYYY.-'
-					doc_je.posting_date = get_last_audit_date()
-					doc_je.company = frappe.get_doc('Global Defaults').default_company
-					doc_je.total_amount_currency = frappe.get_doc('Global Defaults').default_currency
-					doc_je.remark = closed_folio_remark
-					doc_je.user_remark = closed_folio_remark
-
-					for trx in closed_trx_list:
-						if trx.flag == 'Debit':
-							doc_jea_debit = frappe.new_doc('Journal Entry Account')
-							doc_jea_debit.account = trx.debit_account
-							doc_jea_debit.debit = trx.amount
-							doc_jea_debit.credit_in_account_currency = trx.amount #amount flipped to credit
-							doc_jea_debit.party_type, doc_jea_debit.party = _fill_party_account(doc_jea_debit.account, cust_name)
-							doc_jea_debit.user_remark = closed_folio_remark
-							doc_je.append('accounts', doc_jea_debit)
-							print(f"DEBIT {doc_jea_debit.debit} - {doc_jea_debit.credit_in_account_currency} {trx.remark}")
-						elif trx.flag == 'Credit':
-							doc_jea_credit = frappe.new_doc('Journal Entry Account')
-							doc_jea_credit.account = trx.credit_account
-							doc_jea_credit.credit = trx.amount
-							doc_jea_credit.debit_in_account_currency = trx.amount #amount flipped to debit
-							doc_jea_credit.party_type, doc_jea_credit.party = _fill_party_account(doc_jea_credit.account, cust_name)
-							doc_jea_credit.user_remark = closed_folio_remark
-							doc_je.append('accounts', doc_jea_credit)
-							print(f"CREDIT {doc_jea_credit.credit} - {doc_jea_credit.debit_in_account_currency} {trx.remark}")
-
-					doc_je.save()
-					doc_je.submit()
-					doc_folio.journal_entry_id_closed = doc_je.name
-					doc_folio.save()
-
-		# Create Journal Entry for Inn Restaurant Finished Order
-		# Get all finished order that not transfered to folio and not paired with journal entry yet
-		# create_je_for_inn_restaurant_finished_order()
-
-
-		doc_audit_log = frappe.new_doc('Inn Audit Log')
-		doc_audit_log.naming_series = 'AL.DD.-.MM.-.YYYY.-'
-		doc_audit_log.audit_date = get_last_audit_date() + datetime.timedelta(days = 1)
-		doc_audit_log.posting_date = datetime.datetime.now()
-		doc_audit_log.posted_by =frappe.session.user
-		doc_audit_log.insert()
-
-		doc = frappe.get_doc('Inn Dayend Close', doc_id)
-		doc.status = 'Closed'
-		doc.save()
-
-		return doc.status
+	return get_dayend_close_job_name(doc_id) in get_jobs(site=frappe.local.site, key='job_name').get(frappe.local.site, [])
+
+@frappe.whitelist()
+def get_dayend_readiness():
+	"""
+	everything that keeps the day from being closed, in one round trip for the dayend close form:
+	pending_void_requests and open_room_charge_postings block the close,
+	unposted_rooms (In House rooms without room charge at the audit date) and open_shifts are warnings.
+	"""
+	pending_void_requests = get_pending_void_requests()
+	open_room_charge_postings = frappe.get_all('Inn Room Charge Posting', filters={'status': 'Open'}, pluck='name')
+	unposted_rooms = [{'reservation_id': item.reservation_id, 'folio_id': item.folio_id, 'room_id': item.room_id}
+					  for item in populate_tobe_posted()]
+	open_shifts = frappe.get_all('Inn Shift', filters={'status': 'Open'}, fields=['name', 'username'])
+
+	return {
+		'ready': not pending_void_requests and not open_room_charge_postings,
+		'pending_void_requests': pending_void_requests,
+		'open_room_charge_postings': open_room_charge_postings,
+		'unposted_rooms': unposted_rooms,
+		'open_shifts': open_shifts,
+	}
+
+def run_dayend_close(doc_id):
+	"""
+	background job of the dayend close. every phase commits as it goes and is idempotent,
+	so a failed job can be enqueued again and continues where it stopped:
+	1. room status of In House reservation, checkpointed per folio in last_processed_folio
+	2. journal entries of folio transactions, one multi-row Journal Entry per account pair, committed per pair
+	3. closing journal entry of folios closed at the audit date, committed per folio
+	4. new audit date
+	"""
+	frappe.db.set_value('Inn Dayend Close', doc_id, {'job_status': 'Running', 'job_error': None})
+	frappe.db.commit()
+
+	try:
+		context = get_dayend_close_context()
+		update_in_house_room_status(doc_id)
+		create_dayend_journal_entries(doc_id, context)
+		create_closed_folio_journal_entries(doc_id, context)
+		close_audit_date(doc_id, context)
+	except Exception:
+		frappe.db.rollback()
+		frappe.db.set_value('Inn Dayend Close', doc_id, {'job_status': 'Failed', 'job_error': frappe.get_traceback()})
+		frappe.db.commit()
+		frappe.log_error(title='Inn Dayend Close ' + doc_id)
+		publish_dayend_close_progress(doc_id, 'Failed')
+		raise
+
+def get_dayend_close_context():
+	# values shared by every journal entry of the job, read once
+	return frappe._dict({
+		'audit_date': get_last_audit_date(),
+		'company': frappe.db.get_single_value('Global Defaults', 'default_company'),
+		'currency': frappe.db.get_single_value('Global Defaults', 'default_currency'),
+		'commission_transaction_type': frappe.db.get_single_value("Inn Hotels Setting", fieldname="profit_sharing_transaction_type"),
+		# account type of every journal entry account, resolved once per job
+		'account_resolver': PartyAccountResolver(),
+	})
+
+def publish_dayend_close_progress(doc_id, phase, progress=0, total=0, account_cache=None):
+	frappe.publish_realtime(DAYEND_CLOSE_PROGRESS_EVENT,
+							{'doc_id': doc_id, 'phase': phase, 'progress': progress, 'total': total, 'account_cache': account_cache},
+							doctype='Inn Dayend Close', docname=doc_id)
+
+def update_in_house_room_status(doc_id):
+	phase = 'Room Status'
+	last_processed_folio = frappe.db.get_value('Inn Dayend Close', doc_id, 'last_processed_folio')
+	folio_list = frappe.db.sql("""
+		select folio.name, reservation.actual_room_id
+		from `tabInn Folio` as folio
+		inner join `tabInn Reservation` as reservation on reservation.name = folio.reservation_id
+		where folio.status in ('Open', 'Closed') and ifnull(folio.journal_entry_id_closed, '') = ''
+			and reservation.status = 'In House' and folio.name > %s
+		order by folio.name asc
+	""", last_processed_folio or '', as_dict=True)
+
+	frappe.db.set_value('Inn Dayend Close', doc_id, {'job_phase': phase, 'total_folio': len(folio_list), 'processed_folio': 0})
+	for index, item in enumerate(folio_list, 1):
+		actual_room = frappe.get_doc('Inn Room', item.actual_room_id)
+		actual_room.room_status = 'Occupied Dirty'
+		actual_room.save()
+
+		frappe.db.set_value('Inn Dayend Close', doc_id, {'last_processed_folio': item.name, 'processed_folio': index})
+		frappe.db.commit()
+		publish_dayend_close_progress(doc_id, phase, index, len(folio_list))
+
+def get_transaction_party(account, customer_id, trx, context, channel_supplier):
+	party_type, party = _fill_party_account(account, customer_id, context.account_resolver)
+	if trx.transaction_type == context.commission_transaction_type and party_type == 'Supplier':
+		party = channel_supplier.get(trx.reservation_id)
+	return party_type, party
+
+def create_dayend_journal_entries(doc_id, context):
+	phase = 'Journal Entry'
+	trx_list = frappe.db.sql("""
+		select trx.name, trx.transaction_type, trx.debit_account, trx.credit_account, trx.amount,
+			folio.customer_id, folio.reservation_id
+		from `tabInn Folio Transaction` as trx
+		inner join `tabInn Folio` as folio on folio.name = trx.parent
+		where trx.parenttype = 'Inn Folio' and trx.is_void = 0 and trx.journal_entry_id is null
+			and folio.status in ('Open', 'Closed') and ifnull(folio.journal_entry_id_closed, '') = ''
+		order by trx.debit_account, trx.credit_account, trx.name
+	""", as_dict=True)
+
+	reservation_ids = list({trx.reservation_id for trx in trx_list
+							if trx.reservation_id and trx.transaction_type == context.commission_transaction_type})
+	channel_supplier = {}
+	if reservation_ids:
+		channel_supplier = dict(frappe.db.sql("""
+			select reservation.name, channel.supplier
+			from `tabInn Reservation` as reservation
+			inner join `tabInn Channel` as channel on channel.name = reservation.channel
+			where reservation.name in %s
+		""", [reservation_ids]))
+
+	context.account_resolver.prefetch([trx.debit_account for trx in trx_list] + [trx.credit_account for trx in trx_list])
+
+	account_pairs = {}
+	for trx in trx_list:
+		account_pairs.setdefault((trx.debit_account, trx.credit_account), []).append(trx)
+
+	frappe.db.set_value('Inn Dayend Close', doc_id, {'job_phase': phase, 'total_folio': len(account_pairs), 'processed_folio': 0})
+	for index, ((debit_account, credit_account), pair_trx_list) in enumerate(account_pairs.items(), 1):
+		remark = 'Dayend Close {0}: {1} / {2}'.format(context.audit_date.strftime('%d-%m-%Y'), debit_account, credit_account)
+		# one row per party on each side instead of one journal entry per transaction
+		debit_rows = {}
+		credit_rows = {}
+		for trx in pair_trx_list:
+			debit_party = get_transaction_party(debit_account, trx.customer_id, trx, context, channel_supplier)
+			debit_rows[debit_party] = debit_rows.get(debit_party, 0) + flt(trx.amount)
+			credit_party = get_transaction_party(credit_account, trx.customer_id, trx, context, channel_supplier)
+			credit_rows[credit_party] = credit_rows.get(credit_party, 0) + flt(trx.amount)
+
+		doc_je = new_dayend_journal_entry('Dayend Close ' + context.audit_date.strftime('%d-%m-%Y'), remark, context)
+		for (party_type, party), amount in debit_rows.items():
+			doc_je.append('accounts', {
+				'account': debit_account,
+				'debit': amount,
+				'debit_in_account_currency': amount,
+				'party_type': party_type,
+				'party': party,
+				'user_remark': remark,
+			})
+		for (party_type, party), amount in credit_rows.items():
+			doc_je.append('accounts', {
+				'account': credit_account,
+				'credit': amount,
+				'credit_in_account_currency': amount,
+				'party_type': party_type,
+				'party': party,
+				'user_remark': remark,
+			})
+		doc_je.save()
+		doc_je.submit()
+
+		frappe.db.sql("update `tabInn Folio Transaction` set journal_entry_id = %s where name in %s",
+					  (doc_je.name, [trx.name for trx in pair_trx_list]))
+		frappe.db.set_value('Inn Dayend Close', doc_id, 'processed_folio', index)
+		frappe.db.commit()
+		publish_dayend_close_progress(doc_id, phase, index, len(account_pairs))
+
+def create_closed_folio_journal_entries(doc_id, context):
+	phase = 'Closed Folio'
+	# Get all Closed folio with close date == last audit date
+	closed_folio_list = frappe.get_all('Inn Folio', filters={
+		'status': 'Closed',
+		'total_credit': ['!=', 0],
+		'total_debit': ['!=', 0],
+		'journal_entry_id_closed': ['=', ''],
+		'close': context.audit_date,
+	}, fields=['name', 'customer_id'])
+
+	frappe.db.set_value('Inn Dayend Close', doc_id, {'job_phase': phase, 'total_folio': len(closed_folio_list), 'processed_folio': 0})
+	for index, item in enumerate(closed_folio_list, 1):
+		closed_folio_remark = 'Closed Folio Transaction'
+		# Get all transactions that not void
+		closed_trx_list = frappe.get_all('Inn Folio Transaction',
+										 filters={'parent': item.name, 'is_void': 0},
+										 fields=['flag', 'amount', 'debit_account', 'credit_account'])
+		# Folio must not be empty, Because Journal Entry Table Account not allowed to be empty
+		if len(closed_trx_list) > 0:
+			context.account_resolver.prefetch([trx.debit_account for trx in closed_trx_list] + [trx.credit_account for trx in closed_trx_list])
+			doc_je = new_dayend_journal_entry(item.name, closed_folio_remark, context)
+			for trx in closed_trx_list:
+				if trx.flag == 'Debit':
+					party_type, party = _fill_party_account(trx.debit_account, item.customer_id, context.account_resolver)
+					doc_je.append('accounts', {
+						'account': trx.debit_account,
+						'debit': trx.amount,
+						'credit_in_account_currency': trx.amount, #amount flipped to credit
+						'party_type': party_type,
+						'party': party,
+						'user_remark': closed_folio_remark,
+					})
+				elif trx.flag == 'Credit':
+					party_type, party = _fill_party_account(trx.credit_account, item.customer_id, context.account_resolver)
+					doc_je.append('accounts', {
+						'account': trx.credit_account,
+						'credit': trx.amount,
+						'debit_in_account_currency': trx.amount, #amount flipped to debit
+						'party_type': party_type,
+						'party': party,
+						'user_remark': closed_folio_remark,
+					})
+			doc_je.save()
+			doc_je.submit()
+			frappe.db.set_value('Inn Folio', item.name, 'journal_entry_id_closed', doc_je.name)
+
+		frappe.db.set_value('Inn Dayend Close', doc_id, 'processed_folio', index)
+		frappe.db.commit()
+		publish_dayend_close_progress(doc_id, phase, index, len(closed_folio_list))
+
+def new_dayend_journal_entry(title, remark, context):
+	doc_je = frappe.new_doc('Journal Entry')
+	doc_je.title = title
+	doc_je.voucher_type = 'Journal Entry'
+	doc_je.naming_series = 'ACC-JV-.YYYY.-'
+	doc_je.posting_date = context.audit_date
+	doc_je.company = context.company
+	doc_je.total_amount_currency = context.currency
+	doc_je.remark = remark
+	doc_je.user_remark = remark
+	return doc_je
+
+def close_audit_date(doc_id, context):
+	# facts of the closed day for the Daily Flash Report
+	update_daily_kpi(context.audit_date)
+	# months marked dirty by the GL Entry posted since the last dayend, for the P&L report
+	update_gl_monthly_balance()
+
+	# Create Journal Entry for Inn Restaurant Finished Order
+	# Get all finished order that not transfered to folio and not paired with journal entry yet
+	# create_je_for_inn_restaurant_finished_order()
+
+	doc_audit_log = frappe.new_doc('Inn Audit Log')
+	doc_audit_log.naming_series = 'AL.DD.-.MM.-.YYYY.-'
+	doc_audit_log.audit_date = context.audit_date + datetime.timedelta(days = 1)
+	doc_audit_log.posting_date = datetime.datetime.now()
+	doc_audit_log.posted_by =frappe.session.user
+	doc_audit_log.insert()
+
+	doc = frappe.get_doc('Inn Dayend Close', doc_id)
+	doc.status = 'Closed'
+	doc.job_status = 'Completed'
+	doc.job_phase = None
+	doc.save()
+	frappe.db.commit()
+	account_cache = context.account_resolver.get_hit_rates()
+	frappe.logger('inn').info('Inn Dayend Close {0} account type lookups: {1}'.format(doc_id, account_cache))
+	publish_dayend_close_progress(doc_id, 'Completed', account_cache=account_cache)
 
 @frappe.whitelist()
 def load_child(date):
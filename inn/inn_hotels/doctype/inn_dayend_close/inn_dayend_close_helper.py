@@ -1,35 +1,89 @@
 import frappe
 
+ACCOUNT_TYPE_CACHE_KEY = "inn_account_type"
 
-def _fill_party_account(doc_id: str, party_in: str) -> tuple[str, str]:
-    """Return party type is Customer or Supplier 
-    by querying to Account database and check its account type if its 
+PARTY_TYPE_BY_ACCOUNT_TYPE = {
+    "Receivable": "Customer",
+    "Payable": "Supplier",
+}
+
+
+class PartyAccountResolver:
+    """Party resolution of journal entry accounts for one dayend job.
+
+    Account types are looked up in the in-memory map of the job, then the site cache,
+    and the remaining accounts are read with a single query. Hits of each level are
+    counted so the job can report them once it is done.
+    """
+
+    def __init__(self):
+        self.account_types = {}
+        self.hits = {"memory": 0, "cache": 0, "database": 0}
+
+    def prefetch(self, accounts) -> None:
+        """Resolve the account type of many accounts at once"""
+        missing = []
+        for account in set(accounts):
+            if not account or account in self.account_types:
+                continue
+            account_type = frappe.cache().hget(ACCOUNT_TYPE_CACHE_KEY, account)
+            if account_type is None:
+                missing.append(account)
+            else:
+                self.account_types[account] = account_type
+                self.hits["cache"] += 1
+
+        if missing:
+            account_types = dict.fromkeys(missing, "")
+            account_types.update(frappe.db.sql(
+                "select name, ifnull(account_type, '') from `tabAccount` where name in %s", [missing]))
+            for account, account_type in account_types.items():
+                frappe.cache().hset(ACCOUNT_TYPE_CACHE_KEY, account, account_type)
+                self.account_types[account] = account_type
+            self.hits["database"] += len(missing)
+
+    def get_account_type(self, account: str) -> str:
+        if account in self.account_types:
+            self.hits["memory"] += 1
+        else:
+            self.prefetch([account])
+        return self.account_types.get(account, "")
+
+    def fill_party_account(self, account: str, party_in: str) -> tuple[str, str]:
+        """Same as _fill_party_account, served from the job map"""
+        party_type = PARTY_TYPE_BY_ACCOUNT_TYPE.get(self.get_account_type(account), "")
+        return party_type, party_in if party_type else ""
+
+    def get_hit_rates(self) -> dict:
+        """Share of lookups served by each level, with the raw counts"""
+        total = sum(self.hits.values())
+        return {level: {"count": count, "rate": round(count / total, 4) if total else 0}
+                for level, count in self.hits.items()}
+
+
+def clear_account_type_cache(doc=None, method=None, *args):
+    """doc_events hook of Account, a changed account type must not be served from the site cache.
+    after_rename passes the old name too, the whole map is dropped then."""
+    if doc and doc.name and not args:
+        frappe.cache().hdel(ACCOUNT_TYPE_CACHE_KEY, doc.name)
+    else:
+        frappe.cache().delete_value(ACCOUNT_TYPE_CACHE_KEY)
+
+
+def _fill_party_account(doc_id: str, party_in: str, resolver: PartyAccountResolver = None) -> tuple[str, str]:
+    """Return party type is Customer or Supplier
+    by querying to Account database and check its account type if its
     Receiveable (return Customer) or Payable (return Supplier)
 
     Parameters
     ----
     doc_id : str, account id
         Account identifier
-    
+
     party : str, party name
-        Party name will be echoed if account type is Receiveable or Payable 
+        Party name will be echoed if account type is Receiveable or Payable
 
+    resolver : PartyAccountResolver, optional
+        Account types already resolved by the current job, a fresh one (site cache) is used otherwise
     """
-    party_type = ""
-    party = ""
-    doc_jea_type_account = frappe.get_doc("Account", doc_id)
-    match doc_jea_type_account.account_type:
-        case "Receivable":
-            party_type = 'Customer'
-            party = party_in
-        case "Payable":
-            party_type = 'Supplier'
-            party = party_in
-    # print('--from _fill_party_account')
-    # print('account: '+ doc_id)
-    # print('account type: ' + doc_jea_type_account.account_type)
-    # print("party type: " + party_type)
-    # print("party: " + party)
-    # print('--endfrom')
-
-    return party_type, party
\ No newline at end of file
+    return (resolver or PartyAccountResolver()).fill_party_account(doc_id, party_in)
@@ -113,26 +113,20 @@ frappe.ui.form.on('Inn Floor Plan', {
 		frappe.call({
 			method: 'inn.inn_hotels.doctype.inn_room_booking.inn_room_booking.get_all_room_with_room_booking_status',
 			callback: (resp) => {
-				resp.forEach(element => {
-					if (element.status == 'AV') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#33a02c;');
-					} else if (element.status == 'RS') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#1f78b4;');
-					} else if (element.status == 'RC') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#a6cee3;');
-					} else if (element.status == 'OU') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#ff7f00;');
-					} else if (element.status == 'HU') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#fdbf6f;');
-					} else if (element.status == 'OO') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#e31a1c;');
-					} else if (element.status == 'UC') {
-						document.getElementById('room-' + element.name).setAttribute('style', 'fill:#fb9a99;');
-					}
+				resp.message.forEach(element => {
+					paint_room_status(element);
 				});
 			}
 		});
 
+		// bookings and rooms changed elsewhere are pushed here, no need to reload the whole floor plan
+		if (!frm.floor_plan_listener) {
+			frm.floor_plan_listener = true;
+			frappe.realtime.on('inn_floor_plan_status', (element) => {
+				paint_room_status(element);
+			});
+		}
+
 		var information = '' +
 			'<divc class="col-xs-12 col-md-4">\
 				<p><b>Information</b></p>\
@@ -157,3 +151,20 @@ frappe.ui.form.on('Inn Floor Plan', {
 		wrapper.html(wrapper.html() + information);
 	}
 });
+
+const FLOOR_PLAN_STATUS_COLOR = {
+	'AV': '#33a02c',
+	'RS': '#1f78b4',
+	'RC': '#a6cee3',
+	'OU': '#ff7f00',
+	'HU': '#fdbf6f',
+	'OO': '#e31a1c',
+	'UC': '#fb9a99',
+};
+
+function paint_room_status(element) {
+	let room = document.getElementById('room-' + element.name);
+	if (room && FLOOR_PLAN_STATUS_COLOR[element.status]) {
+		room.setAttribute('style', 'fill:' + FLOOR_PLAN_STATUS_COLOR[element.status] + ';');
+	}
+}
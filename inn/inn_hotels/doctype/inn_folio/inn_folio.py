@@ -9,9 +9,15 @@ import math
 import json
 import datetime
 from frappe.model.document import Document
+from frappe.utils import flt
 
 class InnFolio(Document):
-	pass
+	def before_save(self):
+		# total_debit, total_credit and balance are ledger counters maintained by apply_balance_delta,
+		# never write back the values loaded with this document, they may be stale.
+		if not self.is_new():
+			self.total_debit, self.total_credit, self.balance = frappe.db.get_value(
+				'Inn Folio', self.name, ['total_debit', 'total_credit', 'balance'], for_update=True)
 
 @frappe.whitelist()
 def create_folio(reservation_id):
@@ -41,56 +47,102 @@ def get_reservation_id(folio_id):
 	doc = frappe.get_doc('Inn Folio', folio_id)
 	return doc.reservation_id
 
+def compute_balance(total_debit, total_credit):
+	return int(flt(total_credit) - math.ceil(flt(total_debit)))
+
+def apply_balance_delta(folio_id, debit=0.0, credit=0.0):
+	'''
+	add debit / credit to the running totals of a folio. the folio row is locked while the new balance is computed,
+	so concurrent transactions on the same folio are serialized.
+	'''
+	if not folio_id or (not debit and not credit):
+		return
+	current = frappe.db.get_value('Inn Folio', folio_id, ['total_debit', 'total_credit'], as_dict=True, for_update=True)
+	if not current:
+		return
+	total_debit = flt(current.total_debit) + flt(debit)
+	total_credit = flt(current.total_credit) + flt(credit)
+	frappe.db.set_value('Inn Folio', folio_id, {
+		'total_debit': total_debit,
+		'total_credit': total_credit,
+		'balance': compute_balance(total_debit, total_credit),
+	}, update_modified=False)
+
+def get_transaction_totals(folio_ids):
+	'''
+	:return dict of folio name to (total_debit, total_credit) summed from non void Inn Folio Transaction, with one query
+	'''
+	totals = {folio_id: (0.0, 0.0) for folio_id in folio_ids}
+	if not folio_ids:
+		return totals
+	for row in frappe.db.sql('''select parent,
+			coalesce(sum(case when flag='Debit' then amount else 0 end), 0),
+			coalesce(sum(case when flag='Credit' then amount else 0 end), 0)
+		from `tabInn Folio Transaction`
+		where parenttype='Inn Folio' and is_void=0 and parent in %(folios)s
+		group by parent''', {'folios': folio_ids}):
+		totals[row[0]] = (flt(row[1]), flt(row[2]))
+	return totals
+
+def reconcile_folio_balances(folio_ids=None, only_open=True):
+	'''
+	verify the running totals of folios against the sum of their transactions and repair any drift.
+	:param folio_ids folios to check, default is every folio (only open folios when only_open is set)
+	:return list of repaired folio name
+	'''
+	filters = {}
+	if folio_ids is not None:
+		filters['name'] = ['in', folio_ids]
+	if only_open:
+		filters['status'] = 'Open'
+	folios = frappe.get_all('Inn Folio', filters=filters, fields=['name', 'total_debit', 'total_credit', 'balance'])
+
+	totals = get_transaction_totals([folio.name for folio in folios])
+	repaired = []
+	for folio in folios:
+		total_debit, total_credit = totals[folio.name]
+		balance = compute_balance(total_debit, total_credit)
+		if abs(flt(folio.total_debit) - total_debit) > 0.005 or abs(flt(folio.total_credit) - total_credit) > 0.005 \
+				or flt(folio.balance) != balance:
+			frappe.db.set_value('Inn Folio', folio.name, {
+				'total_debit': total_debit,
+				'total_credit': total_credit,
+				'balance': balance,
+			}, update_modified=False)
+			repaired.append(folio.name)
+
+	if repaired:
+		frappe.logger('inn').info({'reconcile_folio_balances': len(folios), 'repaired': repaired})
+	return repaired
+
+def reconcile_open_folio_balances():
+	# scheduler entry point
+	reconcile_folio_balances(only_open=True)
+
 @frappe.whitelist()
 def update_balance(folio_id):
-	doc = frappe.get_doc('Inn Folio', folio_id)
-	trx_list = doc.get('folio_transaction')
-	total_debit = 0.0
-	total_credit = 0.0
-	for trx in trx_list:
-		if trx.flag == 'Debit' and trx.is_void == 0:
-			total_debit += float(trx.amount)
-		elif trx.flag == 'Credit' and trx.is_void == 0:
-			total_credit += float(trx.amount)
-	balance = total_credit - math.ceil(total_debit)
-
-	if balance != doc.balance:
-		frappe.db.set_value('Inn Folio', doc.name, 'total_debit', math.ceil(total_debit))
-		frappe.db.set_value('Inn Folio', doc.name, 'total_credit', total_credit)
-		frappe.db.set_value('Inn Folio', doc.name, 'balance', int(balance))
-
+	reconcile_folio_balances([folio_id], only_open=False)
+	total_debit, total_credit, balance = frappe.db.get_value('Inn Folio', folio_id, ['total_debit', 'total_credit', 'balance'])
 	return total_debit, total_credit, balance
 
 @frappe.whitelist()
 def need_to_update_balance(folio_id):
-	doc = frappe.get_doc('Inn Folio', folio_id)
-	trx_list = doc.get('folio_transaction')
-
-	total_debit = 0.0
-	total_credit = 0.0
-	for trx in trx_list:
-		if trx.flag == 'Debit' and trx.is_void == 0:
-			total_debit += float(trx.amount)
-		elif trx.flag == 'Credit' and trx.is_void == 0:
-			total_credit += float(trx.amount)
-	balance = total_credit - total_debit
-
-	if balance != doc.balance:
+	total_debit, total_credit = get_transaction_totals([folio_id])[folio_id]
+	if compute_balance(total_debit, total_credit) != flt(frappe.db.get_value('Inn Folio', folio_id, 'balance')):
 		return 1
 	else:
 		return 0
 
-
 @frappe.whitelist()
 def get_balance(folio_id):
-	update_balance(folio_id)
-	return frappe.db.get_value('Inn Folio', folio_id, ['balance'])
+	return frappe.db.get_value('Inn Folio', folio_id, 'balance')
 
 @frappe.whitelist()
 def get_balance_by_reservation(reservation_id):
-	folio = frappe.get_doc('Inn Folio', {'reservation_id': reservation_id})
-	balance = get_balance(folio.name)
-	return balance
+	folio_id = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_id}, 'name')
+	if not folio_id:
+		raise frappe.DoesNotExistError
+	return get_balance(folio_id)
 
 @frappe.whitelist()
 def transfer_to_another_folio(trx_list, old_parent, new_parent):
@@ -158,11 +210,23 @@ def close_folio(folio_id):
 
 @frappe.whitelist()
 def check_void_request(folio_id):
-	need_resolve = []
-	folio = frappe.get_doc('Inn Folio', folio_id)
-	trx_list = folio.get('folio_transaction')
-	for item in trx_list:
-		if item.is_void == 0 and item.void_id is not None:
-			if frappe.db.get_value('Inn Void Folio Transaction', {'name': item.void_id }, 'status') == 'Requested':
-				need_resolve.append(item.name)
-	return need_resolve
+	# transactions of the folio whose void request is not responded yet
+	return [trx.transaction for trx in get_pending_void_requests(folio_id)]
+
+def get_pending_void_requests(folio_id=None):
+	'''
+	:param folio_id optional Inn Folio, default is every Open or Closed folio not journaled yet (the ones the dayend close journals)
+	:return list of {folio, transaction, void_request} for every not voided transaction with a Requested Inn Void Folio Transaction
+	'''
+	if folio_id:
+		condition = 'trx.parent = %(folio_id)s'
+	else:
+		condition = "folio.status in ('Open', 'Closed') and ifnull(folio.journal_entry_id_closed, '') = ''"
+	return frappe.db.sql("""
+		select trx.parent as folio, trx.name as transaction, void.name as void_request
+		from `tabInn Folio Transaction` as trx
+		inner join `tabInn Void Folio Transaction` as void on void.name = trx.void_id
+		inner join `tabInn Folio` as folio on folio.name = trx.parent
+		where trx.parenttype = 'Inn Folio' and trx.is_void = 0 and void.status = 'Requested' and {0}
+		order by trx.parent, trx.idx
+	""".format(condition), {'folio_id': folio_id}, as_dict=True)
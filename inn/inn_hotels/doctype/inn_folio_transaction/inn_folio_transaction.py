@@ -6,10 +6,12 @@ from __future__ import unicode_literals
 import frappe
 import datetime
 from inn.inn_hotels.doctype.inn_folio_transaction_type.inn_folio_transaction_type import get_accounts_from_id
-from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges
+from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges, get_tax_breakdown_account
 from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
 from inn.inn_hotels.doctype.inn_folio_transaction_bundle.inn_folio_transaction_bundle import get_trx_list
+from inn.inn_hotels.doctype.inn_folio.inn_folio import apply_balance_delta
 from frappe.model.document import Document
+from frappe.utils import flt, cint
 
 class InnFolioTransaction(Document):
     def validate(self):
@@ -17,6 +19,38 @@ class InnFolioTransaction(Document):
         if amount == 0:
         	raise ValueError("Amount cannot be zero")
 
+    def on_update(self):
+        # keep the folio running totals in sync: covers insert, void, amount change and transfer to another folio
+        update_folio_balance(self.get_doc_before_save(), self)
+
+    def on_trash(self):
+        update_folio_balance(self, None)
+
+def on_doctype_update():
+	# shift cash reconciliation scans transactions by creation window and type
+	frappe.db.add_index('Inn Folio Transaction', ['creation', 'transaction_type', 'is_void'])
+	# audit report sums the transactions of one audit date per folio and transaction type
+	frappe.db.add_index('Inn Folio Transaction', ['audit_date', 'parent', 'transaction_type'])
+
+def get_balance_contribution(trx):
+	# (folio, debit, credit) that a transaction adds to its folio running totals
+	if trx is None or trx.parenttype != 'Inn Folio' or cint(trx.is_void) == 1:
+		return None, 0.0, 0.0
+	if trx.flag == 'Debit':
+		return trx.parent, flt(trx.amount), 0.0
+	elif trx.flag == 'Credit':
+		return trx.parent, 0.0, flt(trx.amount)
+	return None, 0.0, 0.0
+
+def update_folio_balance(old_trx, new_trx):
+	old_folio, old_debit, old_credit = get_balance_contribution(old_trx)
+	new_folio, new_debit, new_credit = get_balance_contribution(new_trx)
+	if old_folio == new_folio:
+		apply_balance_delta(new_folio, new_debit - old_debit, new_credit - old_credit)
+	else:
+		apply_balance_delta(old_folio, -old_debit, -old_credit)
+		apply_balance_delta(new_folio, new_debit, new_credit)
+
 @frappe.whitelist()
 def get_mode_of_payment_account(mode_of_payment_id, company_name=frappe.get_doc("Global Defaults").default_company):
 	return frappe.db.get_value('Mode of Payment Account', {'parent': mode_of_payment_id, 'company': company_name}, "default_account")
@@ -66,7 +100,7 @@ def add_package_charge(package_name, sub_folio, remark, parent):
 		new_tax_doc.amount = tb_amount[index]
 		new_tax_doc.reference_id = package_doc.name
 		new_tax_doc.sub_folio = sub_folio
-		new_tax_doc.credit_account = frappe.get_doc('Inn Tax Breakdown', package_tax_item_name).breakdown_account
+		new_tax_doc.credit_account = get_tax_breakdown_account(package_doc.inn_tax_id, package_tax_item_name)
 		new_tax_doc.debit_account = package_doc.debit_account
 		new_tax_doc.remark = 'Package Tax ' + remark
 		new_tax_doc.parent = parent
@@ -106,6 +140,9 @@ def add_package_charge(package_name, sub_folio, remark, parent):
 		# kurangi amount dari package charge sesuai dengan difference (ini ditambah karena nilai difference negatif, jadi sama saja dengan amount + (- difference)
 		frappe.db.set_value('Inn Folio Transaction', package[0].name, 'amount', package[0].amount + difference)
 
+	# set_value bypasses on_update, move the folio running totals by the adjusted amount
+	apply_balance_delta(parent, difference)
+
 	return new_doc.name
 
 @frappe.whitelist()
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Core Initiative and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Inn GL Monthly Balance', {
+	refresh: function(frm) {
+
+	}
+});
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and contributors
+# For license information, please see license.txt
+
+'''
+Inn GL Monthly Balance is the per account, per month rollup of GL Entry read by the P&L report: one row per
+(fiscal_year, month, account) holding the sum of debit and credit of that month.
+
+Submitting, cancelling or deleting a GL Entry marks its month in Inn GL Dirty Month (mark_gl_month_dirty, a doc event of
+GL Entry). The dayend close refreshes the marked months only (update_gl_monthly_balance), the P&L report reads the
+months still marked from GL Entry and never writes. rebuild_gl_monthly_balance recomputes everything.
+'''
+
+from __future__ import unicode_literals
+import datetime
+import frappe
+from frappe.model.document import Document
+from frappe.utils import get_last_day, getdate, now
+from inn.helper.bulk import bulk_insert_docs
+
+GL_MONTHLY_BALANCE_FIELDS = ['fiscal_year', 'month', 'account', 'debit', 'credit']
+
+class InnGLMonthlyBalance(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index('Inn GL Monthly Balance', ['fiscal_year', 'month'])
+
+def get_month_range(fiscal_year, month):
+	'''
+	:return first and last day of month within the fiscal year
+	'''
+	year_start_date = getdate(frappe.get_cached_value('Fiscal Year', fiscal_year, 'year_start_date'))
+	year = year_start_date.year if month >= year_start_date.month else year_start_date.year + 1
+	first_day = datetime.date(year, month, 1)
+	return first_day, get_last_day(first_day)
+
+def refresh_gl_monthly_balance(months, refreshed_at=None):
+	'''
+	recompute the rollup rows of some months from GL Entry, grouped in SQL.
+	:param months list of (fiscal_year, month)
+	'''
+	refreshed_at = refreshed_at or now()
+	rows = []
+	for fiscal_year, month in set(months):
+		frappe.db.sql("delete from `tabInn GL Monthly Balance` where fiscal_year = %s and month = %s", (fiscal_year, month))
+		for account, debit, credit in frappe.db.sql("""
+			select account, sum(debit), sum(credit)
+			from `tabGL Entry`
+			where fiscal_year = %s and posting_date between %s and %s
+			group by account
+		""", (fiscal_year,) + get_month_range(fiscal_year, month)):
+			rows.append({
+				'name': frappe.generate_hash(length=10),
+				'fiscal_year': fiscal_year,
+				'month': month,
+				'account': account,
+				'debit': debit,
+				'credit': credit,
+				'creation': refreshed_at,
+				'modified': refreshed_at,
+			})
+	bulk_insert_docs('Inn GL Monthly Balance', GL_MONTHLY_BALANCE_FIELDS, rows)
+
+def mark_gl_month_dirty(doc, method=None):
+	'''doc event of GL Entry: its month has to be rolled up again'''
+	if doc.fiscal_year and doc.posting_date:
+		mark_gl_months_dirty([(doc.fiscal_year, getdate(doc.posting_date).month)])
+
+def mark_gl_months_dirty(months):
+	# one row per month, named after it: marking a month already marked is a no-op
+	for fiscal_year, month in set(months):
+		frappe.db.sql("""
+			insert ignore into `tabInn GL Dirty Month` (name, fiscal_year, month, creation, modified, owner, modified_by)
+			values (%(name)s, %(fiscal_year)s, %(month)s, %(now)s, %(now)s, %(user)s, %(user)s)
+		""", {'name': '{0}-{1:02d}'.format(fiscal_year, int(month)), 'fiscal_year': fiscal_year, 'month': month,
+			  'now': now(), 'user': frappe.session.user})
+
+def get_dirty_gl_months(fiscal_year=None):
+	'''
+	:return list of (fiscal_year, month) changed since their last rollup
+	'''
+	filters = {'fiscal_year': fiscal_year} if fiscal_year else {}
+	return [(row.fiscal_year, row.month) for row in frappe.get_all('Inn GL Dirty Month', filters=filters, fields=['fiscal_year', 'month'])]
+
+def update_gl_monthly_balance(commit=True):
+	'''
+	dayend refresh of the months marked dirty since the last refresh.
+	:return number of months refreshed
+	'''
+	months = get_dirty_gl_months()
+	if not months:
+		return 0
+
+	# unmarked and committed before the refresh reads GL Entry: an entry committed from now on marks its month again
+	frappe.db.delete('Inn GL Dirty Month', {'name': ['in', ['{0}-{1:02d}'.format(fiscal_year, int(month)) for fiscal_year, month in months]]})
+	if commit:
+		frappe.db.commit()
+	try:
+		refresh_gl_monthly_balance(months)
+	except Exception:
+		if commit:
+			frappe.db.rollback()
+			mark_gl_months_dirty(months)
+			frappe.db.commit()
+		raise
+
+	return len(months)
+
+def rebuild_gl_monthly_balance(fiscal_year=None, commit=True):
+	'''
+	recompute the rollup of every month, optionally of one fiscal year only.
+	:return number of months rebuilt
+	'''
+	refreshed_at = now()
+	if fiscal_year:
+		months = frappe.db.sql("select distinct fiscal_year, month(posting_date) from `tabGL Entry` where fiscal_year = %s", fiscal_year)
+		frappe.db.sql("delete from `tabInn GL Monthly Balance` where fiscal_year = %s", fiscal_year)
+		frappe.db.delete('Inn GL Dirty Month', {'fiscal_year': fiscal_year})
+	else:
+		months = frappe.db.sql("select distinct fiscal_year, month(posting_date) from `tabGL Entry`")
+		frappe.db.delete('Inn GL Monthly Balance')
+		frappe.db.delete('Inn GL Dirty Month')
+
+	for fiscal_year, month in months:
+		refresh_gl_monthly_balance([(fiscal_year, month)], refreshed_at)
+		if commit:
+			frappe.db.commit()
+
+	return len(months)
+
+def get_gl_monthly_balance(fiscal_year, to_month, exclude_months=()):
+	'''
+	:return list of (month, account, debit, credit) of the fiscal year for every month before to_month
+	'''
+	return [row for row in frappe.db.sql("""
+		select month, account, debit, credit
+		from `tabInn GL Monthly Balance`
+		where fiscal_year = %s and month < %s
+	""", (fiscal_year, to_month)) if row[0] not in exclude_months]
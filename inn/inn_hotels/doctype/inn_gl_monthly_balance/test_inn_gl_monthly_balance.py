@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import datetime
+import math
+
+import frappe
+import unittest
+
+from inn.helper.bulk import bulk_insert_docs
+from inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance import (get_dirty_gl_months, mark_gl_month_dirty,
+	rebuild_gl_monthly_balance, update_gl_monthly_balance)
+from inn.inn_hotels.report.report_pnl.report_pnl import get_data
+
+FISCAL_YEAR = '2031'
+REPORT_DATE = '2031-03-15'
+
+def pnl_from_gl_entries(date, fiscal_year):
+	'''
+	the P&L as computed before the rollup: every GL Entry of the fiscal year walked up its account tree.
+	:return dict of account to (current_month, last_month, year_to_date)
+	'''
+	accounts_map = {}
+	for account in frappe.db.sql("select name, parent_account from `tabAccount` where root_type in ('Income', 'Expense')", as_dict=True):
+		accounts_map[account.name] = {'account_parent': account.parent_account or None, 'balance': [0, 0, 0]}
+
+	for gl_entry in frappe.db.sql("""
+		select posting_date, account, debit, credit
+		from `tabGL Entry`
+		where fiscal_year=%s and posting_date<=%s""", (fiscal_year, date), as_dict=True):
+		account = gl_entry.account
+		if account[:1] not in ('4', '5', '6', '7'):
+			continue
+		while account is not None:
+			if account[:1] == '4':
+				amount = gl_entry.credit - gl_entry.debit
+			elif account[:1] in ('5', '6', '7'):
+				amount = gl_entry.debit - gl_entry.credit
+			else:
+				amount = 0
+			accounts_map[account]['balance'][2] += amount
+			if gl_entry.posting_date.month == date.month:
+				accounts_map[account]['balance'][0] += amount
+			elif gl_entry.posting_date.month + 1 == date.month:
+				accounts_map[account]['balance'][1] += amount
+			account = accounts_map[account]['account_parent']
+
+	return {account: tuple(math.ceil(value) for value in values['balance']) for account, values in accounts_map.items()}
+
+class TestInnGLMonthlyBalance(unittest.TestCase):
+	def setUp(self):
+		self.accounts = frappe.get_all('Account', filters={'root_type': ['in', ['Income', 'Expense']], 'is_group': 0},
+									   pluck='name', limit=4)
+		self.accounts = [account for account in self.accounts if account[:1] in ('4', '5', '6', '7')]
+		if not self.accounts:
+			self.skipTest("needs numbered Income and Expense accounts")
+		if not frappe.db.exists('Fiscal Year', FISCAL_YEAR):
+			frappe.get_doc({'doctype': 'Fiscal Year', 'year': FISCAL_YEAR, 'year_start_date': FISCAL_YEAR + '-01-01',
+							'year_end_date': FISCAL_YEAR + '-12-31'}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def insert_gl_entries(self, entries):
+		bulk_insert_docs('GL Entry', ['posting_date', 'fiscal_year', 'account', 'debit', 'credit'], [{
+			'name': frappe.generate_hash(length=10),
+			'posting_date': posting_date,
+			'fiscal_year': FISCAL_YEAR,
+			'account': account,
+			'debit': debit,
+			'credit': credit,
+		} for posting_date, account, debit, credit in entries])
+
+	def fixture_entries(self):
+		entries = []
+		for index, account in enumerate(self.accounts):
+			for month, day in ((1, 5), (1, 28), (2, 10), (3, 1), (3, 15), (3, 20)):
+				entries.append(('2031-{0:02d}-{1:02d}'.format(month, day), account, 1000.5 * (index + 1) * month, 250.25 * day))
+		return entries
+
+	def report(self):
+		data = get_data(frappe._dict({'date': REPORT_DATE, 'fiscal_year': FISCAL_YEAR}))
+		return {row['account']: (row['current_month'], row['last_month'], row['year_to_date']) for row in data}
+
+	def test_rollup_matches_gl_entry_walk(self):
+		self.insert_gl_entries(self.fixture_entries())
+		rebuild_gl_monthly_balance(FISCAL_YEAR, commit=False)
+
+		self.assertEqual(self.report(), pnl_from_gl_entries(datetime.datetime.strptime(REPORT_DATE, '%Y-%m-%d'), FISCAL_YEAR))
+
+	def rollup(self):
+		return frappe.db.sql("""select month, account, debit, credit from `tabInn GL Monthly Balance`
+			where fiscal_year=%s order by month, account""", FISCAL_YEAR)
+
+	def test_backdated_entry_is_read_until_dayend(self):
+		self.insert_gl_entries(self.fixture_entries())
+		rebuild_gl_monthly_balance(FISCAL_YEAR, commit=False)
+		self.assertEqual(get_dirty_gl_months(FISCAL_YEAR), [])
+
+		# posted into February after the rollup, marked by the GL Entry doc event
+		self.insert_gl_entries([('2031-02-27', self.accounts[0], 777, 0)])
+		mark_gl_month_dirty(frappe._dict({'fiscal_year': FISCAL_YEAR, 'posting_date': '2031-02-27'}))
+		self.assertEqual(get_dirty_gl_months(FISCAL_YEAR), [(FISCAL_YEAR, 2)])
+
+		# the report reads the marked month from GL Entry and leaves the rollup alone
+		rollup = self.rollup()
+		expected = pnl_from_gl_entries(datetime.datetime.strptime(REPORT_DATE, '%Y-%m-%d'), FISCAL_YEAR)
+		self.assertEqual(self.report(), expected)
+		self.assertEqual(self.rollup(), rollup)
+		self.assertEqual(get_dirty_gl_months(FISCAL_YEAR), [(FISCAL_YEAR, 2)])
+
+		# the dayend rolls up the marked month only
+		update_gl_monthly_balance(commit=False)
+		self.assertEqual(get_dirty_gl_months(FISCAL_YEAR), [])
+		self.assertNotEqual(self.rollup(), rollup)
+		self.assertEqual(self.report(), expected)
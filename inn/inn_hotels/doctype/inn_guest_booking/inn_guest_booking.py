@@ -3,14 +3,19 @@
 
 from dateutil.parser import parse
 import frappe
-from inn.helper import daterange
+from inn.helper.bulk import bulk_insert_docs
+from inn.inn_hotels.doctype.inn_room_night.inn_room_night import delete_room_nights, get_room_night_rows, ROOM_NIGHT_FIELDS
+from inn.inn_hotels.doctype.inn_room_booking.inn_room_booking import refresh_floor_plan_status_after_commit
 from frappe.model.document import Document
-from datetime import date, timedelta, datetime
+from frappe.utils import getdate
+from datetime import timedelta
 import string
 import random
 import re
 
 RE_EMAIL_VALID = r"[^@]+@[^@]+\.[^@]+"
+ROOM_BOOKING_FIELDS = ["room_id", "start", "end", "room_availability", "note", "reference_type", "reference_name", "status"]
+GUEST_BOOKING_ROOM_FIELDS = ["parent", "parenttype", "parentfield", "idx", "inn_room_booking", "start_date", "end_date", "room_number"]
 class InnGuestBooking(Document):
 	pass
 
@@ -77,98 +82,113 @@ class InnGuestBooking(Document):
 	def generate_body_email(self):
 		return ""	
 
-	def new_room_booking(self, room_id):
-		doc_irb = frappe.new_doc("Inn Room Booking")
-		doc_irb.room_id = room_id
-		doc_irb.room_availability = "Room Sold"
-		doc_irb.note = self.additional_request
-		doc_irb.reference_type = "Inn Guest Booking"
-		doc_irb.reference_name = self.name
-		doc_irb.status = "Booked"
-		return doc_irb
-
-	def generate_booking_room(self, list_room: dict):
-		# generate Inn Room Booking
-		list_room_booking = []
-		for key in list_room:
-			doc_irb = self.new_room_booking(key)
-
-			if len(list_room[key]) == 1:
-				doc_irb.start = list_room[key][0]
-				doc_irb.end = list_room[key][0] + timedelta(days=1)
-				doc_irb.save(ignore_permissions=True)
-				list_room_booking.append(doc_irb)
-				continue
-
-			
-			doc_irb.start = list_room[key][0]
-			doc_irb.end = list_room[key][0] + timedelta(days=1)
-			
-			for idx in range(1, len(list_room[key])):
-				if (list_room[key][idx] - list_room[key][idx-1]).days == 1:
-					doc_irb.end = list_room[key][idx] + timedelta(days=1)
-				else:
-					doc_irb.end = list_room[key][idx-1] + timedelta(days=1)
-					doc_irb.save()
-					doc_irb = self.new_room_booking(key)
-					doc_irb.start = list_room[key][idx]
-					doc_irb.end = list_room[key][idx] + timedelta(days=1)
-
-			doc_irb.save(ignore_permissions=True)
-			list_room_booking.append(doc_irb)
-
-		# connect Inn Room Booking with Inn Guest Booking Room
-		for ii in list_room_booking:
-			doc_igbr = frappe.new_doc("Inn Guest Booking Room")
-			doc_igbr.inn_room_booking = ii.name
-			doc_igbr.parenttype = "Inn Guest Booking"
-			doc_igbr.parent = self.name
-			doc_igbr.parentfield = "inn_room_booking"
-			doc_igbr.save(ignore_permissions=True)
+	def generate_booking_room(self, segments: list):
+		# create the Inn Room Booking of every segment, its room nights and its Inn Guest Booking Room in bulk
+		room_bookings = []
+		for room_id, start, end in segments:
+			room_bookings.append(frappe._dict({
+				"name": frappe.generate_hash(length=10),
+				"room_id": room_id,
+				"start": start,
+				"end": end,
+				"room_availability": "Room Sold",
+				"note": self.additional_request,
+				"reference_type": "Inn Guest Booking",
+				"reference_name": self.name,
+				"status": "Booked",
+			}))
+		bulk_insert_docs("Inn Room Booking", ROOM_BOOKING_FIELDS, room_bookings)
+
+		room_nights = []
+		for room_booking in room_bookings:
+			room_nights.extend(get_room_night_rows(room_booking))
+		bulk_insert_docs("Inn Room Night", ROOM_NIGHT_FIELDS, room_nights)
+
+		bulk_insert_docs("Inn Guest Booking Room", GUEST_BOOKING_ROOM_FIELDS, [{
+			"name": frappe.generate_hash(length=10),
+			"parent": self.name,
+			"parenttype": "Inn Guest Booking",
+			"parentfield": "inn_room_booking",
+			"idx": idx,
+			"inn_room_booking": room_booking.name,
+			"start_date": room_booking.start,
+			"end_date": room_booking.end,
+			"room_number": room_booking.room_id,
+		} for idx, room_booking in enumerate(room_bookings, 1)])
+
+		refresh_floor_plan_status_after_commit([room_booking.room_id for room_booking in room_bookings])
 
 	def list_available_room(self, *args, **kwargs):
-		start_date = datetime.strptime(self.start, "%Y-%m-%d")
-		end_date = datetime.strptime(self.end, "%Y-%m-%d")
-
-		list_room_date = {}
-		prev_day_room = []
-
-		# semua kamar, kalo butuh kamar ekstra. query disini biar cuma 1x
-		all_room = frappe.db.get_list(ignore_permissions=True, doctype="Inn Room", filters={"bed_type": self.bed_type, "room_type": self.room_type}, pluck="name")
-
-		# TODO optimisasi pemilihan ruangan: pilih ruangan yang bikin paling dikit jumlah booking nya
-		for today_date in daterange(start_date, end_date):
-			today_room = []
-			today_string = today_date.strftime("%Y-%m-%d")
-			for room in prev_day_room:
-				# kalo kamar kemarin masih bisa dipake hari ini
-				if not frappe.db.exists("Inn Room Booking", {"room_id": room, "start":["<=", today_string], "end": [">", today_string], "status": ["not in", ['Finished', 'Canceled'] ]}):
-					today_room.append(room)
-			
-			# region butuh kamar (pada day 2, kamar yang dipake day 1 udah ada yang booking). Kalo bisa pake terus ini bakal di skip
-			# cari lagi kamar kosong yang bisa dipake
-			room_num_diff = len(today_room) - self.number_of_rooms
-			for room in all_room:
-				# kalu kebutuhan kamar terpenuhi, ngga usah cari kamar lagi
-				if room_num_diff == 0:
-					break
-				# kalo kamar ini udah masuk ke sebagai yang dipake
-				if room in today_room:
+		"""
+		:return list of (room_id, start, end) segments covering number_of_rooms rooms every night of the stay,
+		as long as the hotel has enough free rooms of the requested type, with as few room changes as possible
+		"""
+		start_date = getdate(self.start)
+		nights = (getdate(self.end) - start_date).days
+		if nights <= 0:
+			return []
+
+		all_room = frappe.db.get_list(ignore_permissions=True, doctype="Inn Room", filters={"bed_type": self.bed_type, "room_type": self.room_type}, pluck="name", order_by="name")
+		if not all_room:
+			return []
+
+		# occupancy of every candidate room for the whole stay, in one query
+		occupied_nights = {}
+		for room_id, night_date in frappe.db.sql("""
+			select room_id, date from `tabInn Room Night`
+			where room_id in %(rooms)s and date >= %(start)s and date < %(end)s
+			and status not in ('Finished', 'Canceled')
+		""", {"rooms": tuple(all_room), "start": start_date, "end": getdate(self.end)}):
+			occupied_nights.setdefault(room_id, set()).add((getdate(night_date) - start_date).days)
+
+		return [(room_id, start_date + timedelta(days=first_night), start_date + timedelta(days=first_night + length))
+				for room_id, first_night, length in assign_rooms(all_room, occupied_nights, nights, self.number_of_rooms)]
+
+
+def assign_rooms(rooms: list, occupied_nights: dict, nights: int, number_of_rooms: int) -> list:
+	"""
+	Assign number_of_rooms rooms to every night of a stay while minimising room changes.
+
+	Each guest room is a slot, a slot keeps its room for as long as the room is free. Whenever a slot needs a
+	(new) room, it takes the free room that stays free the longest from that night on (greedy with lookahead),
+	so fewer segments are needed for the rest of the stay.
+
+	:param rooms candidate Inn Room, ties are broken by this order
+	:param occupied_nights dict of room to set of night offsets (0 is the first night) already booked
+	:param nights number of nights of the stay
+	:param number_of_rooms rooms needed every night, fewer are assigned on nights without enough free rooms
+	:return list of (room, first night offset, number of nights) segments
+	"""
+	# free_run[room][n]: consecutive free nights of room starting at night n
+	free_run = {}
+	for room in rooms:
+		busy = occupied_nights.get(room, ())
+		run = [0] * (nights + 1)
+		for n in range(nights - 1, -1, -1):
+			run[n] = 0 if n in busy else run[n + 1] + 1
+		free_run[room] = run
+
+	segments = []
+	# room to the night offset its current segment ends (exclusive)
+	held_until = {}
+	for night in range(nights):
+		covered = sum(1 for until in held_until.values() if until > night)
+		for _ in range(number_of_rooms - covered):
+			best_room = None
+			for room in rooms:
+				if held_until.get(room, 0) > night:
 					continue
-				if not frappe.db.exists("Inn Room Booking", {"room_id": room, "start":["<=", today_string], "end": [">", today_string], "status": ["not in", ['Finished', 'Canceled'] ]}):
-					today_room.append(room)
-					room_num_diff += 1
-			# endregion
-			
-			# rekap penggunaan room untuk hari ini
-			for room in today_room:
-				if room in list_room_date:
-					list_room_date[room].append(today_date)
-				else:
-					list_room_date[room] = [today_date]
-			prev_day_room = today_room
-		return list_room_date
-	
+				if free_run[room][night] > (free_run[best_room][night] if best_room else 0):
+					best_room = room
+			if best_room is None:
+				break
+			length = free_run[best_room][night]
+			segments.append((best_room, night, length))
+			held_until[best_room] = night + length
+
+	return segments
+
+
 @frappe.whitelist()
 def convert_to_reservation(doc_id, customer_name):
 	# create reservation
@@ -213,7 +233,10 @@ def convert_to_reservation(doc_id, customer_name):
 @frappe.whitelist()
 def delete_booking_room_from_child(doc_id):
 	irb_name = frappe.db.get_value("Inn Guest Booking Room", doc_id, "inn_room_booking")
+	room_id = frappe.db.get_value("Inn Room Booking", irb_name, "room_id")
 	frappe.db.delete("Inn Room Booking", {"name": irb_name})
+	delete_room_nights(irb_name)
+	refresh_floor_plan_status_after_commit([room_id])
 
 
 @frappe.whitelist(allow_guest=True)
@@ -1,9 +1,31 @@
 # Copyright (c) 2024, Core Initiative and Contributors
 # See license.txt
 
-# import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from inn.inn_hotels.doctype.inn_guest_booking.inn_guest_booking import assign_rooms
+
 
 class TestInnGuestBooking(FrappeTestCase):
-	pass
+	def test_room_is_kept_across_nights(self):
+		self.assertEqual(assign_rooms(['A', 'B'], {}, 3, 1), [('A', 0, 3)])
+		self.assertEqual(assign_rooms(['A', 'B'], {}, 3, 2), [('A', 0, 3), ('B', 0, 3)])
+
+	def test_room_is_switched_when_it_becomes_busy(self):
+		occupied_nights = {'A': {2}, 'B': {0}}
+		self.assertEqual(assign_rooms(['A', 'B'], occupied_nights, 4, 1), [('A', 0, 2), ('B', 2, 2)])
+
+	def test_longest_free_run_is_taken(self):
+		occupied_nights = {'A': {1}, 'C': {2}}
+		self.assertEqual(assign_rooms(['A', 'B', 'C'], occupied_nights, 3, 1), [('B', 0, 3)])
+		# equal runs keep the order of the candidates
+		self.assertEqual(assign_rooms(['C', 'A', 'B'], {'A': {2}, 'C': {2}}, 3, 1), [('B', 0, 3)])
+		self.assertEqual(assign_rooms(['C', 'A', 'B'], {}, 3, 1), [('C', 0, 3)])
+
+	def test_fewer_free_rooms_than_needed(self):
+		self.assertEqual(assign_rooms(['A', 'B'], {}, 2, 3), [('A', 0, 2), ('B', 0, 2)])
+		self.assertEqual(assign_rooms(['A', 'B'], {'A': {0}}, 2, 2), [('B', 0, 2), ('A', 1, 1)])
+		self.assertEqual(assign_rooms([], {}, 2, 1), [])
+
+	def test_zero_nights(self):
+		self.assertEqual(assign_rooms(['A', 'B'], {}, 0, 2), [])
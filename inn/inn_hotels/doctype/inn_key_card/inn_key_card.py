@@ -7,9 +7,10 @@ from __future__ import unicode_literals
 from datetime import datetime, timedelta
 
 import frappe
-import requests
 import json
 from frappe.model.document import Document
+from frappe.utils import cint
+from inn.helper.door_lock import get_door_lock_client, get_door_lock_settings
 
 class InnKeyCard(Document):
 	pass
@@ -19,8 +20,8 @@ def room_max_active_card():
 	return frappe.db.get_single_value('Inn Hotels Setting', 'room_max_active_card')
 
 @frappe.whitelist()
-def issue_card(reservation_id):
-	door_lock_provider = frappe.db.get_single_value('Inn Hotels Setting', 'door_lock_api_provider')
+def issue_card(reservation_id, duplicate=False):
+	door_lock_provider = get_door_lock_settings().provider
 	if door_lock_provider == 'TESA':
 		doc = frappe.get_doc('Inn Reservation', reservation_id)
 		room = doc.actual_room_id
@@ -31,14 +32,14 @@ def issue_card(reservation_id):
 		for card in cards:
 			active_card += int(card.is_active)
 
-		if active_card == 0:
+		if active_card == 0 and not cint(duplicate):
 			cmd = "CI"
 		else:
 			cmd = "CG"
 
 		new_card = frappe.new_doc('Inn Key Card')
 		new_card.card_number = tesa_checkin(cmd, room, expiryDate)
-		if new_card.card_number == "E2" or new_card.card_number == "ED":
+		if new_card.card_number is None or new_card.card_number == "E2" or new_card.card_number == "ED":
 			return 'ERROR'
 		else:
 			new_card.room_id = doc.actual_room_id
@@ -72,7 +73,7 @@ def issue_card(reservation_id):
 
 @frappe.whitelist()
 def erase_card(flag, card_name):
-	door_lock_provider = frappe.db.get_single_value('Inn Hotels Setting', 'door_lock_api_provider')
+	door_lock_provider = get_door_lock_settings().provider
 	if door_lock_provider == 'TESA':
 		doc = frappe.get_doc('Inn Key Card', card_name)
 		room = doc.room_id
@@ -109,9 +110,6 @@ def erase_card(flag, card_name):
 			return doc.is_active
 
 def tesa_erase():
-	# api-endpoint
-	api_checkin_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/checkin'
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		"cmd": "CI",
@@ -123,28 +121,11 @@ def tesa_erase():
 		"returnCardId": "1"
 	}
 
-	if api_checkin_url is not None:
-		if int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth')) == 1:
-			auth = (frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user'),
-					frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password'))
-			r = requests.post(api_checkin_url, json=params, auth=auth)
-		else:
-			r = requests.post(api_checkin_url, json=params)
-
-		if r:
-			returned = json.loads(r.text)
-			msg_hex = returned['rawMsgHex']
-			data = msg_hex.split("B3")
-			card_number = bytearray.fromhex(data[-2]).decode()
-			r.close()
-			return card_number
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_erase', 'POST', '/checkin', json=params)
+	if r is not None:
+		return tesa_card_number(r.json())
 
 def tesa_checkin(cmd, room_id, expiry_date):
-	# api-endpoint
-	api_checkin_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/checkin'
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		"cmd": cmd,
@@ -156,28 +137,16 @@ def tesa_checkin(cmd, room_id, expiry_date):
 		"returnCardId": "1"
 	}
 
-	if api_checkin_url is not None:
-		if int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth')) == 1:
-			auth = (frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user'),
-					frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password'))
-			r = requests.post(api_checkin_url, json=params, auth=auth)
-		else:
-			r = requests.post(api_checkin_url, json=params)
-
-		if r:
-			returned = json.loads(r.text)
-			msg_hex = returned['rawMsgHex']
-			data = msg_hex.split("B3")
-			card_number = bytearray.fromhex(data[-2]).decode()
-			r.close()
-			return card_number
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_checkin', 'POST', '/checkin', json=params)
+	if r is not None:
+		return tesa_card_number(r.json())
 
-def tesa_verify(track):
-	# api-endpoint
-	api_verify_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/verify'
+def tesa_card_number(returned):
+	# the card number is the field before the last B3 separator of the raw message
+	data = returned['rawMsgHex'].split("B3")
+	return bytearray.fromhex(data[-2]).decode()
 
+def tesa_verify(track):
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		"cmd": "RC",
@@ -188,23 +157,11 @@ def tesa_verify(track):
 		"track": track
 	}
 
-	if api_verify_url is not None:
-		if int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth')) == 1:
-			auth = (frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user'),
-					frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password'))
-			r = requests.post(api_verify_url, json=params, auth=auth)
-		else:
-			r = requests.post(api_verify_url, json=params)
-
-		if r:
-			returned = json.loads(r.text)
-			r.close()
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_verify', 'POST', '/verify', idempotent=True, json=params)
+	if r is not None:
+		return r.json()
 
 def dows_checkin(building, room_id, expiry_date):
-	api_checkin_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/checkin'
 	params = {
 		"building": building,
 		"room": room_id.replace('R-', '').zfill(4),
@@ -212,56 +169,20 @@ def dows_checkin(building, room_id, expiry_date):
 		"arrival": datetime.today().strftime("%Y-%m-%d") + " 12:00:00",
 		"departure": expiry_date + " 14:00:00",
 	}
-	if api_checkin_url is not None:
-		s = requests.Session()
-		headers = {"Content-Type": "application/json"}
-		req = requests.Request('POST', api_checkin_url, json=params, headers=headers)
-		prepped = s.prepare_request(req)
-		del prepped.headers['Connection']
-		del prepped.headers['Accept-Encoding']
-		del prepped.headers['Accept']
-		r = s.send(prepped)
-		if r:
-			returned = json.loads(r.text)
-			r.close()
-			return returned['cardNo']
-		else:
-			frappe.msgprint("Error. Fail to Connect to CardEncoder. Please wait a moment and try again.")
-
+	headers = {"Content-Type": "application/json"}
+	r = get_door_lock_client('DOWS').request('dows_checkin', 'POST', '/checkin', json=params, headers=headers)
+	if r is not None:
+		return r.json()['cardNo']
 
 def dows_verify():
-	api_checkin_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/verify'
-	if api_checkin_url is not None:
-		s = requests.Session()
-		req = requests.Request('GET', api_checkin_url)
-		prepped = s.prepare_request(req)
-
-		del prepped.headers['Connection']
-		del prepped.headers['Accept-Encoding']
-		del prepped.headers['Accept']
-
-		r = s.send(prepped)
-		if r:
-			returned = json.loads(r.text)
-			r.close()
-			return returned
+	r = get_door_lock_client('DOWS').request('dows_verify', 'GET', '/verify', idempotent=True)
+	if r is not None:
+		return r.json()
 
 def dows_erase(room_id):
-	api_checkin_url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url') + '/erase/' + room_id.replace('R-', '').zfill(4)
-	if api_checkin_url is not None:
-		s = requests.Session()
-		req = requests.Request('DELETE', api_checkin_url)
-		prepped = s.prepare_request(req)
-
-		del prepped.headers['Connection']
-		del prepped.headers['Accept-Encoding']
-		del prepped.headers['Accept']
-
-		r = s.send(prepped)
-		if r:
-			returned = json.loads(r.text)
-			r.close()
-			return returned['cardNo']
+	r = get_door_lock_client('DOWS').request('dows_erase', 'DELETE', '/erase/' + room_id.replace('R-', '').zfill(4), idempotent=True)
+	if r is not None:
+		return r.json()['cardNo']
 
 
 @frappe.whitelist()
@@ -291,18 +212,27 @@ def test_api(option):
 		frappe.msgprint("Expiry Date = " + returned['expiryDate'])
 		frappe.msgprint("Info = " + returned['info'])
 
-@frappe.whitelist()
-def verify_card(track):
-	door_lock_provider = frappe.db.get_single_value('Inn Hotels Setting', 'door_lock_api_provider')
+def read_card(track="3"):
+	'''
+	:return list of the lines describing the card put on the encoder, None when it could not be read
+	'''
+	door_lock_provider = get_door_lock_settings().provider
 	if door_lock_provider == 'TESA':
 		returned = tesa_verify(track)
-		frappe.msgprint("User = " + returned['user'])
-		frappe.msgprint("Expiry Date = " + returned['expiryDate'])
-		frappe.msgprint("Expiry Time = " + returned['expiryTime'])
+		if returned is not None:
+			return ["User = " + returned['user'],
+					"Expiry Date = " + returned['expiryDate'],
+					"Expiry Time = " + returned['expiryTime']]
 	elif door_lock_provider == 'DOWS':
 		returned = dows_verify()
-		frappe.msgprint("Room = R-" + returned['room'].lstrip("0"))
-		frappe.msgprint("Expiry Date = " + returned['departure'])
+		if returned is not None:
+			return ["Room = R-" + returned['room'].lstrip("0"),
+					"Expiry Date = " + returned['departure']]
+
+@frappe.whitelist()
+def verify_card(track):
+	for line in read_card(track) or []:
+		frappe.msgprint(line)
 
 def tesa_check_in(cmd, room, activationDate, activationTime, expiryDate, expiryTime,
 				  pcId="", technology="P", encoder="1",  cardOperation="EF", grant=None, keypad=None, operator=None,
@@ -313,19 +243,9 @@ def tesa_check_in(cmd, room, activationDate, activationTime, expiryDate, expiryT
 	#  "activationTime": "12:00", "expiryDate": "17/05/2017", "expiryTime": "12:00",
 	#  "cardOperation": "RP", "operator": "tesa"}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json', 'Accept': 'text/plain'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -361,19 +281,9 @@ def tesa_check_in(cmd, room, activationDate, activationTime, expiryDate, expiryT
 	if cardId is not None:
 		params.update({'cardId': cardId})
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, data=params, headers=headers, auth=auth)
-		else:
-			r = requests.post(url, data=params, headers=headers)
-
-		if r:
-			returned = json.loads(r.text)
-			return returned['returnCardId']
-		else:
-			return "CARD NUMBER FROM TESA CHECK IN"
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_check_in', 'POST', data=params, headers=headers)
+	if r is not None:
+		return r.json()['returnCardId']
 
 def tesa_read_card(track, pcId="", cmd="RC", technology="P", cardOperation="EF", encoder="1", format="T", message="" ):
 
@@ -381,19 +291,9 @@ def tesa_read_card(track, pcId="", cmd="RC", technology="P", cardOperation="EF",
 	# {"pcId": "", "cmd": "RC", "technology": "P", "cardOperation": "EF", "encoder":
 	# 	"1", "format": "T", "track": "3", "message": ""}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json', 'Accept': 'text/plain'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -406,17 +306,9 @@ def tesa_read_card(track, pcId="", cmd="RC", technology="P", cardOperation="EF",
 		'message': message,
 	}
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, data=params, headers=headers, auth=auth)
-		else:
-			r = requests.post(url, data=params, headers=headers)
-
-		if r:
-			returned = json.loads(r.text)
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_read_card', 'POST', idempotent=True, data=params, headers=headers)
+	if r is not None:
+		return r.json()
 
 def tesa_read_card1(track, pcId="", cmd="RC", technology="P", cardOperation="EF", encoder="1", format="T", message="" ):
 
@@ -424,19 +316,9 @@ def tesa_read_card1(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 	# {"pcId": "", "cmd": "RC", "technology": "P", "cardOperation": "EF", "encoder":
 	# 	"1", "format": "T", "track": "3", "message": ""}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json', 'Accept': 'text/plain'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -449,19 +331,9 @@ def tesa_read_card1(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 		'message': message,
 	}
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, json=params, auth=auth)
-		else:
-			r = requests.post(url, json=params)
-
-		if r:
-			print("headers: ")
-			print(r.headers)
-			returned = json.loads(r.text)
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_read_card1', 'POST', idempotent=True, json=params)
+	if r is not None:
+		return r.json()
 
 def tesa_read_card2(track, pcId="", cmd="RC", technology="P", cardOperation="EF", encoder="1", format="T", message="" ):
 
@@ -469,19 +341,9 @@ def tesa_read_card2(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 	# {"pcId": "", "cmd": "RC", "technology": "P", "cardOperation": "EF", "encoder":
 	# 	"1", "format": "T", "track": "3", "message": ""}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json', 'Accept': 'text/plain'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -494,19 +356,9 @@ def tesa_read_card2(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 		'message': message,
 	}
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, data=json.dumps(params), auth=auth)
-		else:
-			r = requests.post(url, data=json.dumps(params))
-
-		if r:
-			print("headers: ")
-			print(r.headers)
-			returned = json.loads(r.text)
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_read_card2', 'POST', idempotent=True, data=json.dumps(params))
+	if r is not None:
+		return r.json()
 
 def tesa_read_card3(track, pcId="", cmd="RC", technology="P", cardOperation="EF", encoder="1", format="T", message="" ):
 
@@ -514,19 +366,9 @@ def tesa_read_card3(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 	# {"pcId": "", "cmd": "RC", "technology": "P", "cardOperation": "EF", "encoder":
 	# 	"1", "format": "T", "track": "3", "message": ""}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json', 'Accept': 'text/plain'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -539,19 +381,9 @@ def tesa_read_card3(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 		'message': message,
 	}
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, data=params, headers=headers, auth=auth)
-		else:
-			r = requests.post(url, data=params, headers=headers)
-
-		if r:
-			print("headers: ")
-			print(r.headers)
-			returned = json.loads(r.text)
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
+	r = get_door_lock_client('TESA').request('tesa_read_card3', 'POST', idempotent=True, data=params, headers=headers)
+	if r is not None:
+		return r.json()
 
 def tesa_read_card4(track, pcId="", cmd="RC", technology="P", cardOperation="EF", encoder="1", format="T", message="" ):
 
@@ -559,19 +391,9 @@ def tesa_read_card4(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 	# {"pcId": "", "cmd": "RC", "technology": "P", "cardOperation": "EF", "encoder":
 	# 	"1", "format": "T", "track": "3", "message": ""}
 
-	# api-endpoint
-	url = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_url')
-	username = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_user')
-	password = frappe.db.get_single_value('Inn Hotels Setting', 'card_api_password')
-	is_card_use_auth = int(frappe.db.get_single_value('Inn Hotels Setting', 'card_use_auth'))
-
 	# defining header JSON
 	headers = {'Content-Type': 'application/json'}
 
-	# defining auth to be sent to the API
-	if is_card_use_auth == 1:
-		auth = (username, password)
-
 	# defining a params dict for the parameters to be sent to the API
 	params = {
 		'pcId': pcId,
@@ -584,16 +406,6 @@ def tesa_read_card4(track, pcId="", cmd="RC", technology="P", cardOperation="EF"
 		'message': message,
 	}
 
-	if url is not None:
-		if is_card_use_auth == 1:
-			r = requests.post(url, data=params, headers=headers, auth=auth)
-		else:
-			r = requests.post(url, data=params, headers=headers)
-
-		if r:
-			print("headers: ")
-			print(r.headers)
-			returned = json.loads(r.text)
-			return returned
-	else:
-		frappe.msgprint("Card API url not defined yet. Define the URL in Inn Hotel Setting")
\ No newline at end of file
+	r = get_door_lock_client('TESA').request('tesa_read_card4', 'POST', idempotent=True, data=params, headers=headers)
+	if r is not None:
+		return r.json()
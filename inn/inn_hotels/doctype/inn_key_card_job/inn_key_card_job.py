@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and contributors
+# For license information, please see license.txt
+
+'''
+Inn Key Card Job is one card operation (Issue, Duplicate, Erase, Verify) handed to a card encoder in the background,
+so the desk does not wait while the card is written.
+
+Jobs of an encoder are run one at a time in the order they were queued by process_encoder_queue, whatever the number
+of background workers: an encoder writes a single card at once. Every change of status is published to the user who
+queued the job through the inn_key_card_job realtime event.
+'''
+
+from __future__ import unicode_literals
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, now, now_datetime
+from inn.inn_hotels.doctype.inn_key_card.inn_key_card import erase_card, issue_card, read_card
+
+KEY_CARD_JOB_EVENT = 'inn_key_card_job'
+KEY_CARD_OPERATIONS = ('Issue', 'Duplicate', 'Erase', 'Verify')
+DEFAULT_ENCODER = '1'
+# held by the background job talking to an encoder, it outlives a stuck job by ENCODER_LOCK_TTL seconds at most
+ENCODER_LOCK_KEY = 'inn_key_card_encoder'
+ENCODER_LOCK_TTL = 300
+
+class InnKeyCardJob(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index('Inn Key Card Job', ['encoder', 'status'])
+
+@frappe.whitelist()
+def queue_key_card_job(operation, reservation_id=None, key_card=None, encoder=None):
+	'''
+	queue one card operation, the result comes back through the inn_key_card_job realtime event.
+	:return name of the Inn Key Card Job
+	'''
+	return new_key_card_job(operation, reservation_id, key_card, encoder).name
+
+@frappe.whitelist()
+def queue_issue_cards(reservation_ids, encoder=None):
+	'''
+	queue the cards of a group check-in, one Issue job per In House reservation, written one after another by the encoder.
+	:return names of the Inn Key Card Job
+	'''
+	reservation_ids = frappe.parse_json(reservation_ids)
+	return [new_key_card_job('Issue', reservation_id, encoder=encoder).name for reservation_id in reservation_ids]
+
+def new_key_card_job(operation, reservation_id=None, key_card=None, encoder=None):
+	if operation not in KEY_CARD_OPERATIONS:
+		frappe.throw("Key card operation must be one of {0}".format(', '.join(KEY_CARD_OPERATIONS)))
+
+	if operation == 'Erase':
+		reservation_id = frappe.db.get_value('Inn Key Card', key_card, 'parent')
+	# the job itself is inserted ignoring permissions, the desk user must be allowed to change the reservation
+	if reservation_id:
+		frappe.has_permission('Inn Reservation', 'write', reservation_id, throw=True)
+	else:
+		frappe.has_permission('Inn Reservation', 'read', throw=True)
+
+	room_id = None
+	if operation in ('Issue', 'Duplicate'):
+		reservation = frappe.db.get_value('Inn Reservation', reservation_id, ['status', 'actual_room_id'], as_dict=True)
+		if not reservation or reservation.status != 'In House':
+			frappe.throw("Card can only be issued for In House Reservation, {0} is not".format(reservation_id))
+		active_card = frappe.db.count('Inn Key Card', {'parent': reservation_id, 'parenttype': 'Inn Reservation', 'is_active': 1})
+		if active_card >= cint(frappe.db.get_single_value('Inn Hotels Setting', 'room_max_active_card') or 5):
+			frappe.throw("Maximum number of active card issued is reached for {0}. Cannot issue more card".format(reservation_id))
+		room_id = reservation.actual_room_id
+	elif operation == 'Erase':
+		card = frappe.db.get_value('Inn Key Card', key_card, ['parent', 'room_id', 'is_active'], as_dict=True)
+		if not card or not card.is_active:
+			frappe.throw("Card already deactivated.")
+		reservation_id = card.parent
+		room_id = card.room_id
+
+	job = frappe.get_doc({
+		'doctype': 'Inn Key Card Job',
+		'operation': operation,
+		'status': 'Queued',
+		'encoder': encoder or DEFAULT_ENCODER,
+		'reservation_id': reservation_id,
+		'key_card': key_card,
+		'room_id': room_id,
+	}).insert(ignore_permissions=True)
+
+	enqueue_encoder_queue(job.encoder, after_commit=True)
+	publish_key_card_job(job)
+	return job
+
+def enqueue_encoder_queue(encoder, after_commit=False):
+	frappe.enqueue('inn.inn_hotels.doctype.inn_key_card_job.inn_key_card_job.process_encoder_queue',
+				   queue='short', job_name='Inn Key Card Encoder ' + encoder,
+				   enqueue_after_commit=after_commit, encoder=encoder)
+
+def process_encoder_queue(encoder):
+	'''
+	background job writing the oldest queued card of one encoder, then enqueuing itself again while cards are left,
+	so every RQ job stays far below the timeout of the short queue whatever the size of a group check-in.
+	only the job holding the encoder lock talks to the encoder, the others return at once and leave their card to it.
+	'''
+	token = acquire_encoder(encoder)
+	if not token:
+		return
+	try:
+		job_id = get_next_queued_job(encoder)
+		if job_id:
+			run_key_card_job(job_id)
+	finally:
+		release_encoder(encoder, token)
+
+	# also picks the jobs queued while the lock was held, their own drainer has returned already
+	frappe.db.commit()
+	if get_next_queued_job(encoder):
+		enqueue_encoder_queue(encoder)
+
+def get_next_queued_job(encoder):
+	return frappe.db.get_value('Inn Key Card Job', {'encoder': encoder, 'status': 'Queued'}, 'name', order_by='creation asc')
+
+def sweep_key_card_jobs():
+	'''
+	scheduled every few minutes. a card job whose worker was killed stays Encoding, it is set Failed once its encoder lock
+	expired (the card may have been written, it is not encoded again). encoders left with Queued jobs and no drainer
+	are enqueued again.
+	'''
+	for job_id in frappe.get_all('Inn Key Card Job', filters={'status': 'Encoding',
+			'started_at': ['<', add_to_date(now_datetime(), seconds=-ENCODER_LOCK_TTL)]}, pluck='name'):
+		job = frappe.get_doc('Inn Key Card Job', job_id)
+		values = {'status': 'Failed', 'error': "Encoder job stopped before the card was written, please redo the process.",
+				  'finished_at': now()}
+		frappe.db.set_value('Inn Key Card Job', job_id, values)
+		job.update(values)
+		publish_key_card_job(job)
+	frappe.db.commit()
+
+	for encoder in frappe.get_all('Inn Key Card Job', filters={'status': 'Queued'}, pluck='encoder', distinct=True):
+		# the key is already prefixed by make_key, read it raw as release_encoder does
+		if not frappe.cache().get(get_encoder_lock_key(encoder)):
+			enqueue_encoder_queue(encoder)
+
+def get_encoder_lock_key(encoder):
+	return frappe.cache().make_key(ENCODER_LOCK_KEY + ':' + encoder)
+
+def acquire_encoder(encoder):
+	token = frappe.generate_hash(length=10)
+	key = get_encoder_lock_key(encoder)
+	if frappe.cache().set(key, token, nx=True, ex=ENCODER_LOCK_TTL):
+		return token
+
+def release_encoder(encoder, token):
+	key = get_encoder_lock_key(encoder)
+	if frappe.safe_decode(frappe.cache().get(key) or b'') == token:
+		frappe.cache().delete(key)
+
+def run_key_card_job(job_id):
+	frappe.db.set_value('Inn Key Card Job', job_id, {'status': 'Encoding', 'started_at': now()})
+	job = frappe.get_doc('Inn Key Card Job', job_id)
+	publish_key_card_job(job)
+	frappe.db.commit()
+
+	# the door lock client reports encoder errors with msgprint, the last one is kept as the error of the job
+	frappe.local.message_log = []
+	values = {'status': 'Completed', 'error': None}
+	try:
+		if job.operation in ('Issue', 'Duplicate'):
+			card_number = issue_card(job.reservation_id, duplicate=job.operation == 'Duplicate')
+			if card_number in (None, 'ERROR'):
+				values.update({'status': 'Failed', 'error': get_last_message() or "Error Issuing Card, Please Redo the Process."})
+			else:
+				values['card_number'] = card_number
+		elif job.operation == 'Erase':
+			if erase_card('with', job.key_card) != 0:
+				values.update({'status': 'Failed', 'error': get_last_message() or "Error Erasing Card, Please Redo the Process."})
+			else:
+				values['card_number'] = frappe.db.get_value('Inn Key Card', job.key_card, 'card_number')
+		elif job.operation == 'Verify':
+			lines = read_card()
+			if lines is None:
+				values.update({'status': 'Failed', 'error': get_last_message() or "Error Reading Card, Please Redo the Process."})
+			else:
+				values['result'] = '\n'.join(lines)
+	except Exception:
+		frappe.db.rollback()
+		values.update({'status': 'Failed', 'error': frappe.get_traceback()})
+		frappe.log_error(title='Inn Key Card Job ' + job_id)
+
+	values['finished_at'] = now()
+	frappe.db.set_value('Inn Key Card Job', job_id, values)
+	job.update(values)
+	publish_key_card_job(job)
+	frappe.db.commit()
+
+def get_last_message():
+	if frappe.local.message_log:
+		message = frappe.parse_json(frappe.local.message_log[-1])
+		return message.get('message') if isinstance(message, dict) else message
+
+def publish_key_card_job(job):
+	frappe.publish_realtime(KEY_CARD_JOB_EVENT, {
+		'name': job.name,
+		'operation': job.operation,
+		'status': job.status,
+		'encoder': job.encoder,
+		'reservation_id': job.reservation_id,
+		'room_id': job.room_id,
+		'card_number': job.card_number,
+		'result': job.result,
+		# the last line of a traceback is the exception itself
+		'error': job.error.strip().splitlines()[-1] if job.error else None,
+	}, user=job.owner, after_commit=True)
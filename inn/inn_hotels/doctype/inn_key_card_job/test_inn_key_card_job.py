@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from unittest.mock import patch
+
+from inn.helper.door_lock import DoorLockSettings
+from inn.helper.door_lock_mock import start_mock_encoder
+from inn.inn_hotels.doctype.inn_key_card_job import inn_key_card_job
+
+ENCODER = 'TEST-ENCODER'
+
+class TestInnKeyCardJob(unittest.TestCase):
+	def setUp(self):
+		self.server = start_mock_encoder('DOWS')
+		settings = DoorLockSettings('DOWS', self.server.url, None)
+		self.published = []
+		self.enqueued = []
+		self.patches = [
+			# a fresh client, the circuit breaker state of other tests does not leak in
+			patch.dict('inn.helper.door_lock._clients', clear=True),
+			patch('inn.helper.door_lock.get_door_lock_settings', return_value=settings),
+			patch('inn.inn_hotels.doctype.inn_key_card.inn_key_card.get_door_lock_settings', return_value=settings),
+			patch.object(inn_key_card_job, 'publish_key_card_job',
+						 side_effect=lambda job: self.published.append((job.name, job.status))),
+			# the RQ drainers are run by the test itself
+			patch.object(inn_key_card_job, 'enqueue_encoder_queue',
+						 side_effect=lambda encoder, after_commit=False: self.enqueued.append(encoder)),
+		]
+		for p in self.patches:
+			p.start()
+
+	def tearDown(self):
+		for p in self.patches:
+			p.stop()
+		self.server.shutdown()
+		frappe.db.delete('Inn Key Card Job', {'encoder': ENCODER})
+		frappe.cache().delete(inn_key_card_job.get_encoder_lock_key(ENCODER))
+		frappe.db.commit()
+
+	def drain(self):
+		while self.enqueued:
+			inn_key_card_job.process_encoder_queue(self.enqueued.pop(0))
+
+	def test_jobs_are_written_in_queue_order(self):
+		jobs = [inn_key_card_job.new_key_card_job('Verify', encoder=ENCODER).name for i in range(3)]
+		self.drain()
+
+		encoding = [name for name, status in self.published if status == 'Encoding']
+		self.assertEqual(encoding, jobs)
+		for name in jobs:
+			statuses = [status for job_name, status in self.published if job_name == name]
+			self.assertEqual(statuses, ['Queued', 'Encoding', 'Completed'])
+			job = frappe.get_doc('Inn Key Card Job', name)
+			self.assertEqual(job.status, 'Completed')
+			self.assertIn('Room = R-101', job.result)
+			self.assertTrue(job.started_at and job.finished_at)
+
+	def test_drainer_leaves_the_encoder_to_the_lock_holder(self):
+		job = inn_key_card_job.new_key_card_job('Verify', encoder=ENCODER).name
+		token = inn_key_card_job.acquire_encoder(ENCODER)
+		inn_key_card_job.process_encoder_queue(ENCODER)
+		self.assertEqual(frappe.db.get_value('Inn Key Card Job', job, 'status'), 'Queued')
+
+		inn_key_card_job.release_encoder(ENCODER, token)
+		self.drain()
+		self.assertEqual(frappe.db.get_value('Inn Key Card Job', job, 'status'), 'Completed')
+
+	def test_encoder_error_fails_the_job(self):
+		self.server.failure_rate = 1
+		job = inn_key_card_job.new_key_card_job('Verify', encoder=ENCODER).name
+		self.drain()
+		self.assertEqual(frappe.db.get_value('Inn Key Card Job', job, 'status'), 'Failed')
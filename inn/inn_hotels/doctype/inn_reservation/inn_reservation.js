@@ -601,31 +601,12 @@ frappe.ui.form.on('Inn Reservation', {
 				frappe.msgprint("Maximum number of active card issued is reached. Cannot issue more card");
 			}
 			else {
-				frappe.call({
-					method: 'inn.inn_hotels.doctype.inn_key_card.inn_key_card.issue_card',
-					args: {
-						reservation_id: frm.doc.name
-					},
-					callback: (r) => {
-						if (r.message !== 'ERROR') {
-							frm.reload_doc();
-							frappe.show_alert(__("Card " + r.message + " issued for this Reservation.")); return;
-						}
-						else {
-							frappe.msgprint("Error Issuing Card, Please Redo the Process.")
-						}
-					}
-				});
+				queue_key_card_job(frm, 'Issue', {reservation_id: frm.doc.name});
 			}
 		}
 	},
-	verify_card: function () {
-		frappe.call({
-			method: 'inn.inn_hotels.doctype.inn_key_card.inn_key_card.verify_card',
-			args: {
-				track: "3"
-			}
-		});
+	verify_card: function (frm) {
+		queue_key_card_job(frm, 'Verify', {});
 	},
 	test_1: function () {
 		frappe.call({
@@ -664,7 +645,7 @@ frappe.ui.form.on('Inn Key Card', {
 	erase_card: function (frm, cdt, cdn) {
 		let child = locals[cdt][cdn];
 		if (child.is_active === 1) {
-			erase_card('with', child.name);
+			queue_key_card_job(frm, 'Erase', {key_card: child.name});
 		}
 		else {
 			frappe.msgprint("Card already deactivated.");
@@ -985,6 +966,60 @@ function get_room_max_active_card() {
 	});
 }
 
+// Function to hand a card operation to the encoder queue, the desk is told through realtime once the card is written
+function queue_key_card_job(frm, operation, args) {
+	listen_key_card_job();
+	frappe.call({
+		method: 'inn.inn_hotels.doctype.inn_key_card_job.inn_key_card_job.queue_key_card_job',
+		args: Object.assign({operation: operation}, args),
+		callback: (r) => {
+			if (r.message) {
+				frappe.show_alert(__("Card " + operation + " queued, put the card on the encoder."));
+			}
+		}
+	});
+}
+
+// one handler for the whole desk, removed once the reservation form is left
+let key_card_job_handler = null;
+
+function listen_key_card_job() {
+	if (key_card_job_handler) {
+		return;
+	}
+	key_card_job_handler = (job) => {
+		if (job.status === 'Completed') {
+			if (job.operation === 'Verify') {
+				frappe.msgprint(job.result.split('\n').join('<br />'));
+			}
+			else if (job.operation === 'Erase') {
+				frappe.show_alert(__("Card " + job.card_number + " Erased."));
+			}
+			else {
+				frappe.show_alert(__("Card " + job.card_number + " issued for Reservation " + job.reservation_id + "."));
+			}
+			if (cur_frm && cur_frm.doctype === 'Inn Reservation' && job.reservation_id === cur_frm.doc.name) {
+				cur_frm.reload_doc();
+			}
+		}
+		else if (job.status === 'Failed') {
+			frappe.msgprint(__("Error on Card " + job.operation + " of " + (job.reservation_id || job.name) + ": " + job.error));
+		}
+	};
+	frappe.realtime.on('inn_key_card_job', key_card_job_handler);
+	frappe.router.on('change', stop_listening_key_card_job);
+}
+
+function stop_listening_key_card_job() {
+	let route = frappe.get_route();
+	if (route[0] === 'Form' && route[1] === 'Inn Reservation') {
+		return;
+	}
+	frappe.realtime.off('inn_key_card_job', key_card_job_handler);
+	frappe.router.off('change', stop_listening_key_card_job);
+	key_card_job_handler = null;
+}
+
 // Function to erase the priviledge of key card to open room door
 function erase_card(flag, card_name) {
 	console.log('card_name = ' + card_name);
@@ -30,6 +30,20 @@ frappe.listview_settings['Inn Reservation'] = {
             }
 
         });
+        listview.page.add_action_item(__('Issue Key Card'), function () {
+            frappe.call({
+                method: 'inn.inn_hotels.doctype.inn_key_card_job.inn_key_card_job.queue_issue_cards',
+                args: {
+                    reservation_ids: listview.get_checked_items(true)
+                },
+                callback: (r) => {
+                    if (r.message) {
+                        listen_group_key_card_job();
+                        frappe.show_alert(__(r.message.length + " cards queued, put them on the encoder one after another."));
+                    }
+                }
+            });
+        });
         listview.page.add_action_item(__('Cancel'), function () {
             let reservation_to_cancel = listview.get_checked_items(true);
             frappe.confirm(
@@ -80,4 +94,33 @@ frappe.listview_settings['Inn Reservation'] = {
             );
         });
     }
-};
\ No newline at end of file
+};
+
+// one handler for the group cards queued from the list, removed once the list is left
+let group_key_card_job_handler = null;
+
+function listen_group_key_card_job() {
+    if (group_key_card_job_handler) {
+        return;
+    }
+    group_key_card_job_handler = (job) => {
+        if (job.status === 'Completed' && job.operation === 'Issue') {
+            frappe.show_alert(__("Card " + job.card_number + " issued for Reservation " + job.reservation_id + "."));
+        }
+        else if (job.status === 'Failed') {
+            frappe.msgprint(__("Error on Card " + job.operation + " of " + (job.reservation_id || job.name) + ": " + job.error));
+        }
+    };
+    frappe.realtime.on('inn_key_card_job', group_key_card_job_handler);
+    frappe.router.on('change', stop_listening_group_key_card_job);
+}
+
+function stop_listening_group_key_card_job() {
+    let route = frappe.get_route();
+    if (route[0] === 'List' && route[1] === 'Inn Reservation') {
+        return;
+    }
+    frappe.realtime.off('inn_key_card_job', group_key_card_job_handler);
+    frappe.router.off('change', stop_listening_group_key_card_job);
+    group_key_card_job_handler = null;
+}
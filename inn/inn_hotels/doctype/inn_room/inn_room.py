@@ -10,9 +10,17 @@ from frappe.exceptions import DoesNotExistError
 from frappe.model.document import Document
 from datetime import date, timedelta
 from dateutil.parser import parse
+from inn.inn_hotels.doctype.inn_room_booking.inn_room_booking import refresh_floor_plan_status_after_commit
 
 class InnRoom(Document):
-	pass
+	def on_update(self):
+		refresh_floor_plan_status_after_commit([self.name])
+
+	def on_trash(self):
+		refresh_floor_plan_status_after_commit([self.name])
+
+	def after_rename(self, old, new, merge=False):
+		refresh_floor_plan_status_after_commit([old, new])
 
 @frappe.whitelist()
 def get_max_floor():
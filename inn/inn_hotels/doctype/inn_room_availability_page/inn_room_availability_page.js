@@ -76,84 +76,73 @@ function search(doc) {
 			start.setDate(start.getDate() + 1);
 		}
 
+		// the matrix is loaded one floor at a time, every floor in a single request
 		frappe.call({
-			method: 'inn.inn_hotels.doctype.inn_room.inn_room.get_all_inn_room',
+			method: 'inn.inn_hotels.doctype.inn_room_availability_page.inn_room_availability_page.get_room_floors',
 			callback: (resp) => {
-				resp.message.forEach(elm => {
-					var tr = document.createElement('tr');
-					tr.className = 'grid-row';
-
-					var td = document.createElement('td');
-					td.className = 'frozen';
-					td.innerHTML = elm.name;
-					tr.appendChild(td);
-
-					var td = document.createElement('td');
-					td.className = 'grid-static-col';
-					td.innerHTML = elm.room_type;
-					tr.appendChild(td);
-
-					var td = document.createElement('td');
-					td.className = 'grid-static-col';
-					td.innerHTML = elm.bed_type;
-					tr.appendChild(td);
-
-					var td = document.createElement('td');
-					td.className = 'grid-static-col';
-					td.innerHTML = elm.allow_smoke;
-					tr.appendChild(td);
-
-					var td = document.createElement('td');
-					td.className = 'grid-static-col';
-					td.innerHTML = elm.view;
-					tr.appendChild(td);
-
-					var td = document.createElement('td');
-					td.className = 'grid-static-col';
-					td.innerHTML = elm.room_status;
-					tr.appendChild(td);
+				var floors = resp.message.length > 1 ? resp.message : [undefined];
+				var load_floor = function(index) {
+					if (index >= floors.length) {
+						return;
+					}
+					frappe.call({
+						method: 'inn.inn_hotels.doctype.inn_room_availability_page.inn_room_availability_page.get_availability_matrix',
+						args: {
+							start: doc.start,
+							end: doc.end,
+							floor: floors[index]
+						},
+						callback: (resp) => {
+							render_rooms(resp.message);
+							load_floor(index + 1);
+						}
+					});
+				}
+				load_floor(0);
+			}
+		});
+	}
+}
 
-					var start = new Date(doc.start);
-					var	end = new Date(doc.end);
+function render_rooms(matrix) {
+	var table = document.getElementById('table-calendar');
+	var fragment = document.createDocumentFragment();
 
-					var loop = function(start, end) {
-						get_availability(start, function(){
-							start.setDate(start.getDate() + 1);
-							if (start <= end) {
-								loop(start, end);
-							}
-						})
-					}
+	matrix.rooms.forEach(elm => {
+		var tr = document.createElement('tr');
+		tr.className = 'grid-row';
 
-					function get_availability(date, fun) {
-						var dateCopied = new Date(date);
-						dateCopied = formatDate(dateCopied);
+		var td = document.createElement('td');
+		td.className = 'frozen';
+		td.innerHTML = elm.name;
+		tr.appendChild(td);
 
-						frappe.call({
-							method: 'inn.inn_hotels.doctype.inn_room_availability_page.inn_room_availability_page.get_room_availability',
-							args: {
-								room_id: elm.name,
-								date: formatDate(date)
-							},
-							callback: (resp) => {
-								var td = document.createElement('td');
-								td.className = 'grid-static-col';
-								td.innerHTML = resp.message;
-								td.ondblclick = function() {
-									book_dialog(elm.name, dateCopied, resp.message);
-								}
-								tr.appendChild(td);
+		['room_type', 'bed_type', 'allow_smoke', 'view', 'room_status'].forEach(field => {
+			var td = document.createElement('td');
+			td.className = 'grid-static-col';
+			td.innerHTML = elm[field];
+			tr.appendChild(td);
+		});
 
-								fun();
-							}
-						});
-					}
-					loop(start, end);
-					document.getElementById('table-calendar').appendChild(tr);
-				});
+		elm.cells.forEach((cell, i) => {
+			var date = matrix.dates[i];
+			var availability = cell ? cell[0] : '';
+			var td = document.createElement('td');
+			td.className = 'grid-static-col';
+			td.innerHTML = availability;
+			if (cell && cell[2]) {
+				td.title = cell[2];
+			}
+			td.ondblclick = function() {
+				book_dialog(elm.name, date, availability);
 			}
+			tr.appendChild(td);
 		});
-	}
+
+		fragment.appendChild(tr);
+	});
+
+	table.appendChild(fragment);
 }
 
 function formatDate(date) {
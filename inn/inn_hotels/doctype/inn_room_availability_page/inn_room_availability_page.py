@@ -4,7 +4,9 @@
 
 from __future__ import unicode_literals
 import frappe
+from datetime import timedelta
 from frappe.model.document import Document
+from frappe.utils import getdate
 
 class InnRoomAvailabilityPage(Document):
 	pass
@@ -13,13 +15,55 @@ class InnRoomAvailabilityPage(Document):
 def get_room_availability(room_id, date):
 	availability = frappe.db.sql(
 		'SELECT room_availability '
-		'FROM `tabInn Room Booking` '
-		'WHERE status != "Canceled" '
-		'AND room_id = %s '
-		'AND %s >= start '
-		'AND %s < end',
-		(room_id, date, date))
+		'FROM `tabInn Room Night` '
+		'WHERE room_id = %s '
+		'AND date = %s',
+		(room_id, date))
 	if len(availability) > 0:
 		return availability
 	else:
 		return ''
+
+
+@frappe.whitelist()
+def get_room_floors():
+	# floors of the hotel, '' for rooms without floor, the page loads its matrix one floor at a time
+	return [floor for (floor,) in frappe.db.sql(
+		"SELECT DISTINCT ifnull(floor, '') FROM `tabInn Room` ORDER BY ifnull(floor, '')")]
+
+@frappe.whitelist()
+def get_availability_matrix(start, end, floor=None):
+	'''
+	rooms x dates availability of the Room Availability Page in one response.
+	:param start first date of the matrix
+	:param end last date of the matrix, included
+	:param floor only rooms of this floor ('' for rooms without floor), every room when omitted
+	:return {'dates': [date], 'rooms': [room fields + 'cells': [[availability, room booking, note] or None per date]]}
+	'''
+	start = getdate(start)
+	end = getdate(end)
+	dates = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+
+	filters = {}
+	if floor is not None:
+		filters['floor'] = floor if floor else ['is', 'not set']
+	rooms = frappe.get_all('Inn Room', filters=filters,
+						   fields=['name', 'room_type', 'bed_type', 'allow_smoke', 'view', 'room_status', 'floor'],
+						   order_by='name asc')
+	if not rooms or not dates:
+		return {'dates': dates, 'rooms': []}
+
+	cells = {}
+	for night in frappe.db.sql(
+		'SELECT irn.room_id, irn.date, irn.room_availability, irn.room_booking, irb.note '
+		'FROM `tabInn Room Night` as irn '
+		'INNER JOIN `tabInn Room Booking` as irb ON irb.name = irn.room_booking '
+		'WHERE irn.date BETWEEN %s AND %s AND irn.room_id IN %s '
+		'ORDER BY irn.room_id, irn.date, irb.creation',
+		(start, end, [room.name for room in rooms]), as_dict=True):
+		cells.setdefault((night.room_id, night.date), [night.room_availability, night.room_booking, night.note])
+
+	for room in rooms:
+		room.cells = [cells.get((room.name, date)) for date in dates]
+
+	return {'dates': dates, 'rooms': rooms}
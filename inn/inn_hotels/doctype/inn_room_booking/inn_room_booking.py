@@ -6,13 +6,34 @@ from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
 from inn.inn_hotels.doctype.inn_folio.inn_folio import update_close_by_reservation
+from inn.inn_hotels.doctype.inn_room_night.inn_room_night import sync_room_nights, delete_room_nights
 from datetime import date
+from functools import partial
 from dateutil.parser import parse
 
 
+FLOOR_PLAN_CACHE_KEY = 'inn_floor_plan_status'
+# set once the snapshot holds every room, kept apart: hgetall returns the field names of the hash as bytes
+FLOOR_PLAN_BUILT_KEY = 'inn_floor_plan_status_built'
+FLOOR_PLAN_EVENT = 'inn_floor_plan_status'
+ROOM_AVAILABILITY_STATUS_CODE = {
+    'Room Sold': 'RS',
+    'Under Construction': 'UC',
+    'Office Use': 'OU',
+    'Out of Order': 'OO',
+    'House Use': 'HU',
+    'Room Compliment': 'RC',
+}
+
+
 class InnRoomBooking(Document):
 
     def on_update(self):
+        # keep the room-night occupancy index in sync with this booking
+        sync_room_nights(self)
+        previous = self.get_doc_before_save()
+        refresh_floor_plan_status_after_commit([self.room_id, previous.room_id if previous else None])
+
         if frappe.db.exists("Inn Guest Booking Room", {"inn_room_booking": self.name}, cache=True):
             gbr = frappe.get_doc("Inn Guest Booking Room", {
                                  "inn_room_booking": self.name}, cache=True)
@@ -37,6 +58,10 @@ class InnRoomBooking(Document):
             frappe.db.set_value('Inn Room', self.room_id,
                                 'room_status', room_status)
 
+    def on_trash(self):
+        delete_room_nights(self.name)
+        refresh_floor_plan_status_after_commit([self.room_id])
+
 
 @frappe.whitelist()
 # Keep the Room Booking valid when Reservation created or updated
@@ -132,167 +157,160 @@ def update_by_reservation(reservation_id):
 
 @frappe.whitelist()
 def get_room_available(doctype, txt, searchfield, start, page_len, filters):
-    room_list = []
-    if filters.get('phase') == 'Check In':
-        if filters.get('start') and filters.get('end'):
-            if filters.get('room_type'):
-                if filters.get('bed_type'):
-                    room_list = list(frappe.db.sql(
-                        "select name, room_type, bed_type from `tabInn Room` where room_status = 'Vacant Ready' and room_type = %s and bed_type = %s",
-                        (filters.get('room_type'), filters.get('bed_type'))
-                    ))
-                else:
-                    room_list = list(frappe.db.sql(
-                        "select name, room_type, bed_type from `tabInn Room` where room_status = 'Vacant Ready' and room_type = %s",
-                        (filters.get('room_type'))
-                    ))
-            else:
-                room_list = list(frappe.db.sql(
-                    "select name, room_type, bed_type from `tabInn Room` where room_status = 'Vacant Ready' "
-                ))
-    else:
-        if filters.get('start') and filters.get('end'):
-            if filters.get('room_type'):
-                if filters.get('bed_type'):
-                    room_list = list(frappe.db.sql(
-                        "select name, room_type, bed_type from `tabInn Room` where room_type = %s and bed_type = %s",
-                        (filters.get('room_type'), filters.get('bed_type'))
-                    ))
-                else:
-                    room_list = list(frappe.db.sql(
-                        "select name, room_type, bed_type from `tabInn Room` where room_type = %s",
-                        (filters.get('room_type'))
-                    ))
-            else:
-                room_list = list(frappe.db.sql(
-                    "select name, room_type, bed_type from `tabInn Room`"
-                ))
-
-    room_book_list = get_room_book_list(filters)
-
-    for room_book in room_book_list:
-        for item in room_list:
-            if item[0] == room_book[0]:
-                room_list.remove(item)
-
-    return room_list
+    return query_available_room('name', ['name', 'room_type', 'bed_type'], filters, txt, start, page_len)
 
 
 @frappe.whitelist()
 def get_room_type_available(doctype, txt, searchfield, start, page_len, filters):
-    room_list = get_room_available(
-        doctype, txt, searchfield, start, page_len, filters)
-
-    tmp = []
-    room_type_list = []
-
-    for room in room_list:
-        tmp.append(room[1])
-
-    tmp = list(set(tmp))
-
-    for t in tmp:
-        room_type_list.append([t])
-
-    return room_type_list
+    return query_available_room('room_type', ['room_type'], filters, txt, start, page_len)
 
 
 @frappe.whitelist()
 def get_bed_type_available(doctype, txt, searchfield, start, page_len, filters):
-    room_list = get_room_available(
-        doctype, txt, searchfield, start, page_len, filters)
-
-    tmp = []
-    bed_type_list = []
-
-    for room in room_list:
-        if room[1] == filters.get('room_type'):
-            tmp.append(room[2])
-
-    tmp = list(set(tmp))
-
-    for t in tmp:
-        bed_type_list.append([t])
-
-    return bed_type_list
-
-
-def get_room_book_list(filters):
-    room_book_list = list(frappe.db.sql(
-        "select irb.room_id from `tabInn Room Booking` as irb "
-        "where irb.reference_name != %s "
-        "and irb.status = 'Booked' "
-        "and irb.room_availability = 'Room Sold' "
-        "and irb.start != irb.end "
-        "and ((%s >= irb.start and %s < irb.end) "
-        "or (%s > irb.start and %s <= irb.end) "
-        "or (%s < irb.start and %s > irb.end))",
-        (filters.get('reference_name'),
-         filters.get('start'), filters.get('start'),
-         filters.get('end'), filters.get('end'),
-         filters.get('start'), filters.get('end'))
-    ))
-    room_book_list.extend(list(frappe.db.sql(
-        "select irb.room_id from `tabInn Room Booking` as irb "
-        "where irb.status = 'Booked' "
-        "and irb.room_availability in ('Under Construction', 'Office Use', 'Out of Order', 'House Use', 'Room Compliment') "
-        "and irb.start != irb.end "
-        "and ((%s >= irb.start and %s < irb.end) "
-        "or (%s > irb.start and %s <= irb.end) "
-        "or (%s < irb.start and %s > irb.end))",
-        (filters.get('start'), filters.get('start'),
-         filters.get('end'), filters.get('end'),
-         filters.get('start'), filters.get('end'))
-    )))
-    return room_book_list
+    if not filters.get('room_type'):
+        return []
+    return query_available_room('bed_type', ['bed_type'], filters, txt, start, page_len)
+
+
+def query_available_room(search_field, fields, filters, txt='', start=0, page_len=20):
+    """
+    rooms without a Booked night within [filters.start, filters.end), the search of the room, room type and bed type pickers.
+    booked rooms are excluded with a NOT EXISTS anti-join on the (room_id, date) index of Inn Room Night,
+    txt, start and page_len are applied by the database. results are shared by the pickers within one request.
+
+    :param search_field column of Inn Room matched against txt, distinct values are returned when it is not name
+    :param fields columns of Inn Room to return
+    :return list of tuple
+    """
+    if not filters.get('start') or not filters.get('end'):
+        return []
+
+    key = (search_field, tuple(fields), filters.get('phase'), filters.get('start'), filters.get('end'),
+           filters.get('reference_name'), filters.get('room_type'), filters.get('bed_type'),
+           txt or '', int(start or 0), int(page_len or 20))
+    request_results = frappe.local.cache.setdefault('inn_available_room', {})
+    if key in request_results:
+        return request_results[key]
+
+    conditions = []
+    values = {
+        'start': filters.get('start'),
+        'end': filters.get('end'),
+        'reference_name': filters.get('reference_name') or '',
+        'txt': '%{0}%'.format(txt or ''),
+        'offset': int(start or 0),
+        'page_len': int(page_len or 20),
+    }
+    if filters.get('phase') == 'Check In':
+        conditions.append("r.room_status = 'Vacant Ready'")
+    if filters.get('room_type'):
+        conditions.append('r.room_type = %(room_type)s')
+        values['room_type'] = filters.get('room_type')
+    if filters.get('room_type') and filters.get('bed_type') and search_field == 'name':
+        conditions.append('r.bed_type = %(bed_type)s')
+        values['bed_type'] = filters.get('bed_type')
+    if search_field != 'name':
+        conditions.append("ifnull(r.{0}, '') != ''".format(search_field))
+
+    result = frappe.db.sql("""
+        select {distinct} {fields}
+        from `tabInn Room` as r
+        where r.{search_field} like %(txt)s
+        {conditions}
+        and not exists (
+            select 1 from `tabInn Room Night` as irn
+            inner join `tabInn Room Booking` as irb on irb.name = irn.room_booking
+            where irn.room_id = r.name
+            and irn.date >= %(start)s and irn.date < %(end)s
+            and irn.status = 'Booked'
+            and (irn.room_availability != 'Room Sold' or coalesce(irb.reference_name, '') != %(reference_name)s)
+        )
+        order by r.{search_field}
+        limit %(offset)s, %(page_len)s
+    """.format(
+        distinct='' if search_field == 'name' else 'distinct',
+        fields=', '.join('r.{0}'.format(field) for field in fields),
+        search_field=search_field,
+        conditions=''.join(' and ' + condition for condition in conditions),
+    ), values)
+
+    request_results[key] = result
+    return result
 
 
 @frappe.whitelist()
 def get_all_room_with_room_booking_status():
-    return_list = []
-    room_list = frappe.get_all('Inn Room', fields=['*'])
-    room_booking_list = frappe.get_all('Inn Room Booking', filters={'status': [
-                                       'in', ['Booked', 'Stayed']]}, fields=['*'])
-
-    for room in room_list:
-        return_item = {'name': room.name, 'status': 'AV'}
-        for room_booking in room_booking_list:
-            if room_booking.room_id == room.name:
-                if room_booking.room_availability == 'Room Sold':
-                    return_item['status'] = 'RS'
-                elif room_booking.room_availability == 'Under Construction':
-                    return_item['status'] = 'UC'
-                elif room_booking.room_availability == 'Office Use':
-                    return_item['status'] = 'OU'
-                elif room_booking.room_availability == 'Out of Order':
-                    return_item['status'] = 'OO'
-                elif room_booking.room_availability == 'House Use':
-                    return_item['status'] = 'HU'
-                elif room_booking.room_availability == 'Room Compliment':
-                    return_item['status'] = 'RC'
-            else:
-                pass
-        return_list.append(return_item)
+    # floor plan snapshot, served from the cache and kept up to date by refresh_floor_plan_status
+    if frappe.cache().get_value(FLOOR_PLAN_BUILT_KEY):
+        snapshot = frappe.cache().hgetall(FLOOR_PLAN_CACHE_KEY)
+        if snapshot:
+            return list(snapshot.values())
+
+    return_list = get_floor_plan_status()
+    for item in return_list:
+        frappe.cache().hset(FLOOR_PLAN_CACHE_KEY, item['name'], item)
+    frappe.cache().set_value(FLOOR_PLAN_BUILT_KEY, 1)
 
     return return_list
 
 
+def get_floor_plan_status(room_ids=None):
+    """
+    :param room_ids optional list of Inn Room, default is every room
+    :return list of {'name', 'status'}, status is the code of the room availability of its Booked/Stayed booking
+    """
+    room_filters = {'name': ['in', room_ids]} if room_ids else {}
+    room_list = frappe.get_all('Inn Room', filters=room_filters, pluck='name')
+
+    booking_filters = {'status': ['in', ['Booked', 'Stayed']]}
+    if room_ids:
+        booking_filters['room_id'] = ['in', room_ids]
+    # dict-indexed join, when a room has several bookings the least recently modified one wins as before
+    room_status_code = {}
+    for room_booking in frappe.get_all('Inn Room Booking', filters=booking_filters,
+                                       fields=['room_id', 'room_availability'], order_by='modified desc'):
+        code = ROOM_AVAILABILITY_STATUS_CODE.get(room_booking.room_availability)
+        if code:
+            room_status_code[room_booking.room_id] = code
+
+    return [{'name': room_id, 'status': room_status_code.get(room_id, 'AV')} for room_id in room_list]
+
+
+def refresh_floor_plan_status(room_ids):
+    """
+    recompute the floor plan status of some rooms, update the cached snapshot and push it to the desk.
+    meant to run after commit, so the snapshot never holds uncommitted state.
+    """
+    room_ids = [room_id for room_id in set(room_ids) if room_id]
+    if not room_ids:
+        return
+
+    is_built = frappe.cache().get_value(FLOOR_PLAN_BUILT_KEY)
+    found = set()
+    for item in get_floor_plan_status(room_ids):
+        found.add(item['name'])
+        if is_built:
+            frappe.cache().hset(FLOOR_PLAN_CACHE_KEY, item['name'], item)
+        frappe.publish_realtime(FLOOR_PLAN_EVENT, item)
+
+    # deleted rooms
+    for room_id in set(room_ids) - found:
+        frappe.cache().hdel(FLOOR_PLAN_CACHE_KEY, room_id)
+        frappe.publish_realtime(FLOOR_PLAN_EVENT, {'name': room_id, 'status': None})
+
+
+def refresh_floor_plan_status_after_commit(room_ids):
+    frappe.db.after_commit.add(partial(refresh_floor_plan_status, list(room_ids)))
+
+
 @frappe.whitelist()
 def is_available(room_id, start, end, name):
-    if name:
-        result = frappe.db.sql(
-            'SELECT room_id FROM `tabInn Room Booking` '
-            'WHERE %s != name AND %s = room_id AND status = "Booked" AND (start != end) AND '
-            '((%s >= start AND %s < end) OR (%s > start AND %s <= end) OR (%s < start AND %s > end))',
-            (name, room_id, start, start, end, end, start, end)
-        )
-    else:
-        result = frappe.db.sql(
-            'SELECT room_id FROM `tabInn Room Booking` '
-            'WHERE %s = room_id AND status = "Booked" AND (start != end) AND '
-            '((%s >= start AND %s < end) OR (%s > start AND %s <= end) OR (%s < start AND %s > end))',
-            (room_id, start, start, end, end, start, end)
-        )
+    result = frappe.db.sql(
+        'SELECT room_id FROM `tabInn Room Night` '
+        'WHERE room_id = %(room_id)s AND status = "Booked" AND date >= %(start)s AND date < %(end)s '
+        'AND room_booking != %(name)s LIMIT 1',
+        {'room_id': room_id, 'start': start, 'end': end, 'name': name or ''}
+    )
 
     if result:
         return False
@@ -303,10 +321,9 @@ def is_available(room_id, start, end, name):
 @frappe.whitelist()
 def get_name_within_date_range(room_id, start, end):
     result = frappe.db.sql(
-        'SELECT name FROM `tabInn Room Booking` '
-        'WHERE %s = room_id AND (status = "Booked" OR status = "Stayed") AND (start != end) AND '
-        '((%s >= start AND %s < end) OR (%s > start AND %s <= end) OR (%s < start AND %s > end))',
-        (room_id, start, start, end, end, start, end)
+        'SELECT DISTINCT room_booking FROM `tabInn Room Night` '
+        'WHERE room_id = %s AND status IN ("Booked", "Stayed") AND date >= %s AND date < %s',
+        (room_id, start, end)
     )
     return result
 
@@ -324,5 +341,7 @@ def get_room_booking_name_by_reservation(reservation_id):
 @frappe.whitelist()
 def get_room_booking(room_id, date):
     return frappe.db.sql(
-        'SELECT name, start, end, room_availability, note FROM `tabInn Room Booking` WHERE status = "Booked" AND room_id = %s AND %s >= start AND %s < end',
-        (room_id, date, date))
+        'SELECT irb.name, irb.start, irb.end, irb.room_availability, irb.note FROM `tabInn Room Night` as irn '
+        'INNER JOIN `tabInn Room Booking` as irb ON irb.name = irn.room_booking '
+        'WHERE irn.status = "Booked" AND irn.room_id = %s AND irn.date = %s',
+        (room_id, date))
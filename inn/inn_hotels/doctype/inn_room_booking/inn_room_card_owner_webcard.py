@@ -5,31 +5,18 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from frappe.utils import flt, now_datetime
 from dateutil.parser import parse
 from datetime import date, timedelta, datetime
 
+# every card of the owner workspace reads the same entry, computed at most once per range per minute
+OWNER_KPI_CACHE_KEY = "inn_owner_dashboard_kpi"
+OWNER_KPI_CACHE_TTL = 60
+REVENUE_TRANSACTION_TYPE = ('Breakfast Charge Tax/Service',
+                            'Breakfast Charge', 'Room Charge', 'Room Charge Tax/Service')
 
-def count_all_room(start_date, end_date):
-    default_availability = frappe.db.count("Inn Room")
-    try:
-        start_date = parse(start_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{start_date} is not a valid date string")
-
-    try:
-        end_date = parse(end_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{end_date} is not a valid date string")
-
-    delta = end_date - start_date
-    if delta.days < 0:
-        raise frappe.ValidationError("start date must before end date")
-
-    return default_availability * delta.days
 
-
-@frappe.whitelist()
-def count_sold_room(start_date=None, end_date=None):
+def parse_date_range(start_date=None, end_date=None):
     if start_date == None and end_date == None:
         start_date = date.today().isoformat()
         end_date = date.today() + timedelta(days=1)
@@ -49,264 +36,112 @@ def count_sold_room(start_date=None, end_date=None):
     if delta.days < 0:
         raise frappe.ValidationError("start date must before end date")
 
-    total_sold = 0
-    # calculate reservation start before start_date and reservation end after start date
-    current_sold = frappe.db.get_values(doctype="Inn Room Booking", filters={"start": ["<", start_date], "end": [
-                                        ">", start_date], "room_availability": "Room Sold"}, fieldname=["start", "end"], as_dict=True)
-    for ii in current_sold:
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
+    return start_date, end_date
+
+
+def get_owner_kpi(start_date=None, end_date=None):
+    """
+    :return dict with all_room, sold_room, used_room, ooo_room (room nights), total_rate and room_charge_count
+    of [start_date, end_date), shared by every number card through a short lived cache entry
+    """
+    start_date, end_date = parse_date_range(start_date, end_date)
+    key = "{0}:{1}|{2}".format(OWNER_KPI_CACHE_KEY, start_date, end_date)
+    kpi = frappe.cache().get_value(key)
+    if kpi is None:
+        kpi = compute_owner_kpi(start_date, end_date)
+        frappe.cache().set_value(key, kpi, expires_in_sec=OWNER_KPI_CACHE_TTL)
+    return kpi
+
+
+def compute_owner_kpi(start_date, end_date):
+    kpi = frappe._dict({
+        "all_room": frappe.db.count("Inn Room") * (end_date - start_date).days,
+        "sold_room": 0,
+        "used_room": 0,
+        "ooo_room": 0,
+    })
+
+    # room nights of the range grouped by availability and status, from the room-night index
+    for room_availability, status, nights in frappe.db.sql("""
+        select room_availability, status, count(*)
+        from `tabInn Room Night`
+        where date >= %s and date < %s
+        group by room_availability, status
+    """, (start_date, end_date)):
+        if room_availability == "Room Sold":
+            kpi.sold_room += nights
+        if status != "Finished":
+            kpi.used_room += nights
+            if room_availability == "Out of Order":
+                kpi.ooo_room += nights
+
+    # posted room and breakfast charges of the folios of reservations staying in the range
+    revenue = frappe.db.sql("""
+        select sum(trx.amount) as total, sum(trx.transaction_type = 'Room Charge') as count
+        from `tabInn Folio Transaction` as trx
+        where trx.audit_date >= %(start)s and trx.audit_date < %(end)s
+        and trx.transaction_type in %(transaction_type)s
+        and trx.parent in (
+            select tif.name
+            from `tabInn Reservation` as ir
+            inner join `tabInn Folio` as tif on tif.reservation_id = ir.name
+            where (ir.arrival <= %(start)s and ir.expected_departure > %(start)s) or
+            (ir.expected_arrival >= %(start)s and ir.expected_arrival < %(end)s)
+        )
+    """, {"start": start_date, "end": end_date, "transaction_type": REVENUE_TRANSACTION_TYPE}, as_dict=1)[0]
+    kpi.total_rate = flt(revenue.total)
+    kpi.room_charge_count = int(revenue.count or 0)
+
+    # get today because today charge is not yet posted
+    if start_date <= now_datetime().date() < end_date:
+        today = frappe.db.sql("""
+            select sum(actual_room_rate) as total, count(*) as count
+            from `tabInn Reservation` ir
+            where ir.status = 'In House' and ir.expected_arrival <= %s
+        """, start_date, as_dict=1)[0]
+        kpi.total_rate += flt(today.total)
+        kpi.room_charge_count += today.count
+
+    return kpi
 
-        days_sold = (room_end_date - start_date).days
-        total_sold += days_sold
 
-    # calculate reservation start after start_date and reservations start before before_date
-    current_sold = frappe.db.get_values(doctype="Inn Room Booking", filters=[["start", "between", [start_date, end_date]], [
-                                        "room_availability", "=", "Room Sold"]], fieldname=["start", "end"], as_dict=True)
-    for ii in current_sold:
-        room_start_date = ii.start
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
+def count_all_room(start_date, end_date):
+    return get_owner_kpi(start_date, end_date).all_room
 
-        days_sold = (room_end_date - room_start_date).days
-        total_sold += days_sold
 
+@frappe.whitelist()
+def count_sold_room(start_date=None, end_date=None):
     return {
-        "value": total_sold,
+        "value": get_owner_kpi(start_date, end_date).sold_room,
         "fieldtype": "Int"
     }
 
 
 @frappe.whitelist()
 def count_available_room(start_date=None, end_date=None):
-    if start_date == None and end_date == None:
-        start_date = date.today().isoformat()
-        end_date = date.today() + timedelta(days=1)
-        end_date = end_date.isoformat()
-
-    default_availability = frappe.db.count("Inn Room")
-    try:
-        start_date = parse(start_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{start_date} is not a valid date string")
-
-    try:
-        end_date = parse(end_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{end_date} is not a valid date string")
-
-    delta = end_date - start_date
-    if delta.days < 0:
-        raise frappe.ValidationError("start date must before end date")
-
-    all_room = default_availability * delta.days
-
-    total_sold = 0
-    # calculate reservation start before start_date and reservation end after start date
-    current_used = frappe.db.get_values(doctype="Inn Room Booking", filters={"start": ["<", start_date], "end": [
-                                        ">", start_date],  "status": ["!=", "Finished"]}, fieldname=["start", "end"], as_dict=True)
-    for ii in current_used:
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
-
-        days_sold = (room_end_date - start_date).days
-        total_sold += days_sold
-
-    # calculate reservation start after start_date and reservations start before before_date
-    current_used = frappe.db.get_values(doctype="Inn Room Booking", filters=[["start", "between", [
-                                        start_date, end_date]], ["status", "!=", "Finished"]], fieldname=["start", "end"], as_dict=True)
-    for ii in current_used:
-        room_start_date = ii.start
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
-
-        days_sold = (room_end_date - room_start_date).days
-        total_sold += days_sold
-
+    kpi = get_owner_kpi(start_date, end_date)
     return {
-        "value": all_room - total_sold,
+        "value": kpi.all_room - kpi.used_room,
         "fieldtype": "Int"
     }
 
 
 @frappe.whitelist()
 def count_ooo_room(start_date=None, end_date=None):
-    if start_date == None and end_date == None:
-        start_date = date.today().isoformat()
-        end_date = date.today() + timedelta(days=1)
-        end_date = end_date.isoformat()
-
-    try:
-        start_date = parse(start_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{start_date} is not a valid date string")
-
-    try:
-        end_date = parse(end_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{end_date} is not a valid date string")
-
-    delta = end_date - start_date
-    if delta.days < 0:
-        raise frappe.ValidationError("start date must before end date")
-
-    total_sold = 0
-    # calculate reservation start before start_date and reservation end after start date
-    current_ooo = frappe.db.get_values(doctype="Inn Room Booking", filters={"start": ["<", start_date], "end": [
-                                       ">", start_date], "room_availability": "Out of Order", "status": ["!=", "Finished"]}, fieldname=["start", "end"], as_dict=True)
-    for ii in current_ooo:
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
-
-        days_sold = (room_end_date - start_date).days
-        total_sold += days_sold
-
-    # calculate reservation start after start_date and reservations start before before_date
-    current_ooo = frappe.db.get_values(doctype="Inn Room Booking", filters=[["start", "between", [start_date, end_date]], [
-                                       "room_availability", "=", "Out of Order"], ["status", "!=", "Finished"]], fieldname=["start", "end"], as_dict=True)
-    for ii in current_ooo:
-        room_start_date = ii.start
-        room_end_date = ii.end
-        if room_end_date > end_date:
-            room_end_date = end_date
-
-        days_sold = (room_end_date - room_start_date).days
-        total_sold += days_sold
-
     return {
-        "value": total_sold,
+        "value": get_owner_kpi(start_date, end_date).ooo_room,
         "fieldtype": "Int"
     }
 
 
 def calculate_total_rate_and_sold(start_date, end_date):
-    from frappe.utils import now_datetime
-    try:
-        start_date = parse(start_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{start_date} is not a valid date string")
-
-    try:
-        end_date = parse(end_date, False).date()
-    except ValueError:
-        raise frappe.ValidationError("{end_date} is not a valid date string")
-
-    delta = end_date - start_date
-    if delta.days < 0:
-        raise frappe.ValidationError("start date must before end date")
-
-    # total_sold = 0
-    # total_rate = 0
-    # cached_rate = {}
-    # get today because today charge is not yet posted
-    get_today = False
-    if start_date <= now_datetime().date() < end_date:
-        get_today = True
-
-    transaction_type = ('Breakfast Charge Tax/Service',
-                        'Breakfast Charge', 'Room Charge', 'Room Charge Tax/Service')
-    reservation_query = f'''
-        select tif.name as folio_id
-        from `tabInn Reservation` as ir
-        left join `tabInn Folio` as tif
-        on tif.reservation_id = ir.name
-        where 
-        (ir.arrival <= '{start_date}' and ir.expected_departure > '{start_date}') or
-        (ir.expected_arrival >= '{start_date}' and ir.expected_arrival < '{end_date}')
-    '''
-
-    folio_id = frappe.db.sql(reservation_query, as_dict=1)
-    folio_id = tuple([x.folio_id for x in folio_id])
-    if len(folio_id) == 0:
-        # so no need to parse further
-        folio_id = tuple(["", ""])
-
-    transaction_query = f'''
-        select sum(amount) as total
-        from `tabInn Folio Transaction`
-        where audit_date < '{end_date}' and audit_date >= '{start_date}'
-        and parent in {folio_id}
-        and transaction_type in {transaction_type}
-    '''
-    total = frappe.db.sql(transaction_query, as_dict=1)[0]
-    if total.total == None:
-        total.total = 0
-
-    count_query = f'''
-        select count(*) as count
-        from `tabInn Folio Transaction`
-        where audit_date < '{end_date}' and audit_date >= '{start_date}'
-        and parent in {folio_id}
-        and transaction_type = 'Room Charge'
-    '''
-    count = frappe.db.sql(count_query, as_dict=1)[0]
-
-    if get_today:
-        today_query = f'''
-            select sum(actual_room_rate) as total, count(*) as count
-            from `tabInn Reservation` ir
-            where ir.status = 'In House' and ir.expected_arrival <= '{start_date}'
-        '''
-        today = frappe.db.sql(today_query, as_dict=1)
-        today = today[0]
-        total.total += today.total
-        count.count += today.count
-
-    return total.total, count.count
-
-    # # calculate reservation start before start_date and reservation end after start date
-    # current_sold = frappe.db.get_values(doctype="Inn Reservation", filters={"arrival": ["<", start_date], "expected_departure": [
-    #                                     ">", start_date]}, fieldname=["name", "arrival", "expected_departure", "room_rate"], as_dict=True)
-    # reservation_id = [x.name for x in current_sold]
-    # for ii in current_sold:
-    #     room_end_date = ii.expected_departure
-    #     if room_end_date > end_date:
-    #         room_end_date = end_date
-
-    #     days_sold = (room_end_date - start_date).days
-    #     total_sold += days_sold
-
-    #     if ii.room_rate not in cached_rate:
-    #         room_rate = frappe.db.get_value(doctype="Inn Room Rate", filters={
-    #                                         "name": ii.room_rate}, fieldname="final_total_rate_amount")
-    #         cached_rate[ii.room_rate] = room_rate
-
-    #     total_rate += cached_rate[ii.room_rate] * days_sold
-
-    # # calculate reservation start after start_date and reservations start before before_date
-    # current_sold = frappe.db.get_values(doctype="Inn Reservation", filters=[["expected_arrival", "between", [
-    #                                     start_date, end_date]]], fieldname=["expected_arrival", "expected_departure", "room_rate"], as_dict=True)
-    # for ii in current_sold:
-    #     room_start_date = ii.expected_arrival
-    #     room_end_date = ii.expected_departure
-    #     if room_end_date > end_date:
-    #         room_end_date = end_date
-
-    #     days_sold = (room_end_date - room_start_date).days
-    #     total_sold += days_sold
-
-    #     if ii.room_rate not in cached_rate:
-    #         room_rate = frappe.db.get_value(doctype="Inn Room Rate", filters={
-    #                                         "name": ii.room_rate}, fieldname="final_total_rate_amount")
-    #         cached_rate[ii.room_rate] = room_rate
-    #     total_rate += cached_rate[ii.room_rate] * days_sold
-
-    # return total_rate, total_sold
+    kpi = get_owner_kpi(start_date, end_date)
+    return kpi.total_rate, kpi.room_charge_count
 
 
 @frappe.whitelist()
 def calculate_average_rate(start_date=None, end_date=None):
-    if start_date == None and end_date == None:
-        start_date = date.today().isoformat()
-        end_date = date.today() + timedelta(days=1)
-        end_date = end_date.isoformat()
-    total_rate, total_sold = calculate_total_rate_and_sold(
-        start_date, end_date)
+    total_rate, total_sold = calculate_total_rate_and_sold(start_date, end_date)
     if total_sold == 0:
         value = 0
     else:
@@ -320,13 +155,7 @@ def calculate_average_rate(start_date=None, end_date=None):
 
 @frappe.whitelist()
 def calculate_total_rate(start_date=None, end_date=None):
-    if start_date == None and end_date == None:
-        start_date = date.today().isoformat()
-        end_date = date.today() + timedelta(days=1)
-        end_date = end_date.isoformat()
     total_rate, _ = calculate_total_rate_and_sold(start_date, end_date)
-    if total_rate is None:
-        total_rate = 0
     return {
         "value": total_rate,
         "fieldtype": "Currency"
@@ -5,6 +5,25 @@ from __future__ import unicode_literals
 
 import frappe
 import unittest
+from unittest.mock import patch
+
+from inn.inn_hotels.doctype.inn_room_booking import inn_room_booking
 
 class TestInnRoomBooking(unittest.TestCase):
-	pass
+	def setUp(self):
+		frappe.cache().delete_value([inn_room_booking.FLOOR_PLAN_CACHE_KEY, inn_room_booking.FLOOR_PLAN_BUILT_KEY])
+
+	def tearDown(self):
+		frappe.cache().delete_value([inn_room_booking.FLOOR_PLAN_CACHE_KEY, inn_room_booking.FLOOR_PLAN_BUILT_KEY])
+
+	def test_floor_plan_is_served_from_the_snapshot(self):
+		built = inn_room_booking.get_all_room_with_room_booking_status()
+		if not built:
+			self.skipTest("needs Inn Room")
+
+		# the second call does not query the database
+		with patch.object(frappe.db, 'sql', side_effect=AssertionError("floor plan queried again")):
+			cached = inn_room_booking.get_all_room_with_room_booking_status()
+
+		key = lambda item: item['name']
+		self.assertEqual(sorted(cached, key=key), sorted(built, key=key))
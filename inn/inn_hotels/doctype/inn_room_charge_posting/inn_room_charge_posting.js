@@ -53,6 +53,23 @@ frappe.ui.form.on('Inn Room Charge Posting', {
 		}
 	},
 	populate: function(frm, cdt, cdn) {
+		if (!frm.doc.__islocal) {
+			// rows are written on the server in one bulk insert, the reload would drop unsaved changes
+			if (frm.is_dirty()) {
+				frappe.msgprint(__('Please save the Room Charge Posting before populating To Be Posted.'));
+				return;
+			}
+			frappe.call({
+				method: 'inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting.populate_tobe_posted',
+				args: {
+					parent_id: frm.doc.name
+				},
+				callback: (r) => {
+					frm.reload_doc();
+				}
+			});
+			return;
+		}
 		frappe.call({
 			method: 'inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting.populate_tobe_posted',
 			callback: (r) => {
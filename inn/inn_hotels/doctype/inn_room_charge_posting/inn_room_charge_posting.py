@@ -13,9 +13,12 @@ from frappe.model.document import Document
 from inn.inn_hotels.doctype.inn_folio_transaction_type.inn_folio_transaction_type import get_accounts_from_id
 from inn.inn_hotels.doctype.inn_folio_transaction.inn_folio_transaction import get_idx
 from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
-from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges, calculate_inn_tax_and_charges_exclude_commision
+from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges, calculate_inn_tax_and_charges_exclude_commision, get_tax_breakdown_account, get_tax_plan
+from inn.inn_hotels.doctype.inn_room_rate.inn_room_rate import get_room_rate_plan
 from inn.inn_hotels.doctype.inn_channel.inn_channel import check_channel_commission
-from frappe.utils import flt
+from inn.inn_hotels.doctype.inn_room_charge_posting.inn_room_charge_posting_bulk import post_room_charges_bulk
+from inn.helper.bulk import bulk_insert_docs
+from frappe.utils import flt, cint, now
 
 class InnRoomChargePosting(Document):
 	pass
@@ -36,29 +39,62 @@ def is_there_closed_room_charge_posting_at():
 	else:
 		return 2
 
+TOBE_POSTED_FIELDS = ['reservation_id', 'folio_id', 'room_id', 'customer_id', 'room_rate_id', 'actual_room_rate']
+
 @frappe.whitelist()
-def populate_tobe_posted():
-	tobe_posted_list = []
-	folio_list = frappe.get_all('Inn Folio', filters={'status': 'Open', 'type': 'Guest'}, fields=['*'])
-	for item in folio_list:
-		reservation = frappe.get_doc('Inn Reservation', item.reservation_id)
-		if reservation.status == 'In House' or reservation.status == 'Finish':
-			room_charge_remark = 'Room Charge: Room Rate (Nett): ' + reservation.actual_room_id + " - " + \
-								 get_last_audit_date().strftime("%d-%m-%Y")
-			if not frappe.db.exists('Inn Folio Transaction',
-								{'parent': item.name, 'transaction_type': 'Room Charge', 'remark': room_charge_remark, 'is_void': 0}):
-				tobe_posted = frappe.new_doc('Inn Room Charge To Be Posted')
-				tobe_posted.reservation_id = item.reservation_id
-				tobe_posted.folio_id = item.name
-				tobe_posted.room_id = reservation.actual_room_id
-				tobe_posted.customer_id = reservation.customer_id
-				tobe_posted.room_rate_id = reservation.room_rate
-				tobe_posted.actual_room_rate = reservation.actual_room_rate
-				tobe_posted_list.append(tobe_posted)
+def populate_tobe_posted(parent_id=None):
+	"""
+	list the open guest folio of In House / Finish reservation whose room charge is not posted yet at the last audit date.
+	:param parent_id optional Inn Room Charge Posting, when given its To Be Posted rows are replaced by the result
+	"""
+	if parent_id:
+		frappe.has_permission('Inn Room Charge Posting', 'write', parent_id, throw=True)
+		if frappe.db.get_value('Inn Room Charge Posting', parent_id, 'status') != 'Open':
+			frappe.throw("Room Charge Posting {0} is already Closed.".format(parent_id))
+
+	audit_date = get_last_audit_date().strftime("%d-%m-%Y")
+	tobe_posted_list = frappe.db.sql("""
+		select
+			folio.reservation_id, folio.name as folio_id, reservation.actual_room_id as room_id,
+			reservation.customer_id, reservation.room_rate as room_rate_id, reservation.actual_room_rate
+		from `tabInn Folio` as folio
+		inner join `tabInn Reservation` as reservation on reservation.name = folio.reservation_id
+		where folio.status = 'Open' and folio.type = 'Guest'
+			and reservation.status in ('In House', 'Finish')
+			and not exists (
+				select 1 from `tabInn Folio Transaction` as trx
+				where trx.parent = folio.name and trx.transaction_type = 'Room Charge' and trx.is_void = 0
+					and trx.remark = concat('Room Charge: Room Rate (Nett): ', reservation.actual_room_id, ' - ', %(audit_date)s)
+			)
+		order by folio.modified desc
+	""", {'audit_date': audit_date}, as_dict=True)
+
+	if parent_id:
+		insert_tobe_posted(parent_id, tobe_posted_list)
+
 	return tobe_posted_list
 
+def insert_tobe_posted(parent_id, tobe_posted_list):
+	# replace the To Be Posted rows of the Room Charge Posting with one bulk insert
+	frappe.db.delete('Inn Room Charge To Be Posted', {'parent': parent_id, 'parenttype': 'Inn Room Charge Posting'})
+	rows = []
+	for idx, item in enumerate(tobe_posted_list, 1):
+		row = {field: item.get(field) for field in TOBE_POSTED_FIELDS}
+		row.update({
+			'name': frappe.generate_hash(length=10),
+			'parent': parent_id,
+			'parenttype': 'Inn Room Charge Posting',
+			'parentfield': 'tobe_posted',
+			'idx': idx,
+		})
+		rows.append(row)
+	bulk_insert_docs('Inn Room Charge To Be Posted', TOBE_POSTED_FIELDS + ['parent', 'parenttype', 'parentfield', 'idx'], rows)
+	frappe.db.set_value('Inn Room Charge Posting', parent_id, 'modified', now())
+
 @frappe.whitelist()
 def post_individual_room_charges(parent_id, tobe_posted_list):
+	if is_bulk_posting_enabled():
+		return post_room_charges_bulk(parent_id, tobe_posted_list)
 
 	# to exclude service charge from reduced because of commision / cashback
 	room_post_settings = frappe.db.get_values_from_single(doctype="Inn Hotels Setting", filters="", fields=["profit_sharing_account", "profit_sharing_transaction_type"], as_dict=True)[0]
@@ -131,9 +167,8 @@ def post_individual_room_charges(parent_id, tobe_posted_list):
 		ftbd_doc.transaction_id = room_charge_folio_trx.name
 		ftb_doc.append('transaction_detail', ftbd_doc)
 
-		fdc_room_rate = frappe.get_doc('Inn Room Rate', fdc_reservation.room_rate)
-		fdc_room_rate_tax = frappe.get_doc('Inn Tax', fdc_room_rate.room_rate_tax)
-		fdc_room_rate_tax_breakdown = fdc_room_rate_tax.inn_tax_breakdown
+		fdc_room_rate = get_room_rate_plan(fdc_reservation.room_rate)
+		fdc_room_rate_tax_breakdown = get_tax_plan(fdc_room_rate.room_rate_tax).rows
 		if fdc_room_rate_tax_breakdown[-1].breakdown_rate != 0.0:
 			fdc_room_rate_tax_account = fdc_room_rate_tax_breakdown[-1].breakdown_account
 		else:
@@ -141,8 +176,8 @@ def post_individual_room_charges(parent_id, tobe_posted_list):
 		
 		# get tax breakdown account from reservation
 		if is_exclude_tax:
-			fdc_room_rate_tax = frappe.get_doc("Inn Tax", reservation.actual_room_rate_tax)
-			fdc_room_rate_tax_account = fdc_room_rate_tax.inn_tax_breakdown[-1].breakdown_account if fdc_room_rate_tax.inn_tax_breakdown[-1].breakdown_rate != 0 else fdc_room_rate_tax.inn_tax_breakdown[-2].breakdown_account
+			fdc_room_rate_tax_breakdown = get_tax_plan(reservation.actual_room_rate_tax).rows
+			fdc_room_rate_tax_account = fdc_room_rate_tax_breakdown[-1].breakdown_account if fdc_room_rate_tax_breakdown[-1].breakdown_rate != 0 else fdc_room_rate_tax_breakdown[-2].breakdown_account
 
 		if is_channel_commision:
 			# add commission first
@@ -182,7 +217,7 @@ def post_individual_room_charges(parent_id, tobe_posted_list):
 			room_tax_doc.transaction_type = 'Room Charge Tax/Service'
 			room_tax_doc.amount = room_tb_amount[index]
 			accumulated_amount += room_tb_amount[index]
-			room_tax_doc.credit_account = frappe.get_doc('Inn Tax Breakdown', room_tax_item_name).breakdown_account
+			room_tax_doc.credit_account = get_tax_breakdown_account(reservation.actual_room_rate_tax, room_tax_item_name)
 			room_tax_doc.debit_account = room_charge_debit_account
 			room_tax_doc.remark = 'Room Charge Tax Room Rate ' + room_tax_item_name + ' : ' + item_doc.room_id + " - " + get_last_audit_date().strftime("%d-%m-%Y")
 			room_tax_doc.parent = item_doc.folio_id
@@ -267,8 +302,7 @@ def post_individual_room_charges(parent_id, tobe_posted_list):
 				breakfast_tax_doc.transaction_type = 'Breakfast Charge Tax/Service'
 				breakfast_tax_doc.amount = breakfast_tb_amount[index]
 				accumulated_amount += breakfast_tb_amount[index]
-				breakfast_tax_doc.credit_account = frappe.get_doc('Inn Tax Breakdown',
-																breakfast_tax_item_name).breakdown_account
+				breakfast_tax_doc.credit_account = get_tax_breakdown_account(reservation.actual_breakfast_rate_tax, breakfast_tax_item_name)
 				breakfast_tax_doc.debit_account = breakfast_charge_debit_account
 				breakfast_tax_doc.remark = 'Breakfast Charge Tax Room Rate ' + breakfast_tax_item_name + ' : ' + item_doc.room_id + " - " + get_last_audit_date().strftime("%d-%m-%Y")
 				breakfast_tax_doc.parent = item_doc.folio_id
@@ -356,6 +390,8 @@ def post_individual_room_charges(parent_id, tobe_posted_list):
 
 @frappe.whitelist()
 def post_room_charges(parent_id, tobe_posted_list):
+	if is_bulk_posting_enabled():
+		return post_room_charges_bulk(parent_id, tobe_posted_list)
 
 	# to exclude service charge from reduced because of commision / cashback
 	room_post_settings = frappe.db.get_values_from_single(doctype="Inn Hotels Setting", filters="", fields=["room_revenue_account", "breakfast_revenue_account", "profit_sharing_account", "profit_sharing_transaction_type"], as_dict=True)[0]
@@ -430,17 +466,16 @@ def post_room_charges(parent_id, tobe_posted_list):
 		ftbd_doc.transaction_id = room_charge_folio_trx.name
 		ftb_doc.append('transaction_detail', ftbd_doc)
 
-		fdc_room_rate = frappe.get_doc('Inn Room Rate', fdc_reservation.room_rate)
-		fdc_room_rate_tax = frappe.get_doc('Inn Tax', fdc_room_rate.room_rate_tax)
-		fdc_room_rate_tax_breakdown = fdc_room_rate_tax.inn_tax_breakdown
+		fdc_room_rate = get_room_rate_plan(fdc_reservation.room_rate)
+		fdc_room_rate_tax_breakdown = get_tax_plan(fdc_room_rate.room_rate_tax).rows
 		if fdc_room_rate_tax_breakdown[-1].breakdown_rate != 0.0:
 			fdc_room_rate_tax_account = fdc_room_rate_tax_breakdown[-1].breakdown_account
 		else:
 			fdc_room_rate_tax_account = fdc_room_rate_tax_breakdown[-2].breakdown_account
 				# get tax breakdown account from reservation
 		if is_exclude_tax:
-			fdc_room_rate_tax = frappe.get_doc("Inn Tax", reservation.actual_room_rate_tax)
-			fdc_room_rate_tax_account = fdc_room_rate_tax.inn_tax_breakdown[-1].breakdown_account if fdc_room_rate_tax.inn_tax_breakdown[-1].breakdown_rate != 0 else fdc_room_rate_tax[-2].breakdown_account
+			fdc_room_rate_tax_breakdown = get_tax_plan(reservation.actual_room_rate_tax).rows
+			fdc_room_rate_tax_account = fdc_room_rate_tax_breakdown[-1].breakdown_account if fdc_room_rate_tax_breakdown[-1].breakdown_rate != 0 else fdc_room_rate_tax_breakdown[-2].breakdown_account
 
 
 		if is_channel_commision:
@@ -480,7 +515,7 @@ def post_room_charges(parent_id, tobe_posted_list):
 			room_tax_doc.transaction_type = 'Room Charge Tax/Service'
 			room_tax_doc.amount = room_tb_amount[index]
 			accumulated_amount += room_tb_amount[index]
-			room_tax_doc.credit_account = frappe.get_doc('Inn Tax Breakdown', room_tax_item_name).breakdown_account
+			room_tax_doc.credit_account = get_tax_breakdown_account(reservation.actual_room_rate_tax, room_tax_item_name)
 			room_tax_doc.debit_account = room_charge_debit_account
 			room_tax_doc.remark = 'Room Charge Tax Room Rate ' + room_tax_item_name + ' : ' + item[
 				'room_id'] + " - " + get_last_audit_date().strftime("%d-%m-%Y")
@@ -558,8 +593,7 @@ def post_room_charges(parent_id, tobe_posted_list):
 				breakfast_tax_doc.transaction_type = 'Breakfast Charge Tax/Service'
 				breakfast_tax_doc.amount = breakfast_tb_amount[index]
 				accumulated_amount += breakfast_tb_amount[index]
-				breakfast_tax_doc.credit_account = frappe.get_doc('Inn Tax Breakdown',
-																breakfast_tax_item_name).breakdown_account
+				breakfast_tax_doc.credit_account = get_tax_breakdown_account(reservation.actual_breakfast_rate_tax, breakfast_tax_item_name)
 				breakfast_tax_doc.debit_account = breakfast_charge_debit_account
 				breakfast_tax_doc.remark = 'Breakfast Charge Tax Room Rate ' + breakfast_tax_item_name + ' : ' + item[
 					'room_id'] + " - " + get_last_audit_date().strftime("%d-%m-%Y")
@@ -643,6 +677,9 @@ def post_room_charges(parent_id, tobe_posted_list):
 
 	return return_value
 
+def is_bulk_posting_enabled():
+	return cint(frappe.db.get_single_value('Inn Hotels Setting', 'room_charge_bulk_posting')) == 1
+
 def calculate_already_posted_total(room_charge_posting_id):
 	total = 0.0
 	doc = frappe.get_doc('Inn Room Charge Posting', room_charge_posting_id)
@@ -673,7 +710,6 @@ def __get_actual_room_rate_breakdown_check_commission(reservation_doc):
 	'''
 	from inn.inn_hotels.doctype.inn_channel.inn_channel import check_channel_commission, PROFIT_SHARING_ENABLED, PROFIT_SHARING_TYPE_PERCENTAGE
 	
-	
 	channel = check_channel_commission(reservation_doc, reservation_price=reservation_doc.actual_room_rate)
 	if channel.profit_sharing == PROFIT_SHARING_ENABLED:
 		if channel.sharing_type != PROFIT_SHARING_TYPE_PERCENTAGE:
@@ -683,7 +719,7 @@ def __get_actual_room_rate_breakdown_check_commission(reservation_doc):
 		channel.room_cashback = 0
 		channel.breakfast_cashback = 0
 	
-	room_rate_doc = frappe.get_doc('Inn Room Rate', reservation_doc.room_rate)
+	room_rate_doc = get_room_rate_plan(reservation_doc.room_rate)
 
 	# diff in here: using reservation tax as a base and when channel is not in commission also call this function will filled cashback as 0 
 	_, _, room_price = calculate_inn_tax_and_charges_exclude_commision(reservation_doc.actual_room_rate - room_rate_doc.final_breakfast_rate_amount, reservation_doc.actual_room_rate_tax, channel.room_cashback)
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020, Core Initiative and contributors
+# For license information, please see license.txt
+
+'''
+Set based room charge posting for the night audit.
+
+Instead of posting reservation by reservation (get_doc for every reservation, room rate, tax and
+tax breakdown, insert() for every folio transaction), the whole batch is handled in three phases:
+
+1. load: every reservation, room rate, channel, tax breakdown and transaction type account
+   needed by the batch is read with a handful of queries.
+2. compute: nett rates and commissions are calculated per reservation, taxes are evaluated
+   per Inn Tax plan over all reservations sharing it, then room, breakfast, commission and tax
+   lines (including the rounding difference adjustment) are built in memory.
+3. write: folio transactions, bundles, bundle details and Inn Room Charge Posted rows are
+   written with multi row inserts inside the request transaction.
+'''
+
+from __future__ import unicode_literals
+
+import json
+import math
+import time
+import frappe
+from frappe.utils import flt, nowdate, getdate
+from inn.helper.bulk import reserve_series, bulk_insert_docs
+from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
+from inn.inn_hotels.doctype.inn_folio.inn_folio import apply_balance_delta
+from inn.inn_hotels.doctype.inn_tax.inn_tax import get_tax_plans, evaluate_tax_plan, apply_tax_breakdown_exclude_commision
+from inn.inn_hotels.doctype.inn_channel.inn_channel import calculate_channel_cashback, get_channels, PROFIT_SHARING_ENABLED, PROFIT_SHARING_TYPE_PERCENTAGE
+
+FOLIO_TRANSACTION_FIELDS = ['flag', 'is_void', 'idx', 'transaction_type', 'amount', 'sub_folio', 'debit_account',
+							'credit_account', 'remark', 'audit_date', 'actual_room_rate', 'ftb_id',
+							'parent', 'parenttype', 'parentfield']
+BUNDLE_FIELDS = ['naming_series', 'transaction_type']
+BUNDLE_DETAIL_FIELDS = ['idx', 'transaction_type', 'transaction_id', 'parent', 'parenttype', 'parentfield']
+POSTED_FIELDS = ['idx', 'reservation_id', 'folio_id', 'room_id', 'customer_id', 'room_rate_id', 'actual_room_rate',
+				 'folio_transaction_id', 'parent', 'parenttype', 'parentfield']
+
+@frappe.whitelist()
+def post_room_charges_bulk(parent_id, tobe_posted_list):
+	'''
+	:param parent_id Inn Room Charge Posting name
+	:param tobe_posted_list json list of Inn Room Charge To Be Posted rows (dicts) or row names
+	:return html list of posted remark, same as post_room_charges. the phase timings go to the inn log
+	'''
+	timings = {}
+	started = time.perf_counter()
+
+	items = _load_tobe_posted(json.loads(tobe_posted_list))
+	context = _load_posting_context(items)
+	timings['load'] = time.perf_counter() - started
+
+	checkpoint = time.perf_counter()
+	prepared = [_prepare_reservation(item, context) for item in items]
+	room_taxes = _evaluate_taxes([(p.reservation.actual_room_rate_tax, p.reservation.nett_actual_room_rate) for p in prepared], context)
+	breakfast_taxes = _evaluate_taxes([(p.reservation.actual_breakfast_rate_tax, p.reservation.nett_actual_breakfast_rate) for p in prepared], context)
+	postings = [_build_lines(item, p, room_tax, breakfast_tax, context)
+				for item, p, room_tax, breakfast_tax in zip(items, prepared, room_taxes, breakfast_taxes)]
+	timings['compute'] = time.perf_counter() - checkpoint
+
+	checkpoint = time.perf_counter()
+	_write_postings(parent_id, items, postings, context)
+	timings['write'] = time.perf_counter() - checkpoint
+	timings['total'] = time.perf_counter() - started
+
+	frappe.logger('inn').info({'room_charge_posting': parent_id, 'posted': len(items),
+								'timings': {k: round(v, 4) for k, v in timings.items()}})
+
+	return_value = ''
+	for posting in postings:
+		return_value = return_value + '<li>' + posting['lines'][0]['remark'] + '</li>'
+	return return_value
+
+def _load_tobe_posted(list_json):
+	# post_individual_room_charges receives row names, post_room_charges receives whole rows
+	names = [item for item in list_json if isinstance(item, str)]
+	rows = [frappe._dict(item) for item in list_json if not isinstance(item, str)]
+	if names:
+		rows += frappe.get_all('Inn Room Charge To Be Posted', filters={'name': ['in', names]},
+							   fields=['name', 'reservation_id', 'folio_id', 'room_id', 'customer_id',
+									   'room_rate_id', 'actual_room_rate'])
+	return rows
+
+def _load_posting_context(items):
+	'''read everything needed to post `items` with a fixed number of queries'''
+	settings = frappe.db.get_values_from_single(doctype="Inn Hotels Setting", filters="",
+		fields=["profit_sharing_account", "profit_sharing_transaction_type", "maximum_payment_exclude", "inn_tax_exclude_option"],
+		as_dict=True)[0]
+	channel_exclude_tax = frappe.get_all("Inn Channel Tax Exclude",
+										 filters={"parenttype": "Inn Hotels Setting", "parent": "Inn Hotels Setting",
+												  "parentfield": "inn_channel_exclude_tax"},
+										 pluck="channel")
+
+	reservation_ids = list({item.reservation_id for item in items})
+	reservations = {r.name: r for r in frappe.get_all('Inn Reservation', filters={'name': ['in', reservation_ids]},
+		fields=['name', 'channel', 'room_rate', 'actual_room_rate', 'init_actual_room_rate', 'actual_room_rate_tax',
+				'actual_breakfast_rate_tax', 'nett_actual_room_rate', 'nett_actual_breakfast_rate'])} if reservation_ids else {}
+
+	room_rate_ids = list({r.room_rate for r in reservations.values() if r.room_rate})
+	room_rates = {r.name: r for r in frappe.get_all('Inn Room Rate', filters={'name': ['in', room_rate_ids]},
+		fields=['name', 'room_rate_tax', 'final_breakfast_rate_amount'])} if room_rate_ids else {}
+
+	channel_ids = list({r.channel for r in reservations.values() if r.channel})
+	channels = get_channels(channel_ids)
+
+	tax_ids = {settings.inn_tax_exclude_option}
+	for r in reservations.values():
+		tax_ids.update([r.actual_room_rate_tax, r.actual_breakfast_rate_tax])
+	for r in room_rates.values():
+		tax_ids.add(r.room_rate_tax)
+	tax_plans = get_tax_plans([t for t in tax_ids if t])
+
+	accounts = {t.name: (t.debit_account, t.credit_account) for t in frappe.get_all('Inn Folio Transaction Type',
+		filters={'name': ['in', ['Room Charge', 'Breakfast Charge']]}, fields=['name', 'debit_account', 'credit_account'])}
+
+	folio_ids = list({item.folio_id for item in items})
+	next_idx = {}
+	if folio_ids:
+		for row in frappe.db.sql('''select parent, count(name) from `tabInn Folio Transaction`
+			where parent in %(folios)s and parenttype='Inn Folio' and parentfield='folio_transaction'
+			group by parent''', {'folios': folio_ids}):
+			next_idx[row[0]] = row[1]
+
+	return frappe._dict({
+		'commission_account': settings.profit_sharing_account,
+		'commission_transaction_type': settings.profit_sharing_transaction_type,
+		'maximum_price_exclude_tax': flt(settings.maximum_payment_exclude),
+		'inn_tax_exclude': settings.inn_tax_exclude_option,
+		'channel_exclude_tax': set(channel_exclude_tax),
+		'reservations': reservations,
+		'room_rates': room_rates,
+		'channels': channels,
+		'tax_plans': tax_plans,
+		'accounts': accounts,
+		'next_idx': next_idx,
+		'audit_date': get_last_audit_date(),
+	})
+
+def _tax_rows(inn_tax_id, context):
+	plan = context.tax_plans.get(inn_tax_id)
+	return plan.rows if plan else ()
+
+def _rounding_tax_account(tax_rows):
+	# the rounding difference goes to the last non zero tax row, same as the single posting
+	if not tax_rows:
+		return None
+	if tax_rows[-1].breakdown_rate != 0.0 or len(tax_rows) < 2:
+		return tax_rows[-1].breakdown_account
+	return tax_rows[-2].breakdown_account
+
+def _prepare_reservation(item, context):
+	'''resolve channel commission and (for tax excluded reservations) the nett rates, without touching the database'''
+	reservation = frappe._dict(context.reservations[item.reservation_id])
+	room_rate = context.room_rates.get(reservation.room_rate)
+	channel = context.channels.get(reservation.channel)
+
+	room_price = reservation.actual_room_rate or reservation.init_actual_room_rate
+	room_cashback, breakfast_cashback = calculate_channel_cashback(channel, room_rate, room_price) if channel else (0, 0)
+	is_channel_commision = bool(channel) and channel.profit_sharing == PROFIT_SHARING_ENABLED
+
+	is_exclude_tax = False
+	if (reservation.channel in context.channel_exclude_tax) or (reservation.actual_room_rate <= context.maximum_price_exclude_tax):
+		is_exclude_tax = True
+		reservation.actual_room_rate_tax = context.inn_tax_exclude
+		reservation.actual_breakfast_rate_tax = context.inn_tax_exclude
+		if is_channel_commision and channel.sharing_type != PROFIT_SHARING_TYPE_PERCENTAGE:
+			raise NotImplementedError("comission type other than percentage is not supported yet")
+		exclude_rows = _tax_rows(context.inn_tax_exclude, context)
+		exclude_room_cashback = room_cashback if is_channel_commision else 0
+		exclude_breakfast_cashback = breakfast_cashback if is_channel_commision else 0
+		reservation.nett_actual_room_rate = _nett_exclude_commision(
+			reservation.actual_room_rate - room_rate.final_breakfast_rate_amount, exclude_rows, exclude_room_cashback)
+		reservation.nett_actual_breakfast_rate = _nett_exclude_commision(
+			room_rate.final_breakfast_rate_amount, exclude_rows, exclude_breakfast_cashback)
+
+	if is_exclude_tax:
+		rounding_account = _rounding_tax_account(_tax_rows(reservation.actual_room_rate_tax, context))
+	else:
+		rounding_account = _rounding_tax_account(_tax_rows(room_rate.room_rate_tax, context))
+
+	return frappe._dict({
+		'reservation': reservation,
+		'channel': channel if is_channel_commision else None,
+		'room_cashback': room_cashback,
+		'breakfast_cashback': breakfast_cashback,
+		'rounding_account': rounding_account,
+	})
+
+def _evaluate_taxes(tax_and_bases, context):
+	'''
+	:param tax_and_bases list of (Inn Tax name, base total)
+	:return list of tb_amount in the same order, every Inn Tax plan is evaluated once over all of its base totals
+	'''
+	grouped = {}
+	for index, (inn_tax_id, base_total) in enumerate(tax_and_bases):
+		grouped.setdefault(inn_tax_id, []).append(index)
+
+	result = [[] for _ in tax_and_bases]
+	for inn_tax_id, indexes in grouped.items():
+		plan = context.tax_plans.get(inn_tax_id)
+		if not plan or not plan.rows:
+			continue
+		evaluated = evaluate_tax_plan(plan, [tax_and_bases[index][1] for index in indexes])
+		for index, (tb_amount, _) in zip(indexes, evaluated):
+			result[index] = tb_amount
+	return result
+
+def _build_lines(item, prepared, room_tb_amount, breakfast_tb_amount, context):
+	'''build every folio transaction line of one to be posted row, without touching the database'''
+	reservation = prepared.reservation
+	channel = prepared.channel
+	audit_date_str = getdate(context.audit_date).strftime("%d-%m-%Y")
+	room_debit, room_credit = context.accounts['Room Charge']
+	lines = []
+
+	def add_line(transaction_type, amount, debit_account, credit_account, remark, actual_room_rate=None):
+		line = frappe._dict({
+			'transaction_type': transaction_type,
+			'amount': amount,
+			'debit_account': debit_account,
+			'credit_account': credit_account,
+			'remark': remark,
+			'actual_room_rate': actual_room_rate,
+		})
+		lines.append(line)
+		return line
+
+	room_charge_line = add_line('Room Charge', float(int(reservation.nett_actual_room_rate)), room_debit, room_credit,
+		'Room Charge: Room Rate (Nett): ' + item.room_id + " - " + audit_date_str, reservation.actual_room_rate)
+
+	if channel:
+		add_line(context.commission_transaction_type, float(int(prepared.room_cashback)), room_debit, context.commission_account,
+			'Commission ' + channel.name + ' : ' + item.room_id + " - " + audit_date_str)
+
+	rounding_line = None
+	for index, breakdown in enumerate(_tax_rows(reservation.actual_room_rate_tax, context)):
+		line = add_line('Room Charge Tax/Service', room_tb_amount[index], room_debit, breakdown.breakdown_account,
+			'Room Charge Tax Room Rate ' + breakdown.name + ' : ' + item.room_id + " - " + audit_date_str)
+		if breakdown.breakdown_account == prepared.rounding_account:
+			rounding_line = line
+
+	breakfast_price = float(int(reservation.nett_actual_breakfast_rate))
+	if breakfast_price > 0:
+		breakfast_debit, breakfast_credit = context.accounts['Breakfast Charge']
+		add_line('Breakfast Charge', breakfast_price, breakfast_debit, breakfast_credit,
+			'Room Charge: Breakfast (Nett): ' + item.room_id + " - " + audit_date_str)
+
+		if channel:
+			add_line(context.commission_transaction_type, float(int(prepared.breakfast_cashback)), breakfast_debit,
+				context.commission_account, 'Commission ' + channel.name + ' : ' + item.room_id + " - " + audit_date_str)
+
+		for index, breakdown in enumerate(_tax_rows(reservation.actual_breakfast_rate_tax, context)):
+			add_line('Breakfast Charge Tax/Service', breakfast_tb_amount[index], breakfast_debit, breakdown.breakdown_account,
+				'Breakfast Charge Tax Room Rate ' + breakdown.name + ' : ' + item.room_id + " - " + audit_date_str)
+
+	accumulated_amount = sum(line.amount for line in lines)
+	difference = math.ceil(accumulated_amount) - int(reservation.actual_room_rate)
+	if difference > 0:
+		room_charge_line.amount = room_charge_line.amount - difference
+	elif difference < 0:
+		# no matching tax row means there is no tax to absorb the rounding, put it back to the room charge
+		(rounding_line or room_charge_line).amount += abs(difference)
+
+	return {'lines': lines}
+
+def _nett_exclude_commision(base_total, tax_rows, commission):
+	_, _, tb_total = apply_tax_breakdown_exclude_commision(base_total, tax_rows, commission)
+	if not tb_total:
+		return base_total - commission
+	return tb_total[0]
+
+def _write_postings(parent_id, items, postings, context):
+	line_count = sum(len(posting['lines']) for posting in postings)
+	today = getdate(nowdate())
+	# Inn Folio Transaction is named format:FT-{DD}-{MM}-{YY}-{####}, frappe keeps the {####} counter under the empty series key
+	trx_names = ['FT-' + today.strftime('%d-%m-%y') + '-' + number for number in reserve_series('', 4, line_count)]
+	bundle_names = reserve_series('FTB-', 5, len(postings))
+
+	existing_posted = frappe.db.count('Inn Room Charge Posted', {'parent': parent_id, 'parenttype': 'Inn Room Charge Posting'})
+
+	trx_rows, bundle_rows, detail_rows, posted_rows = [], [], [], []
+	trx_iter = iter(trx_names)
+	for item_index, (item, posting) in enumerate(zip(items, postings)):
+		bundle_name = bundle_names[item_index]
+		bundle_rows.append({'name': bundle_name, 'naming_series': 'FTB-', 'transaction_type': 'Room Charge'})
+
+		room_charge_trx_name = None
+		for line_index, line in enumerate(posting['lines']):
+			trx_name = next(trx_iter)
+			idx = context.next_idx.get(item.folio_id, 0)
+			context.next_idx[item.folio_id] = idx + 1
+			if line_index == 0:
+				room_charge_trx_name = trx_name
+			trx_rows.append({
+				'name': trx_name,
+				'flag': 'Debit',
+				'is_void': 0,
+				'idx': idx,
+				'transaction_type': line.transaction_type,
+				'amount': line.amount,
+				'sub_folio': 'A',
+				'debit_account': line.debit_account,
+				'credit_account': line.credit_account,
+				'remark': line.remark,
+				'audit_date': context.audit_date,
+				'actual_room_rate': line.actual_room_rate,
+				'ftb_id': bundle_name,
+				'parent': item.folio_id,
+				'parenttype': 'Inn Folio',
+				'parentfield': 'folio_transaction',
+			})
+			detail_rows.append({
+				'name': frappe.generate_hash(length=10),
+				'idx': line_index + 1,
+				'transaction_type': line.transaction_type,
+				'transaction_id': trx_name,
+				'parent': bundle_name,
+				'parenttype': 'Inn Folio Transaction Bundle',
+				'parentfield': 'transaction_detail',
+			})
+
+		posted_rows.append({
+			'name': frappe.generate_hash(length=10),
+			'idx': existing_posted + item_index + 1,
+			'reservation_id': item.reservation_id,
+			'folio_id': item.folio_id,
+			'room_id': item.room_id,
+			'customer_id': item.customer_id,
+			'room_rate_id': item.room_rate_id,
+			'actual_room_rate': item.actual_room_rate,
+			'folio_transaction_id': room_charge_trx_name,
+			'parent': parent_id,
+			'parenttype': 'Inn Room Charge Posting',
+			'parentfield': 'already_posted',
+		})
+
+	bulk_insert_docs('Inn Folio Transaction Bundle', BUNDLE_FIELDS, bundle_rows)
+	bulk_insert_docs('Inn Folio Transaction', FOLIO_TRANSACTION_FIELDS, trx_rows)
+	bulk_insert_docs('Inn Folio Transaction Bundle Detail', BUNDLE_DETAIL_FIELDS, detail_rows)
+	bulk_insert_docs('Inn Room Charge Posted', POSTED_FIELDS, posted_rows)
+
+	# bulk inserts skip Inn Folio Transaction on_update, move the folio running totals here
+	folio_debits = {}
+	for row in trx_rows:
+		folio_debits[row['parent']] = folio_debits.get(row['parent'], 0.0) + row['amount']
+	for folio_id, debit in folio_debits.items():
+		apply_balance_delta(folio_id, debit)
+
+	tobe_posted_names = [item.name for item in items if item.get('name')]
+	if tobe_posted_names:
+		frappe.db.delete('Inn Room Charge To Be Posted', {'name': ['in', tobe_posted_names]})
+
+	total = frappe.db.sql('''select coalesce(sum(actual_room_rate), 0) from `tabInn Room Charge Posted`
+		where parent=%s and parenttype='Inn Room Charge Posting' ''', parent_id)[0][0]
+	frappe.db.set_value('Inn Room Charge Posting', parent_id, 'already_posted_total', total)
@@ -3,8 +3,59 @@
 # See license.txt
 from __future__ import unicode_literals
 
+import json
 import frappe
 import unittest
+from unittest.mock import patch
+from frappe.utils import flt
+
+from inn.inn_hotels.doctype.inn_room_charge_posting import inn_room_charge_posting
 
 class TestInnRoomChargePosting(unittest.TestCase):
-	pass
+	def setUp(self):
+		self.tobe_posted = inn_room_charge_posting.populate_tobe_posted()[:5]
+		if not self.tobe_posted:
+			self.skipTest("needs In House reservations whose room charge is not posted yet")
+		self.folio_ids = list({item.folio_id for item in self.tobe_posted})
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def post(self, bulk):
+		'''
+		post the To Be Posted rows with post_room_charges, by reservation or in bulk, and roll the posting back.
+		:return the returned html, the folio transactions posted and the folio balances afterwards
+		'''
+		existing = set(frappe.get_all('Inn Folio Transaction', filters={'parent': ['in', self.folio_ids]}, pluck='name'))
+		posting = frappe.get_doc({'doctype': 'Inn Room Charge Posting', 'status': 'Open'}).insert(ignore_permissions=True)
+		inn_room_charge_posting.insert_tobe_posted(posting.name, self.tobe_posted)
+		rows = frappe.get_all('Inn Room Charge To Be Posted', filters={'parent': posting.name}, order_by='idx asc',
+							  fields=['name'] + inn_room_charge_posting.TOBE_POSTED_FIELDS)
+
+		with patch.object(inn_room_charge_posting, 'is_bulk_posting_enabled', return_value=bulk):
+			html = inn_room_charge_posting.post_room_charges(posting.name, json.dumps(rows, default=str))
+
+		transactions = [(trx.parent, trx.idx, trx.transaction_type, flt(trx.amount, 2), trx.debit_account,
+						 trx.credit_account, trx.remark, str(trx.audit_date))
+						for trx in frappe.get_all('Inn Folio Transaction', filters={'parent': ['in', self.folio_ids]},
+												  fields=['name', 'parent', 'idx', 'transaction_type', 'amount', 'debit_account',
+														  'credit_account', 'remark', 'audit_date'],
+												  order_by='parent asc, idx asc')
+						if trx.name not in existing]
+		balances = {folio.name: (flt(folio.total_debit, 2), flt(folio.total_credit, 2), flt(folio.balance, 2))
+					for folio in frappe.get_all('Inn Folio', filters={'name': ['in', self.folio_ids]},
+												fields=['name', 'total_debit', 'total_credit', 'balance'])}
+		already_posted_total = frappe.db.get_value('Inn Room Charge Posting', posting.name, 'already_posted_total')
+
+		frappe.db.rollback()
+		return html, transactions, balances, flt(already_posted_total, 2)
+
+	def test_bulk_posting_matches_posting_by_reservation(self):
+		html, transactions, balances, already_posted_total = self.post(bulk=False)
+		bulk_html, bulk_transactions, bulk_balances, bulk_already_posted_total = self.post(bulk=True)
+
+		self.assertTrue(transactions)
+		self.assertEqual(bulk_html, html)
+		self.assertEqual(bulk_transactions, transactions)
+		self.assertEqual(bulk_balances, balances)
+		self.assertEqual(bulk_already_posted_total, already_posted_total)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and contributors
+# For license information, please see license.txt
+
+'''
+Inn Room Night is the room-night occupancy index of Inn Room Booking: one row per room per night
+([start, end) of the booking) for every booking that is not Canceled. Overlap checks against bookings
+become indexed lookups on (room_id, date) instead of range predicates over tabInn Room Booking.
+
+The rows are owned by Inn Room Booking (see sync_room_nights), never edit them directly.
+'''
+
+from __future__ import unicode_literals
+import frappe
+from datetime import timedelta
+from frappe.model.document import Document
+from frappe.utils import getdate
+from inn.helper.bulk import bulk_insert_docs
+
+ROOM_NIGHT_FIELDS = ['room_id', 'date', 'room_availability', 'status', 'room_booking']
+
+class InnRoomNight(Document):
+	pass
+
+def on_doctype_update():
+	frappe.db.add_index('Inn Room Night', ['room_id', 'date'])
+	frappe.db.add_index('Inn Room Night', ['date', 'status', 'room_availability'])
+
+def get_room_night_rows(room_booking):
+	'''
+	:param room_booking Inn Room Booking doc or row with name, room_id, start, end, status and room_availability
+	:return list of Inn Room Night row (dict) covering every night of the booking
+	'''
+	if room_booking.status == 'Canceled' or not room_booking.room_id or not room_booking.start or not room_booking.end:
+		return []
+
+	start = getdate(room_booking.start)
+	end = getdate(room_booking.end)
+	rows = []
+	for n in range((end - start).days):
+		rows.append({
+			'name': frappe.generate_hash(length=10),
+			'room_id': room_booking.room_id,
+			'date': start + timedelta(n),
+			'room_availability': room_booking.room_availability,
+			'status': room_booking.status,
+			'room_booking': room_booking.name,
+		})
+	return rows
+
+def sync_room_nights(room_booking):
+	# replace the nights of one booking with its current state
+	frappe.db.delete('Inn Room Night', {'room_booking': room_booking.name})
+	bulk_insert_docs('Inn Room Night', ROOM_NIGHT_FIELDS, get_room_night_rows(room_booking))
+
+def delete_room_nights(room_booking_name):
+	frappe.db.delete('Inn Room Night', {'room_booking': room_booking_name})
+
+def rebuild_room_nights(from_date=None, batch_size=500):
+	'''
+	backfill the index from existing Inn Room Booking.
+	:param from_date only rebuild bookings ending after this date, default is every booking
+	'''
+	filters = {'status': ['!=', 'Canceled']}
+	if from_date:
+		filters['end'] = ['>', getdate(from_date)]
+		frappe.db.sql('delete from `tabInn Room Night` where date >= %s', getdate(from_date))
+	else:
+		frappe.db.delete('Inn Room Night')
+
+	bookings = frappe.get_all('Inn Room Booking', filters=filters,
+							  fields=['name', 'room_id', 'start', 'end', 'status', 'room_availability'])
+	if from_date:
+		# nights before from_date are kept, only regenerate the rest of each booking
+		for booking in bookings:
+			booking.start = max(getdate(booking.start), getdate(from_date))
+
+	rows = []
+	for booking in bookings:
+		rows.extend(get_room_night_rows(booking))
+		if len(rows) >= batch_size:
+			bulk_insert_docs('Inn Room Night', ROOM_NIGHT_FIELDS, rows)
+			rows = []
+	bulk_insert_docs('Inn Room Night', ROOM_NIGHT_FIELDS, rows)
+	frappe.db.commit()
+
+	return len(bookings)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026, Core Initiative and Contributors
+# See license.txt
+from __future__ import unicode_literals
+
+import frappe
+import unittest
+from unittest.mock import patch
+from frappe.utils import getdate
+
+from inn.inn_hotels.doctype.inn_room_night import inn_room_night
+
+class TestInnRoomNight(unittest.TestCase):
+	def setUp(self):
+		self.room_id = frappe.db.get_value('Inn Room', {}, 'name')
+		if not self.room_id:
+			self.skipTest("needs Inn Room")
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def new_booking(self, start, end):
+		return frappe.get_doc({
+			'doctype': 'Inn Room Booking',
+			'room_id': self.room_id,
+			'start': start,
+			'end': end,
+			'status': 'Booked',
+			'room_availability': 'House Use',
+		}).insert(ignore_permissions=True)
+
+	def get_nights(self, room_booking_name):
+		return [(night.room_id, str(night.date), night.status)
+				for night in frappe.get_all('Inn Room Night', filters={'room_booking': room_booking_name},
+											fields=['room_id', 'date', 'status'], order_by='date asc')]
+
+	def expected_nights(self, dates, status):
+		return [(self.room_id, date, status) for date in dates]
+
+	def test_nights_follow_the_booking(self):
+		booking = self.new_booking('2031-01-01', '2031-01-04')
+		self.assertEqual(self.get_nights(booking.name),
+						 self.expected_nights(['2031-01-01', '2031-01-02', '2031-01-03'], 'Booked'))
+
+		booking.status = 'Stayed'
+		booking.save(ignore_permissions=True)
+		self.assertEqual(self.get_nights(booking.name),
+						 self.expected_nights(['2031-01-01', '2031-01-02', '2031-01-03'], 'Stayed'))
+
+		booking.start = '2031-01-02'
+		booking.end = '2031-01-06'
+		booking.save(ignore_permissions=True)
+		self.assertEqual(self.get_nights(booking.name),
+						 self.expected_nights(['2031-01-02', '2031-01-03', '2031-01-04', '2031-01-05'], 'Stayed'))
+
+		booking.status = 'Canceled'
+		booking.save(ignore_permissions=True)
+		self.assertEqual(self.get_nights(booking.name), [])
+
+		booking.status = 'Booked'
+		booking.save(ignore_permissions=True)
+		self.assertEqual(len(self.get_nights(booking.name)), 4)
+		frappe.delete_doc('Inn Room Booking', booking.name, ignore_permissions=True)
+		self.assertEqual(self.get_nights(booking.name), [])
+
+	def test_rebuild_from_date_keeps_earlier_nights(self):
+		booking = self.new_booking('2031-01-01', '2031-01-05')
+		# nights drifted away from the booking, only the ones from from_date on are regenerated
+		frappe.db.sql("update `tabInn Room Night` set status = 'Finished' where room_booking = %s", booking.name)
+
+		with patch.object(frappe.db, 'commit'):
+			inn_room_night.rebuild_room_nights(getdate('2031-01-03'))
+
+		self.assertEqual(self.get_nights(booking.name),
+						 self.expected_nights(['2031-01-01', '2031-01-02'], 'Finished')
+						 + self.expected_nights(['2031-01-03', '2031-01-04'], 'Booked'))
@@ -5,13 +5,50 @@
 from __future__ import unicode_literals
 import frappe
 import math
+from collections import namedtuple
 from frappe.model.document import Document
-from inn.inn_hotels.doctype.inn_channel.inn_channel import check_channel_commission, PROFIT_SHARING_ENABLED, PROFIT_SHARING_TYPE_PERCENTAGE
-from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges, calculate_inn_tax_and_charges_exclude_commision
+from frappe.utils import flt
+from inn.helper.cache import VersionedCache
+from inn.inn_hotels.doctype.inn_channel.inn_channel import calculate_channel_cashback, get_channel, PROFIT_SHARING_ENABLED, PROFIT_SHARING_TYPE_PERCENTAGE
+from inn.inn_hotels.doctype.inn_tax.inn_tax import calculate_inn_tax_and_charges, apply_tax_breakdown, apply_tax_breakdown_exclude_commision, get_tax_plan, get_tax_plans
+from inn.inn_hotels.web_form.room_booking.room_booking import clear_rate_table_cache
+
+# Compiled, immutable form of an Inn Room Rate: only the fields the rate breakdown needs.
+InnRoomRatePlan = namedtuple('InnRoomRatePlan', ['name', 'room_rate_tax', 'breakfast_tax', 'room_rate', 'breakfast_rate',
+												 'final_breakfast_rate_amount', 'final_total_rate_amount', 'rate_after_tax'])
+
+ROOM_RATE_PLAN_CACHE_KEY = 'inn_room_rate_plan'
+_room_rate_plan_cache = VersionedCache(ROOM_RATE_PLAN_CACHE_KEY)
 
 
 class InnRoomRate(Document):
-	pass
+	def on_update(self):
+		clear_rate_table_cache()
+		clear_room_rate_plan_cache(self.name)
+
+	def on_trash(self):
+		clear_rate_table_cache()
+		clear_room_rate_plan_cache(self.name)
+
+	def after_rename(self, old, new, merge=False):
+		clear_room_rate_plan_cache(old)
+		clear_room_rate_plan_cache(new)
+
+def get_room_rate_plan(room_rate_id):
+	'''
+	:return InnRoomRatePlan of the Inn Room Rate, from the process local cache, then redis, then the database.
+	'''
+	plan = _room_rate_plan_cache.get_many([room_rate_id], load_room_rate_plans).get(room_rate_id)
+	if not plan:
+		frappe.throw("Inn Room Rate {0} not found".format(room_rate_id), frappe.DoesNotExistError)
+	return plan
+
+def load_room_rate_plans(room_rate_ids):
+	return {values.name: InnRoomRatePlan(*(values.get(field) for field in InnRoomRatePlan._fields))
+			for values in frappe.get_all('Inn Room Rate', filters={'name': ['in', room_rate_ids]}, fields=list(InnRoomRatePlan._fields))}
+
+def clear_room_rate_plan_cache(room_rate_id=None):
+	_room_rate_plan_cache.invalidate(room_rate_id)
 
 def calculate_total_amount(doc, method):
 	final_room_rate_only_amount = doc.final_total_rate_amount - doc.final_breakfast_rate_amount
@@ -24,33 +61,38 @@ def calculate_total_amount(doc, method):
 	doc.breakfast_rate = float(bf_rate_before[-1])
 
 def get_room_rate_after_tax(room_rate_id):
-	doc = frappe.get_doc('Inn Room Rate', room_rate_id)
-	_, _, room_rate_after_tax = calculate_inn_tax_and_charges(float(doc.room_rate), doc.room_rate_tax)
+	plan = get_room_rate_plan(room_rate_id)
+	_, _, room_rate_after_tax = calculate_inn_tax_and_charges(float(plan.room_rate), plan.room_rate_tax)
 	return room_rate_after_tax[-1]
 
 
 def get_breakfast_rate_after_tax(room_rate_id):
-	doc = frappe.get_doc('Inn Room Rate', room_rate_id)
-	_, _, breakfast_rate_after_tax = calculate_inn_tax_and_charges(float(doc.breakfast_rate), doc.breakfast_tax)
-	return breakfast_rate_after_tax[-1]
+	plan = get_room_rate_plan(room_rate_id)
+	return breakfast_rate_after_tax(plan, get_tax_plan(plan.breakfast_tax).rows)
+
+def breakfast_rate_after_tax(plan, breakfast_tax_rows):
+	# breakfast price including tax of the room rate, does not touch the database
+	_, _, tb_total = apply_tax_breakdown(float(plan.breakfast_rate), breakfast_tax_rows)
+	return tb_total[-1] if breakfast_tax_rows else tb_total
 
 @frappe.whitelist()
 def get_actual_room_rate_before_from_actual_rate(room_rate_id, actual_rate):
 	breakfast_rate = get_breakfast_rate_after_tax(room_rate_id)
 	actual_room_rate = float(actual_rate) - float(breakfast_rate)
-	room_rate_tax_breakdown_list = frappe.get_all('Inn Tax Breakdown',
-													filters={'parent': frappe.db.get_value('Inn Room Rate',
-																						   {'name': room_rate_id},
-																						   ['room_rate_tax'])},
-												  	order_by="idx desc",
-												  	fields=['*'])
+	return room_rate_before_from_actual_rate(actual_room_rate, get_tax_plan(get_room_rate_plan(room_rate_id).room_rate_tax).rows)
+
+def room_rate_before_from_actual_rate(actual_room_rate, tax_rows):
+	'''
+	:param actual_room_rate room price including tax, without breakfast
+	:param tax_rows Inn Tax Breakdown rows of the room rate tax, ordered by idx (InnTaxPlan.rows)
+	:return room rate before tax. does not touch the database.
+	'''
+	room_rate_tax_breakdown_list = tax_rows[::-1]
 	if len(room_rate_tax_breakdown_list) > 0:
-		tb_id = [""] * len(room_rate_tax_breakdown_list)
 		tb_rate_before = [0] * len(room_rate_tax_breakdown_list)
 		tb_rate_after = [0] * len(room_rate_tax_breakdown_list)
 		tb_rate_after[0] = float(actual_room_rate)
 		for index, item in enumerate(room_rate_tax_breakdown_list):
-			tb_id[index] = item.breakdown_type
 			if item.breakdown_type == 'On Net Total':
 				denominator = (100 + float(item.breakdown_rate))/100
 				if index == 0:
@@ -61,63 +103,65 @@ def get_actual_room_rate_before_from_actual_rate(room_rate_id, actual_rate):
 					tb_rate_after[index] = tb_rate_after[index-1]
 			elif item.breakdown_type == 'On Previous Row Total':
 				denominator = (100 + float(item.breakdown_rate)) / 100
-				if index < len(room_rate_tax_breakdown_list):
-					if index == 0:
-						tb_rate_after[len(room_rate_tax_breakdown_list) - int(item.breakdown_row_id)-1] = math.floor(float(actual_room_rate)/denominator)
-						tb_rate_before[index] = float(actual_room_rate)/denominator
-					else:
-						tb_rate_after[len(room_rate_tax_breakdown_list) - int(item.breakdown_row_id)-1] = math.floor(float(tb_rate_after[index-1])/denominator)
-						tb_rate_before[index] = float(tb_rate_after[index-1])/denominator
+				if index == 0:
+					tb_rate_after[len(room_rate_tax_breakdown_list) - int(item.breakdown_row_id)-1] = math.floor(float(actual_room_rate)/denominator)
+					tb_rate_before[index] = float(actual_room_rate)/denominator
+				else:
+					tb_rate_after[len(room_rate_tax_breakdown_list) - int(item.breakdown_row_id)-1] = math.floor(float(tb_rate_after[index-1])/denominator)
+					tb_rate_before[index] = float(tb_rate_after[index-1])/denominator
 		return tb_rate_before[-1]
 	else:
 		return actual_room_rate
 
-@frappe.whitelist()
-def get_base_room_rate(room_rate_id):
-	doc = frappe.get_doc('Inn Room Rate', room_rate_id)
-	return doc.rate_after_tax
- 
-@frappe.whitelist()
-def get_actual_room_rate_breakdown_check_commission(room_rate_id, actual_rate: int, reservation_id):
-	reservation_doc = frappe.get_doc("Inn Reservation", reservation_id)
-	channel = check_channel_commission(reservation_doc, reservation_price=actual_rate)
-	if channel.profit_sharing == PROFIT_SHARING_ENABLED:
+def compute_rate_breakdown(plan, room_tax_rows, breakfast_tax_rows, actual_rate, channel=None):
+	'''
+	rate engine of the reservation: split the price paid for a room into its nett room and breakfast rate.
+	does not touch the database, callers pass the compiled plans (get_room_rate_plan, get_tax_plan).
+
+	:param plan InnRoomRatePlan of the room rate
+	:param room_tax_rows Inn Tax Breakdown rows of plan.room_rate_tax (InnTaxPlan.rows)
+	:param breakfast_tax_rows Inn Tax Breakdown rows of plan.breakfast_tax (InnTaxPlan.rows)
+	:param actual_rate price paid for the room, including breakfast and tax
+	:param channel Inn Channel doc or row with profit_sharing, sharing_type and profit_sharing_amount, optional
+	:return (room_rate_tax, room_rate, breakfast_tax, breakfast_rate, room_cashback, breakfast_cashback)
+	'''
+	actual_rate = flt(actual_rate)
+	if channel and channel.profit_sharing == PROFIT_SHARING_ENABLED:
 		if channel.sharing_type != PROFIT_SHARING_TYPE_PERCENTAGE:
 			raise NotImplementedError("comission type other than percentage is not supported yet")
 
-		room_rate_doc = frappe.get_doc('Inn Room Rate', room_rate_id)
+		room_cashback, breakfast_cashback = calculate_channel_cashback(channel, plan, actual_rate)
+		_, _, room_price = apply_tax_breakdown_exclude_commision(actual_rate - plan.final_breakfast_rate_amount, room_tax_rows, room_cashback)
+		_, _, breakfast_price = apply_tax_breakdown_exclude_commision(plan.final_breakfast_rate_amount, room_tax_rows, breakfast_cashback)
+		return plan.room_rate_tax, room_price[0], plan.breakfast_tax, breakfast_price[0], room_cashback, breakfast_cashback
 
-		print(actual_rate, room_rate_doc.final_breakfast_rate_amount, channel.room_cashback)
-		_, _, room_price = calculate_inn_tax_and_charges_exclude_commision(actual_rate - room_rate_doc.final_breakfast_rate_amount, room_rate_doc.room_rate_tax, channel.room_cashback)
-		print(room_price)
-		_, _, breakfast_price = calculate_inn_tax_and_charges_exclude_commision(room_rate_doc.final_breakfast_rate_amount, room_rate_doc.room_rate_tax, channel.breakfast_cashback)
-		room_rate_tax = room_rate_doc.room_rate_tax
-		room_rate = room_price[0]
-		breakfast_tax = room_rate_doc.breakfast_tax
-		breakfast_rate = breakfast_price[0]
+	room_rate = room_rate_before_from_actual_rate(actual_rate - float(breakfast_rate_after_tax(plan, breakfast_tax_rows)), room_tax_rows)
+	return plan.room_rate_tax, room_rate, plan.breakfast_tax, plan.breakfast_rate, 0, 0
 
-		return room_rate_tax, room_rate, breakfast_tax, breakfast_rate
-
-	return get_actual_room_rate_breakdown(room_rate_id, actual_rate)
+@frappe.whitelist()
+def get_base_room_rate(room_rate_id):
+	return get_room_rate_plan(room_rate_id).rate_after_tax
+ 
+@frappe.whitelist()
+def get_actual_room_rate_breakdown_check_commission(room_rate_id, actual_rate: int, reservation_id):
+	plan = get_room_rate_plan(room_rate_id)
+	channel_name = frappe.db.get_value("Inn Reservation", reservation_id, "channel")
+	channel = get_channel(channel_name)
+	tax_plans = get_tax_plans([plan.room_rate_tax, plan.breakfast_tax])
+	return compute_rate_breakdown(plan, tax_plans[plan.room_rate_tax].rows, tax_plans[plan.breakfast_tax].rows, actual_rate, channel)[:4]
 
 @frappe.whitelist()
 def get_actual_room_rate_breakdown(room_rate_id, actual_rate):
-	room_rate_doc = frappe.get_doc('Inn Room Rate', room_rate_id)
-
-	room_rate_tax = room_rate_doc.room_rate_tax
-	room_rate = get_actual_room_rate_before_from_actual_rate(room_rate_id, actual_rate)
-	breakfast_tax = room_rate_doc.breakfast_tax
-	breakfast_rate = room_rate_doc.breakfast_rate
-
-	return room_rate_tax, room_rate, breakfast_tax, breakfast_rate
+	plan = get_room_rate_plan(room_rate_id)
+	tax_plans = get_tax_plans([plan.room_rate_tax, plan.breakfast_tax])
+	return compute_rate_breakdown(plan, tax_plans[plan.room_rate_tax].rows, tax_plans[plan.breakfast_tax].rows, actual_rate)[:4]
 
 @frappe.whitelist()
 def calculate_rate_breakdown_from_final_rate(room_rate_tax_name, breakfast_tax_name, final_room_rate_amount, final_breakfast_rate_amount):
+	tax_plans = get_tax_plans([room_rate_tax_name, breakfast_tax_name])
+
 	# Calculate for room rate
-	room_rate_tax_breakdown_list = frappe.get_all('Inn Tax Breakdown',
-												  filters={'parent': room_rate_tax_name},
-												  order_by="idx desc",
-												  fields=['*'])
+	room_rate_tax_breakdown_list = tax_plans[room_rate_tax_name].rows[::-1]
 
 	if len(room_rate_tax_breakdown_list) > 0 :
 		room_tax_id = [""] * len(room_rate_tax_breakdown_list)
@@ -137,10 +181,7 @@ def calculate_rate_breakdown_from_final_rate(room_rate_tax_name, breakfast_tax_n
 		frappe.msgprint("Tax Breakdown in " + room_rate_tax_name + " are not defined. Please define it first.")
 
 	# Calculate for breakfast rate
-	breakfast_rate_tax_breakdown_list = frappe.get_all('Inn Tax Breakdown',
-													   filters={'parent': breakfast_tax_name},
-													   order_by="idx desc",
-													   fields=['*'])
+	breakfast_rate_tax_breakdown_list = tax_plans[breakfast_tax_name].rows[::-1]
 	if len(breakfast_rate_tax_breakdown_list) > 0:
 		bf_tax_id = [""] * len(breakfast_rate_tax_breakdown_list)
 		bf_rate_before = [0] * len(breakfast_rate_tax_breakdown_list)
@@ -68,11 +68,14 @@ function search(doc) {
 		}
 
 		frappe.call({
-			method: 'inn.inn_hotels.doctype.inn_room_type.inn_room_type.get_all_room_type',
+			method: 'inn.inn_hotels.doctype.inn_room_type_availability_page.inn_room_type_availability_page.get_room_type_availability_range',
+			args: {
+				start: doc.start,
+				end: doc.end
+			},
 			callback: (resp) => {
-				console.log(resp.message);
-				resp.message.forEach( elm => {
-					console.log(elm.name);
+				var fragment = document.createDocumentFragment();
+				resp.message.room_types.forEach(elm => {
 					var tr = document.createElement('tr');
 					tr.className = 'grid-row';
 
@@ -81,40 +84,16 @@ function search(doc) {
 					td.innerHTML = elm.name;
 					tr.appendChild(td);
 
-					var start = new Date(doc.start);
-					var	end = new Date(doc.end);
-
-					var loop = function(start, end) {
-						get_room_type_availability(start, function(){
-							start.setDate(start.getDate() + 1);
-							if (start <= end) {
-								loop(start, end);
-							}
-						})
-					}
-
-					function get_room_type_availability(date, fun) {
-
-						frappe.call({
-							method: 'inn.inn_hotels.doctype.inn_room_type_availability_page.inn_room_type_availability_page.get_room_type_availability',
-							args: {
-								room_type: elm.name,
-								date: formatDate(date)
-							},
-							callback: (resp)=>{
-								console.log(resp.message)
-								var td = document.createElement('td');
-								td.className = 'grid-static-col';
-								td.innerHTML = parseInt(resp.message[0])-parseInt(resp.message[1]);
-								tr.appendChild(td);
-								fun();
-							}
-						});
-					}
-					loop(start, end);
-					document.getElementById('table-calendar').appendChild(tr);
+					elm.available.forEach((available, i) => {
+						var td = document.createElement('td');
+						td.className = 'grid-static-col';
+						td.innerHTML = available;
+						td.title = elm.booked[i] + ' / ' + elm.total + ' booked';
+						tr.appendChild(td);
+					});
+					fragment.appendChild(tr);
 				});
-
+				document.getElementById('table-calendar').appendChild(fragment);
 			}
 		});
 	}
@@ -4,15 +4,17 @@
 
 from __future__ import unicode_literals
 import frappe
+from datetime import timedelta
 from frappe.model.document import Document
+from frappe.utils import getdate
+
+ROOM_TYPE_AVAILABILITY_CACHE_KEY = 'inn_room_type_availability'
+ROOM_TYPE_AVAILABILITY_CACHE_TTL = 3600
 
 class InnRoomTypeAvailabilityPage(Document):
 	pass
 @frappe.whitelist()
 def get_room_type_availability(room_type, date):
-	print("INI DATE")
-	print(date)
-
 	default_availability = frappe.db.sql(
 		'SELECT count(`name`) '
 		'FROM `tabInn Room` '
@@ -21,25 +23,62 @@ def get_room_type_availability(room_type, date):
 		(room_type))
 
 	availability = frappe.db.sql(
-		'SELECT count(`tabInn Room Booking`.name) '
-		'FROM `tabInn Room` '
-		'left join `tabInn Room Booking` '
-		'on `tabInn Room Booking`.room_id = `tabInn Room`.name '
+		'SELECT count(`tabInn Room Night`.name) '
+		'FROM `tabInn Room Night` '
+		'inner join `tabInn Room` '
+		'on `tabInn Room Night`.room_id = `tabInn Room`.name '
 		'WHERE room_type = %s '
-		'AND %s >= start '
-		'AND %s < end '
-		'AND `tabInn Room Booking`.status in (%s, %s) ',
-		(room_type, date, date, 'Booked', 'Stayed'))
-
+		'AND `tabInn Room Night`.date = %s '
+		'AND `tabInn Room Night`.status in (%s, %s) ',
+		(room_type, date, 'Booked', 'Stayed'))
 
 	if len(default_availability) > 0:
-		# print("default availability")
-		# print(int(default_availability))
-		# print("availability")
-		# print(int(availability))
-		# final_availability = int(default_availability) - int(availability)
-		# return final_availability
 		return default_availability, availability
 	else:
-		print("kosonk")
 		return [0,0]
+
+@frappe.whitelist()
+def get_room_type_availability_range(start, end):
+	'''
+	total/booked/available rooms of every room type for every day of [start, end].
+	:return {'dates': [date], 'room_types': [{'name', 'total', 'booked': [per date], 'available': [per date]}]}
+
+	cached per range and state of Inn Room / Inn Room Booking, any booking change gives a new cache key.
+	'''
+	start = getdate(start)
+	end = getdate(end)
+
+	booking_state = frappe.db.sql('SELECT max(modified), count(*) FROM `tabInn Room Booking`')[0]
+	room_state = frappe.db.sql('SELECT max(modified), count(*) FROM `tabInn Room`')[0]
+	cache_key = '{0}:{1}|{2}|{3}|{4}'.format(ROOM_TYPE_AVAILABILITY_CACHE_KEY, start, end,
+											 '/'.join(str(v) for v in booking_state), '/'.join(str(v) for v in room_state))
+	result = frappe.cache().get_value(cache_key)
+	if result is not None:
+		return result
+
+	dates = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+	total = dict(frappe.db.sql(
+		'SELECT room_type, count(*) FROM `tabInn Room` GROUP BY room_type'))
+	booked = {}
+	for room_type, date, count in frappe.db.sql(
+		'SELECT ir.room_type, irn.date, count(*) '
+		'FROM `tabInn Room Night` as irn '
+		'INNER JOIN `tabInn Room` as ir ON ir.name = irn.room_id '
+		'WHERE irn.date BETWEEN %s AND %s AND irn.status in (%s, %s) '
+		'GROUP BY ir.room_type, irn.date',
+		(start, end, 'Booked', 'Stayed')):
+		booked[(room_type, date)] = count
+
+	room_types = []
+	for room_type in frappe.get_all('Inn Room Type', pluck='name'):
+		booked_per_day = [booked.get((room_type, date), 0) for date in dates]
+		room_types.append({
+			'name': room_type,
+			'total': total.get(room_type, 0),
+			'booked': booked_per_day,
+			'available': [total.get(room_type, 0) - count for count in booked_per_day],
+		})
+
+	result = {'dates': [str(date) for date in dates], 'room_types': room_types}
+	frappe.cache().set_value(cache_key, result, expires_in_sec=ROOM_TYPE_AVAILABILITY_CACHE_TTL)
+	return result
@@ -181,7 +181,7 @@ function populate_payment_refund(frm, shift_id) {
 						$.each(r_payment.message[0], function (i, d) {
 							let item = frm.add_child('cr_payment_transaction');
 							item.type = d.type;
-							item.trx_id = d.trx_id;
+							item.transaction_id = d.transaction_id;
 							item.reservation_id = d.reservation_id;
 							item.folio_id = d.folio_id;
 							item.customer_id = d.customer_id;
@@ -214,7 +214,7 @@ function populate_payment_refund(frm, shift_id) {
 						$.each(r_refund.message[0], function (i, d) {
 							let item = frm.add_child('cr_refund_transaction');
 							item.type = d.type;
-							item.trx_id = d.trx_id;
+							item.transaction_id = d.transaction_id;
 							item.reservation_id = d.reservation_id;
 							item.folio_id = d.folio_id;
 							item.customer_id = d.customer_id;
@@ -4,11 +4,12 @@
 
 from __future__ import unicode_literals
 
-from datetime import datetime, timedelta
-
 import frappe
-from frappe.utils import now
+from frappe.utils import now, flt
 from frappe.model.document import Document
+from inn.helper.bulk import bulk_insert_docs
+
+CR_TRANSACTION_FIELDS = ['type', 'transaction_id', 'reservation_id', 'folio_id', 'customer_id', 'account', 'amount', 'user']
 
 class InnShift(Document):
 	def before_insert(self):
@@ -28,462 +29,133 @@ def get_last_closed_shift():
 	else:
 		return None
 
+PAYMENT_TRANSACTION_TYPES = ['Deposit', 'DP Kamar', 'Room Payment', 'Down Payment', 'Payment']
+PAYMENT_RESERVATION_STATUS = ['Reserved', 'In House', 'Finish', 'Cancel']
+REFUND_RESERVATION_STATUS = ['In House', 'Finish', 'Cancel']
+
+def get_shift_window_start():
+	# transactions created since the last closed shift belong to the current one, everything when no shift was closed yet
+	last_shift = frappe.get_all('Inn Shift', filters={'status': 'Closed'}, fields=['time_out'],
+								order_by='creation desc', limit_page_length=1)
+	if last_shift:
+		return last_shift[0].time_out
+	return None
+
+def _cashier_transaction_conditions(transaction_types, reservation_status, since, debit_only):
+	conditions = """
+		trx.parenttype = 'Inn Folio' and trx.is_void = 0 and trx.transaction_type in %(transaction_types)s
+		and ((folio.type = 'Guest' and reservation.status in %(reservation_status)s)
+			or (folio.type in ('Master', 'Desk') and folio.status in ('Open', 'Closed')))
+	"""
+	values = {'transaction_types': transaction_types, 'reservation_status': reservation_status}
+	if since:
+		conditions += " and trx.creation >= %(since)s"
+		values['since'] = since
+	if debit_only:
+		# Master and Desk folio transactions count whatever their flag
+		conditions += " and (folio.type != 'Guest' or trx.flag = 'Debit')"
+	return conditions, values
+
+def get_cashier_transactions(transaction_types, reservation_status, account_field, since=None, debit_only=False):
+	"""
+	:return list of Inn CR Payment/Refund Transaction row (dict) of every non void transaction in the shift window,
+	from Guest folios of reservation in reservation_status and from Open/Closed Master and Desk folios
+	"""
+	conditions, values = _cashier_transaction_conditions(transaction_types, reservation_status, since, debit_only)
+	return frappe.db.sql("""
+		select
+			trx.transaction_type as type, trx.name as transaction_id,
+			if(folio.type = 'Guest', folio.reservation_id, null) as reservation_id, folio.name as folio_id,
+			if(folio.type = 'Guest', reservation.customer_id, folio.customer_id) as customer_id,
+			trx.{account_field} as account, trx.amount, %(user)s as user
+		from `tabInn Folio Transaction` as trx
+		inner join `tabInn Folio` as folio on folio.name = trx.parent
+		left join `tabInn Reservation` as reservation on reservation.name = folio.reservation_id
+		where {conditions}
+		order by trx.creation
+	""".format(account_field=account_field, conditions=conditions), dict(values, user=frappe.session.user), as_dict=True)
+
+def get_cashier_totals_per_mode_of_payment(transaction_types, reservation_status, since=None):
+	conditions, values = _cashier_transaction_conditions(transaction_types, reservation_status, since, False)
+	return frappe.db.sql("""
+		select mode_of_payment.name as mode_of_payment, sum(trx.amount) as amount
+		from `tabInn Folio Transaction` as trx
+		inner join `tabMode of Payment` as mode_of_payment on mode_of_payment.name = trx.mode_of_payment
+		inner join `tabInn Folio` as folio on folio.name = trx.parent
+		left join `tabInn Reservation` as reservation on reservation.name = folio.reservation_id
+		where {conditions}
+		group by mode_of_payment.name
+		having sum(trx.amount) > 0
+		order by mode_of_payment.name
+	""".format(conditions=conditions), values, as_dict=True)
+
 @frappe.whitelist()
 def populate_cr_payment(shift_id):
-	returned_cr_payment_detail_list = []
-	cr_payment_detail_list = []
-	transaction_list = []
-	list_of_payment_type = ['Deposit', 'DP Kamar', 'Room Payment', 'Down Payment', 'Payment']
-	mode_of_payment = frappe.get_all('Mode of Payment')
-	reservation_list = frappe.get_all('Inn Reservation', filters={'status': ['in', ['Reserved', 'In House', 'Finish', 'Cancel']]}, fields=['*'])
-	if shift_id:
-		last_shift = get_last_closed_shift()
-		if last_shift is None:
-			# Get Guest Folio Transaction type Payment that appear from the beginning
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'parent': folio_name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.reservation_id = reservation_item.name
-					payment_transaction_doc.folio_id = folio_name
-					payment_transaction_doc.customer_id = reservation_item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-			# Get Master/Desk Folio transactions type Payment that appear from the beginning
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'parent': item.name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.folio_id = item.name
-					payment_transaction_doc.customer_id = item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-		else:
-			# Get Guest Folio Transactions type Payment that appear since last shift
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'creation': ['>=', last_shift.time_out],
-																 'parent': folio_name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.reservation_id = reservation_item.name
-					payment_transaction_doc.folio_id = folio_name
-					payment_transaction_doc.customer_id = reservation_item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-			# Get Master/Desk Folio transactions type Payment that appear since last shift
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'creation': ['>=', last_shift.time_out],
-																 'parent': item.name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.folio_id = item.name
-					payment_transaction_doc.customer_id = item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-	else:
-		if len(frappe.get_all('Inn Shift')) > 0:
-			last_shift = get_last_closed_shift()
-			# Get Guest Folio Transactions type Payment that appear since last shift
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'creation': ['>=', last_shift.time_out],
-																 'parent': folio_name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.reservation_id = reservation_item.name
-					payment_transaction_doc.folio_id = folio_name
-					payment_transaction_doc.customer_id = reservation_item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-			# Get Master/Desk Folio transactions type Payment that appear since last shift
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'creation': ['>=', last_shift.time_out],
-																 'parent': item.name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.folio_id = item.name
-					payment_transaction_doc.customer_id = item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-		else:
-			# Get Guest Folio Transaction type Payment that appear from the beginning
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'parent': folio_name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.reservation_id = reservation_item.name
-					payment_transaction_doc.folio_id = folio_name
-					payment_transaction_doc.customer_id = reservation_item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-			# Get Master/Desk Folio transactions type Payment that appear from the beginning
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'parent': item.name,
-																 'transaction_type': ['in', list_of_payment_type],
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					payment_detail_doc = frappe.new_doc('Inn CR Payment Detail')
-					payment_detail_doc.mode_of_payment = folio_trx_item.mode_of_payment
-					payment_detail_doc.amount = folio_trx_item.amount
-					cr_payment_detail_list.append(payment_detail_doc)
-
-					payment_transaction_doc = frappe.new_doc('Inn CR Payment Transaction')
-					payment_transaction_doc.type = folio_trx_item.transaction_type
-					payment_transaction_doc.transaction_id = folio_trx_item.name
-					payment_transaction_doc.folio_id = item.name
-					payment_transaction_doc.customer_id = item.customer_id
-					payment_transaction_doc.account = folio_trx_item.debit_account
-					payment_transaction_doc.amount = folio_trx_item.amount
-					payment_transaction_doc.user = payment_transaction_doc.owner
-					transaction_list.append(payment_transaction_doc)
-
-	for mode_of_payment_item in mode_of_payment:
-		new_payment_detail = frappe.new_doc('Inn CR Payment Detail')
-		new_payment_detail.mode_of_payment = mode_of_payment_item.name
-		new_payment_detail.amount = 0
-		for cr_payment_detail_item in cr_payment_detail_list:
-			if cr_payment_detail_item.mode_of_payment == new_payment_detail.mode_of_payment:
-				new_payment_detail.amount += float(cr_payment_detail_item.amount)
-		if new_payment_detail.amount > 0:
-			returned_cr_payment_detail_list.append(new_payment_detail)
-
+	since = get_shift_window_start()
+	transaction_list = get_cashier_transactions(PAYMENT_TRANSACTION_TYPES, PAYMENT_RESERVATION_STATUS, 'debit_account', since)
+	returned_cr_payment_detail_list = get_cashier_totals_per_mode_of_payment(PAYMENT_TRANSACTION_TYPES, PAYMENT_RESERVATION_STATUS, since)
 
 	return transaction_list, returned_cr_payment_detail_list
 
 @frappe.whitelist()
 def populate_cr_refund(shift_id):
-	returned_cr_refund_detail_list = []
-	transaction_list = []
-	cr_refund = frappe.new_doc('Inn CR Refund Detail')
-	cr_refund.type = 'Refund'
-	cr_refund.amount = 0
-	reservation_list = frappe.get_all('Inn Reservation', filters={'status': ['in', ['In House', 'Finish', 'Cancel']]},
-									  fields=['*'])
-
-	if shift_id:
-		last_shift = get_last_closed_shift()
-		if last_shift is None:
-			# Get all Guest Folio Transactions Refund that appear from beginning
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'parent': folio_name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.reservation_id = reservation_item.name
-					refund_detail_doc.folio_id = folio_name
-					refund_detail_doc.customer_id = reservation_item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-			# Get all Master/Desk Folio Transactions Refund that appear from beginning
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'parent': item.name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.folio_id = item.name
-					refund_detail_doc.customer_id = item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-		else:
-			# Get all Guest Folio Transactions Refund that appear since last shift
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'creation': ['>=', last_shift.time_out],
-																 'parent': folio_name,
-																 'flag': 'Debit',
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.reservation_id = reservation_item.name
-					refund_detail_doc.folio_id = folio_name
-					refund_detail_doc.customer_id = reservation_item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-			# Get all Master/Desk Folio Transactions Refund that appear since last shift
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'creation': ['>=', last_shift.time_out],
-																 'parent': item.name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.folio_id = item.name
-					refund_detail_doc.customer_id = item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-	else:
-		if len(frappe.get_all('Inn Shift')) > 0:
-			last_shift = get_last_closed_shift()
-			# Get all Guest Folio Transactions Refund that appear since last shift
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'creation': ['>=', last_shift.time_out],
-																 'parent': folio_name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.reservation_id = reservation_item.name
-					refund_detail_doc.folio_id = folio_name
-					refund_detail_doc.customer_id = reservation_item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-			# Get all Master/Desk Folio Transactions Refund that appear since last shift
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'creation': ['>=', last_shift.time_out],
-																 'parent': item.name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.folio_id = item.name
-					refund_detail_doc.customer_id = item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-		else:
-			# Get all Guest Folio Transactions Refund that appear from beginning
-			for reservation_item in reservation_list:
-				folio_name = frappe.db.get_value('Inn Folio', {'reservation_id': reservation_item.name}, ['name'])
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'parent': folio_name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.reservation_id = reservation_item.name
-					refund_detail_doc.folio_id = folio_name
-					refund_detail_doc.customer_id = reservation_item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-			# Get all Master/Desk Folio Transactions Refund that appear from beginning
-			master_desk_folio_list = frappe.get_all('Inn Folio',
-													filters={'type': ['in', ['Master', 'Desk']],
-															 'status': ['in', ['Open', 'Closed']]},
-													fields=['*'])
-			for item in master_desk_folio_list:
-				folio_transaction_list = frappe.get_all('Inn Folio Transaction',
-														filters={'transaction_type': 'Refund',
-																 'parent': item.name,
-																 'is_void': 0},
-														fields=['*'])
-				for folio_trx_item in folio_transaction_list:
-					cr_refund.amount += folio_trx_item.amount
-
-					refund_detail_doc = frappe.new_doc('Inn CR Refund Transaction')
-					refund_detail_doc.type = folio_trx_item.transaction_type
-					refund_detail_doc.transaction_id = folio_trx_item.name
-					refund_detail_doc.folio_id = item.name
-					refund_detail_doc.customer_id = item.customer_id
-					refund_detail_doc.account = folio_trx_item.credit_account
-					refund_detail_doc.amount = folio_trx_item.amount
-					refund_detail_doc.user = refund_detail_doc.owner
-					transaction_list.append(refund_detail_doc)
-
-	returned_cr_refund_detail_list.append(cr_refund)
-
-	return transaction_list, returned_cr_refund_detail_list
+	since = get_shift_window_start()
+	# guest refund of an existing shift only counts Debit transactions since the last closed shift
+	debit_only = bool(shift_id and since)
+	transaction_list = get_cashier_transactions(['Refund'], REFUND_RESERVATION_STATUS, 'credit_account', since, debit_only)
+
+	cr_refund = frappe._dict({'type': 'Refund', 'amount': sum(item.amount for item in transaction_list)})
+
+	return transaction_list, [cr_refund]
+
+def refresh_cash_reconciliation(shift_id):
+	"""
+	rebuild Payment/Refund detail and transaction children of the shift with bulk inserts and update its totals.
+	"""
+	payment_transaction_list, payment_detail_list = populate_cr_payment(shift_id)
+	refund_transaction_list, refund_detail_list = populate_cr_refund(shift_id)
+
+	children = [
+		('cr_payment_transaction', 'Inn CR Payment Transaction', CR_TRANSACTION_FIELDS, payment_transaction_list),
+		('payment_detail', 'Inn CR Payment Detail', ['mode_of_payment', 'amount'], payment_detail_list),
+		('cr_refund_transaction', 'Inn CR Refund Transaction', CR_TRANSACTION_FIELDS, refund_transaction_list),
+		('refund_detail', 'Inn CR Refund Detail', ['type', 'amount'], refund_detail_list),
+	]
+	for parentfield, doctype, fields, items in children:
+		frappe.db.delete(doctype, {'parent': shift_id, 'parenttype': 'Inn Shift', 'parentfield': parentfield})
+		rows = []
+		for idx, item in enumerate(items, 1):
+			row = {field: item.get(field) for field in fields}
+			row.update({
+				'name': frappe.generate_hash(length=10),
+				'parent': shift_id,
+				'parenttype': 'Inn Shift',
+				'parentfield': parentfield,
+				'idx': idx,
+			})
+			rows.append(row)
+		bulk_insert_docs(doctype, fields + ['parent', 'parenttype', 'parentfield', 'idx'], rows)
+
+	opening = flt(frappe.db.get_value('Inn Shift', shift_id, 'opening'))
+	total_payment = sum(flt(item.amount) for item in payment_detail_list)
+	total_cash_payment = sum(flt(item.amount) for item in payment_detail_list if item.mode_of_payment == 'Cash')
+	total_refund = sum(flt(item.amount) for item in refund_detail_list)
+	frappe.db.set_value('Inn Shift', shift_id, {
+		'total_payment': total_payment,
+		'total_refund': total_refund,
+		'balance': opening + total_payment - total_refund,
+		'cash_balance': opening + total_cash_payment - total_refund,
+	}, update_modified=False)
 
 @frappe.whitelist()
 def close_shift(shift_id):
-	doc = frappe.get_doc('Inn Shift', shift_id)
-	doc.time_out = now()
-	doc.username = frappe.session.user
-	doc.status = 'Closed'
-	doc.save()
+	refresh_cash_reconciliation(shift_id)
+	# only the header changes, saving the whole doc would rewrite every CR child row one by one
+	frappe.db.set_value('Inn Shift', shift_id, {
+		'time_out': now(),
+		'username': frappe.session.user,
+		'status': 'Closed',
+	})
 
 	if frappe.db.get_value('Inn Shift', {'name': shift_id}, ['status']) == 'Closed':
 		return True
@@ -4,12 +4,30 @@
 
 from __future__ import unicode_literals
 import frappe
+from collections import namedtuple
 from frappe.model.document import Document
-from inn.inn_hotels.doctype.inn_channel.inn_channel import check_channel_commission
+from frappe.utils import cint
+from inn.helper.cache import VersionedCache
+
+# Compiled, immutable form of an Inn Tax: breakdown rows ordered by idx with only the fields the calculation needs.
+InnTaxPlan = namedtuple('InnTaxPlan', ['inn_tax_id', 'rows'])
+InnTaxPlanRow = namedtuple('InnTaxPlanRow', ['name', 'breakdown_type', 'breakdown_rate', 'breakdown_row_id',
+											 'breakdown_account', 'breakdown_amount'])
+
+TAX_PLAN_CACHE_KEY = 'inn_tax_plan'
+_tax_plan_cache = VersionedCache(TAX_PLAN_CACHE_KEY)
 
 
 class InnTax(Document):
-	pass
+	def on_update(self):
+		clear_tax_plan_cache(self.name)
+
+	def on_trash(self):
+		clear_tax_plan_cache(self.name)
+
+	def after_rename(self, old, new, merge=False):
+		clear_tax_plan_cache(old)
+		clear_tax_plan_cache(new)
 
 def autoname(self):
 	# Doc Name = doc Title + Company Abbr
@@ -38,7 +56,13 @@ def calculate_inn_tax_and_charges_exclude_commision(base_total, inn_tax_id, comm
 	top down approach, from customer payable then reduced from commission, then calculate all tax
 	'''
 	
-	tax_breakdown_list = frappe.get_all("Inn Tax Breakdown", filters={"parent": inn_tax_id}, order_by="idx asc", fields=["*"])
+	return apply_tax_breakdown_exclude_commision(base_total, get_tax_plan(inn_tax_id).rows, commission)
+
+def apply_tax_breakdown_exclude_commision(base_total, tax_breakdown_list, commission):
+	'''
+	same as calculate_inn_tax_and_charges_exclude_commision, but on already loaded Inn Tax Breakdown rows (ordered by idx).
+	does not touch the database.
+	'''
 	if len(tax_breakdown_list) == 0:
 		return [], [], []
 
@@ -66,8 +90,10 @@ def calculate_inn_tax_and_charges_exclude_commision(base_total, inn_tax_id, comm
 def calculate_inn_tax_and_charges(base_total, inn_tax_id):
 	# UPDATE: FOR NOW, THE OPTION OF TAX BREAKDOWN IS LIMITED TO ON NET TOTAL
 
-	tax_breakdown_list = frappe.get_all('Inn Tax Breakdown', filters={'parent': inn_tax_id}, order_by="idx asc", fields=['*'])
+	return apply_tax_breakdown(base_total, get_tax_plan(inn_tax_id).rows)
 
+def apply_tax_breakdown(base_total, tax_breakdown_list):
+	# same as calculate_inn_tax_and_charges, but on already loaded Inn Tax Breakdown rows (ordered by idx)
 	if len(tax_breakdown_list) > 0:
 		tb_id = [""] * len(tax_breakdown_list)
 		tb_amount = [0] * len(tax_breakdown_list)
@@ -122,4 +148,72 @@ def calculate_inn_tax_and_charges(base_total, inn_tax_id):
 		tb_amount = 0
 		tb_total = base_total
 
-	return tb_id, tb_amount, tb_total
\ No newline at end of file
+	return tb_id, tb_amount, tb_total
+
+def evaluate_tax_plan(plan, base_totals):
+	'''
+	apply calculate_inn_tax_and_charges to many base totals at once, row by row over the whole array.
+	:param plan InnTaxPlan from get_tax_plan
+	:param base_totals list of base total
+	:return list of (tb_amount, tb_total) in the same order as base_totals
+	'''
+	if len(plan.rows) == 0:
+		return [(0, base_total) for base_total in base_totals]
+
+	amounts = []
+	totals = []
+	for index, item in enumerate(plan.rows):
+		previous_totals = totals[index-1] if index > 0 else base_totals
+		if item.breakdown_type == 'Amount':
+			row_amount = [item.breakdown_amount] * len(base_totals)
+		elif item.breakdown_type == 'On Net Total':
+			row_amount = [float(int(item.breakdown_rate/100.0 * total)) for total in previous_totals]
+		elif index > 0 and item.breakdown_type in ('On Previous Row Amount', 'On Previous Row Total'):
+			# only a row above can be referenced, apply_tax_breakdown reads 0 from any other row
+			row_id = cint(item.breakdown_row_id)
+			if 0 < row_id <= index:
+				referenced = (amounts if item.breakdown_type == 'On Previous Row Amount' else totals)[row_id-1]
+			else:
+				referenced = [0] * len(base_totals)
+			row_amount = [float(int(item.breakdown_rate/100.0 * value)) for value in referenced]
+		else:
+			amounts.append([0] * len(base_totals))
+			totals.append([0] * len(base_totals) if index > 0 else list(base_totals))
+			continue
+		amounts.append(row_amount)
+		totals.append([total + amount for total, amount in zip(previous_totals, row_amount)])
+
+	return [([row[i] for row in amounts], [row[i] for row in totals]) for i in range(len(base_totals))]
+
+def get_tax_plan(inn_tax_id):
+	return get_tax_plans([inn_tax_id])[inn_tax_id]
+
+def get_tax_plans(inn_tax_ids):
+	'''
+	:param inn_tax_ids list of Inn Tax name
+	:return dict of Inn Tax name to InnTaxPlan
+
+	plans are looked up in the process local cache, then redis, and the remaining ones are compiled with a single query.
+	'''
+	plans = {inn_tax_id: InnTaxPlan(inn_tax_id, ()) for inn_tax_id in inn_tax_ids if not inn_tax_id}
+	plans.update(_tax_plan_cache.get_many([inn_tax_id for inn_tax_id in inn_tax_ids if inn_tax_id], compile_tax_plans))
+	return plans
+
+def compile_tax_plans(inn_tax_ids):
+	compiled = {inn_tax_id: [] for inn_tax_id in inn_tax_ids}
+	for item in frappe.get_all('Inn Tax Breakdown', filters={'parent': ['in', inn_tax_ids], 'parenttype': 'Inn Tax'},
+							   fields=['*'], order_by='parent asc, idx asc'):
+		compiled[item.parent].append(InnTaxPlanRow(item.name, item.breakdown_type, item.breakdown_rate,
+												   item.breakdown_row_id, item.breakdown_account,
+												   item.get('breakdown_amount')))
+	return {inn_tax_id: InnTaxPlan(inn_tax_id, tuple(rows)) for inn_tax_id, rows in compiled.items()}
+
+def clear_tax_plan_cache(inn_tax_id=None):
+	_tax_plan_cache.invalidate(inn_tax_id)
+
+def get_tax_breakdown_account(inn_tax_id, breakdown_name):
+	# breakdown_account of an Inn Tax Breakdown row, served from the tax plan instead of loading the row
+	for item in get_tax_plan(inn_tax_id).rows:
+		if item.name == breakdown_name:
+			return item.breakdown_account
+	return frappe.db.get_value('Inn Tax Breakdown', breakdown_name, 'breakdown_account')
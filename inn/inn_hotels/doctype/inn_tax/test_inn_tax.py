@@ -6,5 +6,23 @@ from __future__ import unicode_literals
 import frappe
 import unittest
 
+from inn.inn_hotels.doctype.inn_tax.inn_tax import InnTaxPlan, InnTaxPlanRow, apply_tax_breakdown, evaluate_tax_plan
+
 class TestInnTax(unittest.TestCase):
-	pass
+	def test_evaluate_tax_plan_matches_apply_tax_breakdown(self):
+		rows = (
+			InnTaxPlanRow('Service', 'On Net Total', 10.0, None, None, 0),
+			InnTaxPlanRow('Tax', 'On Previous Row Total', 11.0, 1, None, 0),
+			InnTaxPlanRow('Levy', 'On Previous Row Amount', 5.0, 2, None, 0),
+			# referencing itself or a row below, read as 0
+			InnTaxPlanRow('Self', 'On Previous Row Amount', 5.0, 4, None, 0),
+			InnTaxPlanRow('Below', 'On Previous Row Total', 5.0, 6, None, 0),
+			InnTaxPlanRow('Fixed', 'Amount', 0.0, None, None, 2500.0),
+		)
+		base_totals = [100000.0, 275000.0, 0.0]
+
+		evaluated = evaluate_tax_plan(InnTaxPlan('TEST', rows), base_totals)
+		for base_total, (amounts, totals) in zip(base_totals, evaluated):
+			_, tb_amount, tb_total = apply_tax_breakdown(base_total, rows)
+			self.assertEqual(amounts, tb_amount)
+			self.assertEqual(totals, tb_total)
@@ -20,6 +20,21 @@ frappe.query_reports["Audit Report"] = {
 	"name_field": "account",
 	"parent_field": "parent_account",
 	"initial_depth": 1,
+	onload(query_report) {
+		query_report.page.add_inner_button(__("Export CSV"), () => {
+			let { date, fill_mode_payment } = query_report.get_filter_values()
+			frappe.prompt([
+				{ fieldname: "from_date", label: __("From Date"), fieldtype: "Date", reqd: 1, default: date },
+				{ fieldname: "to_date", label: __("To Date"), fieldtype: "Date", reqd: 1, default: date },
+			], (values) => {
+				window.open(frappe.urllib.get_full_url(
+					"/api/method/inn.inn_hotels.report.audit_report.audit_report.export_audit_report?"
+					+ "from_date=" + encodeURIComponent(values.from_date)
+					+ "&to_date=" + encodeURIComponent(values.to_date)
+					+ "&fill_mode_payment=" + (fill_mode_payment ? 1 : 0)))
+			}, __("Export Audit Report"), __("Export"))
+		})
+	},
 	"formatter": function (value, row, column, data, default_formatter) {
 		value = default_formatter(value, row, column, data)
 
@@ -1,17 +1,11 @@
 import frappe
 from datetime import date, timedelta
 from dateutil.parser import parse
+from inn.helper.export import stream_csv
 
 FILTER_FIELD_DATE = "expected_arrival"
 FILTER_FIELD_STATUS = "status"
 STATUS_RESERVED = "Reserved"
-TRANSACTION_TYPE_ROOM_REVENUE = ""
-TRANSACTION_TYPE_COMISSION = ""
-TRANSACTION_TYPE_BREAKFAST_REVENUE = ""
-TRANSACTION_TYPE_PAYMENT = ""
-TRANSACTION_TYPE_ROOM_PAYMENT = ""
-BREAKFAST_REVENUE_ACCOUNT = ""
-ROOM_REVENUE_ACCOUNT = ""
 
 '''goals:
 
@@ -36,7 +30,11 @@ opt1:
 
 
 def execute(filters=None):
-    columns = [
+    return get_columns(), get_data(filters)
+
+
+def get_columns():
+    return [
         {
             'fieldname': 'rsv',
             'label': 'RSV',
@@ -129,170 +127,128 @@ def execute(filters=None):
         }
     ]
 
-    data = get_data(filters)
-
-    return columns, data
-
 
 def get_data(filters):
     if filters.date == None:
         filters.date = date.today().isoformat()
 
-    return get_data_detail(filters.date, filters.fill_mode_payment)
-
-
-def get_data_detail(start_date, is_show_mode_payment):
-    query = f"""
-        select ir.name, ir.status, ir.customer_id, ir.room_type, ir.actual_room_id, ir.channel, ir.actual_room_rate, if.name as folio, if.bill_instructions
-        from `tabInn Reservation` as ir
-        left join `tabInn Folio` as `if`
-        on if.reservation_id = ir.name
-        where 
-        (ir.status = 'In House' and ir.expected_arrival <= '{start_date}') or
-        (ir.status = 'Finish' and ir.expected_arrival <= '{start_date}' and ir.expected_departure > '{start_date}')
-    """
+    return list(iter_audit_rows(filters.date, filters.fill_mode_payment))
 
-    reservation = frappe.db.sql(query=query, as_dict=1)
-    if len(reservation) == 0:
-        return []
 
-    folio_name = tuple([x.folio for x in reservation])
-    folio_detail = get_folio_detail(folio_name, start_date)
+def iter_audit_rows(audit_date, is_show_mode_payment):
+    """Yield the report rows of one audit date, one per in house reservation folio.
 
-    if is_show_mode_payment:
-        res = [
-            [x.name,
-             x.customer_id,
-             x.room_type,
-             x.actual_room_id,
-             folio_detail[x.folio]["actual_room_rate"],
-             folio_detail[x.folio]["actual_room_nett"],
-             folio_detail[x.folio]["breakfast_revenue"],
-             folio_detail[x.folio]["comission"],  # comission
-             x.channel,
-             "",
-             # mode of payment
-             folio_detail[x.folio]["mode_of_payment"][:-2],
-             folio_detail[x.folio]["total_amount"],
-             folio_detail[x.folio]["payment_date"],  # paid date
-             "",
-             x.bill_instructions
-             ]
-            for x in reservation]
-    else:
-        res = [
-            [x.name,
-             x.customer_id,
-             x.room_type,
-             x.actual_room_id,
-             folio_detail[x.folio]["actual_room_rate"],
-             folio_detail[x.folio]["actual_room_nett"],
-             folio_detail[x.folio]["breakfast_revenue"],
-             folio_detail[x.folio]["comission"],  # comission
-             x.channel,
-             "",
-             "",  # mode of payment
-             folio_detail[x.folio]["total_amount"],
-             folio_detail[x.folio]["payment_date"],  # paid date
-             "",
-             x.bill_instructions
-             ]
-            for x in reservation]
-
-    return res
-
-
-def get_folio_detail(folio_id: list, start_date: str):
-    # folio detail
-    # need data:
-    # actual room nett, breakfast revenue, mode of payment, total_amount (payment_amount?), payment_date
-
-    fill_setting_data()
-    transaction_type_list = (TRANSACTION_TYPE_COMISSION, TRANSACTION_TYPE_ROOM_REVENUE,
-                             TRANSACTION_TYPE_BREAKFAST_REVENUE, TRANSACTION_TYPE_PAYMENT, TRANSACTION_TYPE_ROOM_PAYMENT)
-
-    if (len(folio_id) == 1):
-        folio_id_query = f"= '{folio_id[0]}'"
-    else:
-        folio_id_query = f'in {folio_id}'
-
-    query = f"""
-        select parent, transaction_type, amount, mode_of_payment, creation, actual_room_rate
-        from `tabInn Folio Transaction` as ift
-        where ift.parent {folio_id_query}
-        and
-        ift.transaction_type in {transaction_type_list} and
-        ift.audit_date = '{start_date}'
+    Transactions are summed per folio and transaction type by the database (one parameterized query backed by the
+    (audit_date, parent, transaction_type) index of Inn Folio Transaction), rows are formatted as they are read.
+    Payments are listed per folio from a second query, a group_concat would be cut at group_concat_max_len.
     """
-    print(query)
-    folio_detail = frappe.db.sql(query=query, as_dict=1)
-    res = {folio: {
-        "actual_room_rate": 0,
-        "actual_room_nett": 0,
-        "breakfast_revenue": 0,
-        "mode_of_payment": "",
-        "total_amount": 0,
-        "payment_date": "",
-        "comission": 0
-    } for folio in folio_id}
-
-    for data in folio_detail:
-        # populate aggrate folio data detail, grouped by folio number
-        if data.transaction_type == TRANSACTION_TYPE_ROOM_REVENUE:
-            res[data.parent]["actual_room_nett"] += data.amount
-            print(data)
-            res[data.parent]["actual_room_rate"] = data.actual_room_rate
-        elif data.transaction_type == TRANSACTION_TYPE_PAYMENT or data.transaction_type == TRANSACTION_TYPE_ROOM_PAYMENT:
-            res[data.parent]["mode_of_payment"] += f"BY {data.mode_of_payment} {data.amount:,}".replace(
-                ",", ".") + ", "
-            res[data.parent]["total_amount"] += data.amount
-            res[data.parent]["payment_date"] += f"{data.creation}, "
-        elif data.transaction_type == TRANSACTION_TYPE_BREAKFAST_REVENUE:
-            res[data.parent]["breakfast_revenue"] += data.amount
-        elif data.transaction_type == TRANSACTION_TYPE_COMISSION:
-            res[data.parent]["comission"] += data.amount
-
-    return res
-
-
-def fill_setting_data():
-    # get data setting
-    global TRANSACTION_TYPE_COMISSION, TRANSACTION_TYPE_ROOM_REVENUE, TRANSACTION_TYPE_BREAKFAST_REVENUE, TRANSACTION_TYPE_PAYMENT, TRANSACTION_TYPE_ROOM_PAYMENT, BREAKFAST_REVENUE_ACCOUNT, ROOM_REVENUE_ACCOUNT
-    transaction_type = frappe.db.get_values_from_single(fields=["profit_sharing_transaction_type", "room_revenue_transaction_type", "breakfast_revenue_transaction_type", "customer_payment_transaction_type",
-                                                        "customer_room_payment_transaction_type", "breakfast_revenue_account", "room_revenue_account"], filters="", doctype="Inn Hotels Setting", as_dict=True)[0]
-    if transaction_type.profit_sharing_transaction_type == None:
-        TRANSACTION_TYPE_COMISSION = "Comission Channel"
-    else:
-        TRANSACTION_TYPE_COMISSION = transaction_type.profit_sharing_transaction_type
-
-    if transaction_type.room_revenue_transaction_type == None:
-        TRANSACTION_TYPE_ROOM_REVENUE = "Room Charge"
-    else:
-        TRANSACTION_TYPE_ROOM_REVENUE = transaction_type.room_revenue_transaction_type
-
-    if transaction_type.breakfast_revenue_transaction_type == None:
-        TRANSACTION_TYPE_BREAKFAST_REVENUE = "Breakfast Charge"
-    else:
-        TRANSACTION_TYPE_BREAKFAST_REVENUE = transaction_type.breakfast_revenue_transaction_type
-
-    if transaction_type.customer_payment_transaction_type == None:
-        TRANSACTION_TYPE_PAYMENT = "Payment"
-    else:
-        TRANSACTION_TYPE_PAYMENT = transaction_type.customer_payment_transaction_type
-
-    if transaction_type.customer_room_payment_transaction_type == None:
-        TRANSACTION_TYPE_ROOM_PAYMENT = "Room Payment"
-    else:
-        TRANSACTION_TYPE_ROOM_PAYMENT = transaction_type.customer_room_payment_transaction_type
-
-    if transaction_type.breakfast_revenue_account == None:
+    settings = get_audit_settings()
+    payment_types = (settings.payment, settings.room_payment)
+    values = {
+        "audit_date": audit_date,
+        "room": settings.room_revenue,
+        "breakfast": settings.breakfast_revenue,
+        "comission": settings.comission,
+        "payment_types": payment_types,
+        "transaction_types": (settings.comission, settings.room_revenue, settings.breakfast_revenue) + payment_types,
+    }
+
+    rows = frappe.db.sql("""
+        select ir.name, ir.customer_id, ir.room_type, ir.actual_room_id, ir.channel, `if`.bill_instructions,
+            ift.actual_room_rate, ift.actual_room_nett, ift.breakfast_revenue, ift.comission, ift.total_amount,
+            `if`.name as folio_id
+        from `tabInn Reservation` as ir
+        left join `tabInn Folio` as `if` on `if`.reservation_id = ir.name
+        left join (
+            select parent,
+                max(case when transaction_type = %(room)s then actual_room_rate end) as actual_room_rate,
+                sum(case when transaction_type = %(room)s then amount else 0 end) as actual_room_nett,
+                sum(case when transaction_type = %(breakfast)s then amount else 0 end) as breakfast_revenue,
+                sum(case when transaction_type = %(comission)s then amount else 0 end) as comission,
+                sum(case when transaction_type in %(payment_types)s then amount else 0 end) as total_amount
+            from `tabInn Folio Transaction`
+            where audit_date = %(audit_date)s and transaction_type in %(transaction_types)s
+            group by parent
+        ) as ift on ift.parent = `if`.name
+        where
+        (ir.status = 'In House' and ir.expected_arrival <= %(audit_date)s) or
+        (ir.status = 'Finish' and ir.expected_arrival <= %(audit_date)s and ir.expected_departure > %(audit_date)s)
+    """, values, as_dict=1)
+
+    payments = {}
+    for payment in frappe.db.sql("""
+        select parent, mode_of_payment, amount, creation
+        from `tabInn Folio Transaction`
+        where audit_date = %(audit_date)s and transaction_type in %(payment_types)s
+        order by creation
+    """, values, as_dict=1):
+        payments.setdefault(payment.parent, []).append(payment)
+
+    for x in rows:
+        folio_payments = payments.get(x.folio_id, [])
+        yield [
+            x.name,
+            x.customer_id,
+            x.room_type,
+            x.actual_room_id,
+            x.actual_room_rate or 0,
+            x.actual_room_nett or 0,
+            x.breakfast_revenue or 0,
+            x.comission or 0,
+            x.channel,
+            "",
+            format_payments(folio_payments) if is_show_mode_payment else "",  # mode of payment
+            x.total_amount or 0,
+            ", ".join(str(payment.creation) for payment in folio_payments),  # paid date
+            "",
+            x.bill_instructions
+        ]
+
+
+def format_payments(payments):
+    # "BY <mode of payment> <amount>" per payment, thousands separated by dots
+    return ", ".join(f"BY {payment.mode_of_payment} {float(payment.amount):,}".replace(",", ".") for payment in payments)
+
+
+def get_audit_settings():
+    # transaction types the report sums, read from the cached Inn Hotels Setting
+    setting = frappe.get_cached_doc("Inn Hotels Setting")
+    if setting.breakfast_revenue_account == None:
         raise ImportError(
             "Breakfast Revenue Account in Inn Hotels Setting not set yet")
-    else:
-        BREAKFAST_REVENUE_ACCOUNT = transaction_type.breakfast_revenue_account
-
-    if transaction_type.room_revenue_account == None:
+    if setting.room_revenue_account == None:
         raise ImportError(
             "Room Revenue Account in Inn Hotels Setting not set yet")
-    else:
-        ROOM_REVENUE_ACCOUNT = transaction_type.room_revenue_account
+
+    return frappe._dict({
+        "comission": setting.profit_sharing_transaction_type or "Comission Channel",
+        "room_revenue": setting.room_revenue_transaction_type or "Room Charge",
+        "breakfast_revenue": setting.breakfast_revenue_transaction_type or "Breakfast Charge",
+        "payment": setting.customer_payment_transaction_type or "Payment",
+        "room_payment": setting.customer_room_payment_transaction_type or "Room Payment",
+    })
+
+
+@frappe.whitelist()
+def export_audit_report(from_date, to_date, fill_mode_payment=1):
+    """Download the audit report of every audit date in [from_date, to_date] as CSV.
+
+    Each date is queried and written on its own, so multi-month audits never hold their full row list in memory.
+    """
+    frappe.has_permission("Inn Folio", throw=True)
+    from_date = parse(from_date).date()
+    to_date = parse(to_date).date()
+    if from_date > to_date:
+        raise ValueError("to date cannot before from date")
+
+    is_show_mode_payment = frappe.utils.cint(fill_mode_payment)
+
+    def iter_rows():
+        audit_date = from_date
+        while audit_date <= to_date:
+            for row in iter_audit_rows(audit_date.isoformat(), is_show_mode_payment):
+                yield [audit_date.isoformat()] + row
+            audit_date += timedelta(days=1)
+
+    header = ["Audit Date"] + [column["label"] for column in get_columns()]
+    return stream_csv(f"audit_report_{from_date}_{to_date}.csv", header, iter_rows())
@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 import frappe
 import datetime
 import calendar
+from inn.inn_hotels.doctype.inn_daily_kpi.inn_daily_kpi import get_daily_kpi
 
 def execute(filters=None):
 	columns = [
@@ -56,31 +57,6 @@ def get_total_room():
 		FROM `tabInn Room` r
 		LEFT JOIN `tabInn Room Type` rt ON r.room_type=rt.name""", as_dict=True)
 
-def get_room_booking(current_year, next_year):
-	return frappe.db.sql("""
-		select rb.start, rb.end, rb.room_availability, r.room_type, rb.status
-		from `tabInn Room Booking` rb
-		left join `tabInn Room` r on r.name = rb.room_id 
-		where end>=%s and start<%s""", (current_year, next_year), as_dict=True)
-
-def get_reservation(current_year, next_year):
-	return frappe.db.sql("""
-		select arrival, departure, status, channel, actual_room_rate
-		from `tabInn Reservation`
-		where departure>=%s and arrival<%s""", (current_year, next_year), as_dict=True)
-
-def get_gl_entry(current_year, next_year):
-	return frappe.db.sql("""
-        select posting_date, account, credit, debit
-        from `tabGL Entry`
-        where posting_date>=%s and posting_date<%s""", (current_year, next_year), as_dict=True)
-
-def get_folio_transaction(current_year, next_year):
-	return frappe.db.sql("""
-        select audit_date, amount, mode_of_payment
-        from `tabInn Folio Transaction`
-        where flag='Credit' and audit_date>=%s and audit_date<%s""", (current_year, next_year), as_dict=True)
-
 def get_mode_of_payment():
 	return frappe.db.sql("""
 	select name from `tabMode of Payment`""", as_dict=True)
@@ -108,49 +84,28 @@ def get_data(filters):
 		for key in keys:
 			room[key] = {'today_actual': 0, 'mtd_actual': 0, 'mtd_last_month': 0, 'year_to_date': 0} 
 
-		room_booking = get_room_booking(current_year, next_year)
-		
-		for rb in room_booking:
-			start = rb['start']
-			end = rb['end']
-
-			for i in range((end-start).days):
-				date = start + datetime.timedelta(days=i)
-				availability = rb.room_availability
-
-				if availability == 'Out of Order' or availability == 'House Use':
-					key = 'Total Room ' + availability 
-
-					room[key]['year_to_date'] = room[key]['year_to_date'] + 1
-					if date == today:
-						room[key]['today_actual'] = room[key]['today_actual'] + 1
-					if date >= current_month and date <= today:
-						room[key]['mtd_actual'] = room[key]['mtd_actual'] + 1
-					elif date >= last_month and date < current_month:
-						room[key]['mtd_last_month'] = room[key]['mtd_last_month'] + 1
-
-				elif availability == 'Room Sold' and (rb.status == 'Stayed' or rb.status == 'Finished'):
-					key = rb.room_type + ' Sold'
-
-					room[key]['year_to_date'] = room[key]['year_to_date'] + 1
-					if date == today:
-						room[key]['today_actual'] = room[key]['today_actual'] + 1
-					if date >= current_month and date <= today:
-						room[key]['mtd_actual'] = room[key]['mtd_actual'] + 1
-					elif date >= last_month and date < current_month:
-						room[key]['mtd_last_month'] = room[key]['mtd_last_month'] + 1
-				
-				elif availability == 'Room Sold' and rb.status == 'Booked':
-					key = rb.room_type + ' Reserved'
-
-					room[key]['year_to_date'] = room[key]['year_to_date'] + 1
-					if date == today:
-						room[key]['today_actual'] = room[key]['today_actual'] + 1
-					if date >= current_month and date <= today:
-						room[key]['mtd_actual'] = room[key]['mtd_actual'] + 1
-					elif date >= last_month and date < current_month:
-						room[key]['mtd_last_month'] = room[key]['mtd_last_month'] + 1
-		
+		# one value per (day, kpi) from the daily KPI fact table instead of expanding every booking into nights
+		daily_kpi = get_daily_kpi(current_year, next_year - datetime.timedelta(days=1))
+
+		def add_to_period(counter, date, value):
+			counter['year_to_date'] = counter['year_to_date'] + value
+			if date == today:
+				counter['today_actual'] = counter['today_actual'] + value
+			if date >= current_month and date <= today:
+				counter['mtd_actual'] = counter['mtd_actual'] + value
+			elif date >= last_month and date < current_month:
+				counter['mtd_last_month'] = counter['mtd_last_month'] + value
+
+		room_rate = {'today_actual': 0, 'mtd_actual': 0, 'mtd_last_month': 0, 'year_to_date': 0}
+		for (date, kpi_type, kpi_key), value in daily_kpi.items():
+			if kpi_type != 'Room':
+				continue
+			if kpi_key == 'In House Room Rate':
+				add_to_period(room_rate, date, value)
+				continue
+			if kpi_key in room:
+				add_to_period(room[kpi_key], date, int(value))
+
 		room['Total Saleable Room'] = {
 			'today_actual': room['Total Room Available']['today_actual'] - room['Total Room Out of Order']['today_actual'], 
 			'mtd_actual': room['Total Room Available']['mtd_actual'] - room['Total Room Out of Order']['mtd_actual'], 
@@ -168,49 +123,10 @@ def get_data(filters):
 			'year_to_date': total_room*((today-current_year).days+1)
 		}
 		
-		average_room_rate = {'today_actual': 0, 'mtd_actual': 0, 'mtd_last_month': 0, 'year_to_date': 0}
-
-		reservation = get_reservation(current_year, next_year)
-		for r in reservation:
-			start = r['arrival'].date()
-			end = r['departure'].date()
-
-			if start == end:
-				room['Total Day Use']['year_to_date'] = room['Total Day Use']['year_to_date'] + 1
-				if start == today:
-					room['Total Day Use']['today_actual'] = room['Total Day Use']['today_actual'] + 1
-				if start >= current_month and start <= today:
-					room['Total Day Use']['mtd_actual'] = room['Total Day Use']['mtd_actual'] + 1
-				elif start >= last_month and start < current_month:
-					room['Total Day Use']['mtd_last_month'] = room['Total Day Use']['mtd_last_month'] + 1
-
-			for i in range((end-start).days):
-				date = start + datetime.timedelta(days=i)
-				status = r.status
-
-				if status == 'In House':
-					room['Total In House']['year_to_date'] = room['Total In House']['year_to_date'] + 1
-					average_room_rate['year_to_date'] = (average_room_rate['year_to_date'] + r['actual_room_rate']) / 2
-					if date == today:
-						room['Total In House']['today_actual'] = room['Total In House']['today_actual'] + 1
-						average_room_rate['today_actual'] = (average_room_rate['today_actual'] + r['actual_room_rate']) / 2
-					if date >= current_month and date <= today:
-						room['Total In House']['mtd_actual'] = room['Total In House']['mtd_actual'] + 1
-						average_room_rate['mtd_actual'] = (average_room_rate['mtd_actual'] + r['actual_room_rate']) / 2
-					elif date >= last_month and date < current_month:
-						room['Total In House']['mtd_last_month'] = room['Total In House']['mtd_last_month'] + 1
-						average_room_rate['mtd_last_month'] = (average_room_rate['mtd_last_month'] + r['actual_room_rate']) / 2
-
-					
-					channel = r.channel
-					if channel == 'Walk In':
-						room['Total Walk In']['year_to_date'] = room['Total Walk In']['year_to_date'] + 1
-						if date == today:
-							room['Total Walk In']['today_actual'] = room['Total Walk In']['today_actual'] + 1
-						if date >= current_month and date <= today:
-							room['Total Walk In']['mtd_actual'] = room['Total Walk In']['mtd_actual'] + 1
-						elif date >= last_month and date < current_month:
-							room['Total Walk In']['mtd_last_month'] = room['Total Walk In']['mtd_last_month'] + 1
+		average_room_rate = {}
+		for period in room_rate:
+			in_house = room['Total In House'][period]
+			average_room_rate[period] = room_rate[period] / in_house if in_house else 0
 
 		room['Total Vacant Room'] = {
 			'today_actual': room['Total Room Available']['today_actual'] - room['Total In House']['today_actual'], 
@@ -230,22 +146,9 @@ def get_data(filters):
 		for key in keys:
 			revenue[key] = {'today_actual': 0, 'mtd_actual': 0, 'mtd_last_month': 0, 'year_to_date': 0}
 
-		gl_entry = get_gl_entry(current_year, next_year)
-		for ge in gl_entry:
-			account = ge.account[:8]
-			if account == '4210.001' or \
-				account == '4110.001' or account == '4120.001' or account == '4120.002' or \
-				account == '4140.001' or account == '4140.002' or \
-				account == '4150.001' or account == '4150.002' or account == '4150.003' or account == '4150.004' or account == '4150.006' or \
-				account == '2141.000' or account == '2110.004':
-					
-				revenue[account]['year_to_date'] = revenue[account]['year_to_date'] + ge.credit - ge.debit
-				if ge.posting_date == today:
-					revenue[account]['today_actual'] = revenue[account]['today_actual'] + ge.credit - ge.debit
-				if ge.posting_date >= current_month and ge.posting_date <= today:
-					revenue[account]['mtd_actual'] = revenue[account]['mtd_actual'] + ge.credit - ge.debit
-				elif ge.posting_date >= last_month and ge.posting_date < current_month:
-					revenue[account]['mtd_last_month'] = revenue[account]['mtd_last_month'] + ge.credit - ge.debit
+		for (date, kpi_type, kpi_key), value in daily_kpi.items():
+			if kpi_type == 'Revenue' and kpi_key in revenue:
+				add_to_period(revenue[kpi_key], date, value)
 
 		payment = {}
 
@@ -262,15 +165,9 @@ def get_data(filters):
 				payment[mp.name]['mtd_last_month'] = 0
 				payment[mp.name]['year_to_date'] = 0
 
-		folio_transaction = get_folio_transaction(current_year, next_year)
-		for ft in folio_transaction:
-			payment[ft.mode_of_payment]['year_to_date'] = payment[ft.mode_of_payment]['year_to_date'] + ft.amount
-			if ft.audit_date == today:
-				payment[ft.mode_of_payment]['today_actual'] = payment[ft.mode_of_payment]['today_actual'] + ft.amount
-			if ft.audit_date >= current_month and ft.audit_date <= today:
-				payment[ft.mode_of_payment]['mtd_actual'] = payment[ft.mode_of_payment]['mtd_actual'] + ft.amount
-			elif ft.audit_date >= last_month and ft.audit_date < current_month:
-				payment[ft.mode_of_payment]['mtd_last_month'] = payment[ft.mode_of_payment]['mtd_last_month'] + ft.amount
+		for (date, kpi_type, kpi_key), value in daily_kpi.items():
+			if kpi_type == 'Payment' and kpi_key in payment:
+				add_to_period(payment[kpi_key], date, value)
 
 		for key in room:
 			title = key
@@ -3,10 +3,9 @@
 
 from __future__ import unicode_literals
 import frappe
-import json
-import ast
 import datetime
 import math
+from inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance import get_dirty_gl_months, get_gl_monthly_balance, get_month_range
 
 def execute(filters=None):
     columns = [
@@ -52,11 +51,24 @@ def get_accounts(root_type):
 		from `tabAccount`
 		where root_type=%s order by name""", (root_type), as_dict=True)
 
-def get_gl_entries(date, fiscal_year):
-    return frappe.db.sql("""
-        select posting_date, account, debit, credit
-        from `tabGL Entry`
-        where fiscal_year=%s and posting_date<=%s""", (fiscal_year, date), as_dict=True)
+def get_month_balances(date, fiscal_year):
+    """
+    :return list of (month, account, debit, credit) of the fiscal year up to date:
+    closed months from Inn GL Monthly Balance, the month of date grouped from GL Entry.
+    closed months changed since their rollup (backdated or cancelled entries) are grouped from GL Entry too,
+    until the dayend close rolls them up again
+    """
+    dirty_months = [month for _, month in get_dirty_gl_months(str(fiscal_year)) if month < date.month]
+    balances = get_gl_monthly_balance(fiscal_year, date.month, exclude_months=dirty_months)
+    periods = [(month,) + get_month_range(str(fiscal_year), month) for month in dirty_months]
+    periods.append((date.month, date.replace(day=1).date(), date.date()))
+    for month, from_date, to_date in periods:
+        balances.extend(frappe.db.sql("""
+            select %s, account, sum(debit), sum(credit)
+            from `tabGL Entry`
+            where fiscal_year=%s and posting_date between %s and %s
+            group by account""", (month, fiscal_year, from_date, to_date)))
+    return balances
 
 def get_data(filters):
     data = []
@@ -68,23 +80,11 @@ def get_data(filters):
         if date.year == fiscal_year:
             accounts_map = {}
 
-            accounts = get_accounts('Income')
-            for account in accounts:
-                parent = None
-                if account['parent_account']:
-                    parent = account['parent_account']
-
-                accounts_map[account['name']] = {'account_parent': parent, 'current_month': 0, 'last_month': 0, 'year_to_date': 0}
-
-            
-            accounts = get_accounts('Expense')
-            for account in accounts:
-                parent = None
-                if account['parent_account']:
-                    parent = account['parent_account']
+            for root_type in ('Income', 'Expense'):
+                for account in get_accounts(root_type):
+                    accounts_map[account['name']] = {'account_parent': account['parent_account'] or None,
+                                                     'debit': [0, 0, 0], 'credit': [0, 0, 0]}
 
-                accounts_map[account['name']] = {'account_parent': parent, 'current_month': 0, 'last_month': 0, 'year_to_date': 0}
-            
             for account in accounts_map:
                 indent = 0.0
 
@@ -95,47 +95,45 @@ def get_data(filters):
                 
                 accounts_map[account]['indent'] = indent
 
-            gl_entries = get_gl_entries(date, fiscal_year)
-            for gl_entry in gl_entries:
-                account = gl_entry['account']
-                if account[:1] == '4' or account[:1] == '5' or account[:1] == '6' or account[:1] == '7':
-                    while account is not None:
-                        if account[:1] == '4':
-                            accounts_map[account]['year_to_date'] = accounts_map[account]['year_to_date'] - gl_entry['debit'] + gl_entry['credit']
-
-                            if gl_entry['posting_date'].month == date.month:
-                                accounts_map[account]['current_month'] = accounts_map[account]['current_month'] - gl_entry['debit'] + gl_entry['credit']
-                            elif gl_entry['posting_date'].month+1 == date.month:
-                                accounts_map[account]['last_month'] = accounts_map[account]['last_month'] - gl_entry['debit'] + gl_entry['credit']
-
-                        elif account[:1] == '5' or account[:1] == '6' or account[:1] == '7':
-                            accounts_map[account]['year_to_date'] = accounts_map[account]['year_to_date'] + gl_entry['debit'] - gl_entry['credit']
-
-                            if gl_entry['posting_date'].month == date.month:
-                                accounts_map[account]['current_month'] = accounts_map[account]['current_month'] + gl_entry['debit'] - gl_entry['credit']
-                            elif gl_entry['posting_date'].month+1 == date.month:
-                                accounts_map[account]['last_month'] = accounts_map[account]['last_month'] + gl_entry['debit'] - gl_entry['credit']
-
-                        account = accounts_map[account]['account_parent']
+            # debit and credit per account as [current month, last month, year to date]
+            for month, account, debit, credit in get_month_balances(date, fiscal_year):
+                if account[:1] not in ('4', '5', '6', '7') or account not in accounts_map:
+                    continue
+                periods = [2]
+                if month == date.month:
+                    periods.append(0)
+                elif month + 1 == date.month:
+                    periods.append(1)
+                for period in periods:
+                    accounts_map[account]['debit'][period] += debit
+                    accounts_map[account]['credit'][period] += credit
+
+            # roll the totals up the account tree once, deepest accounts first
+            for account in sorted(accounts_map, key=lambda account: accounts_map[account]['indent'], reverse=True):
+                parent = accounts_map[account]['account_parent']
+                if parent is not None:
+                    for period in range(3):
+                        accounts_map[parent]['debit'][period] += accounts_map[account]['debit'][period]
+                        accounts_map[parent]['credit'][period] += accounts_map[account]['credit'][period]
 
             for account in accounts_map:
-                parent = ''
-                if accounts_map[account]['account_parent']:
-                    parent = accounts_map[account]['account_parent']
-                
+                debit = accounts_map[account]['debit']
+                credit = accounts_map[account]['credit']
+                if account[:1] == '4':
+                    balance = [credit[period] - debit[period] for period in range(3)]
+                elif account[:1] in ('5', '6', '7'):
+                    balance = [debit[period] - credit[period] for period in range(3)]
+                else:
+                    balance = [0, 0, 0]
+
                 data.append({
                         'account': account,
                         'currency': 'IDR',
-                        'current_month': math.ceil(accounts_map[account]['current_month']),
-                        'last_month': math.ceil(accounts_map[account]['last_month']),
-                        'year_to_date': math.ceil(accounts_map[account]['year_to_date']),
-                        'parent_account': parent,
+                        'current_month': math.ceil(balance[0]),
+                        'last_month': math.ceil(balance[1]),
+                        'year_to_date': math.ceil(balance[2]),
+                        'parent_account': accounts_map[account]['account_parent'] or '',
                         'indent': accounts_map[account]['indent']
                     })
-                
-            data = json.dumps(data)
-            data = ast.literal_eval(data)
-
-            print(data)
 
-    return data
\ No newline at end of file
+    return data
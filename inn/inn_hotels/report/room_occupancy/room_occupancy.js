@@ -22,7 +22,22 @@ frappe.query_reports["Room Occupancy"] = {
 			}
 		},
 
-	]
+	],
+	onload(query_report) {
+		["CSV", "XLSX"].forEach(file_format => {
+			query_report.page.add_inner_button(__("Export {0}", [file_format]), () => {
+				let { start_date, end_date } = query_report.get_filter_values()
+				if (!start_date || !end_date) {
+					frappe.throw(__("Set Start Date and End Date first"))
+				}
+				window.open(frappe.urllib.get_full_url(
+					"/api/method/inn.inn_hotels.report.room_occupancy.room_occupancy.export_room_occupancy?"
+					+ "start_date=" + encodeURIComponent(start_date)
+					+ "&end_date=" + encodeURIComponent(end_date)
+					+ "&file_format=" + file_format))
+			}, __("Export"))
+		})
+	}
 };
 
 
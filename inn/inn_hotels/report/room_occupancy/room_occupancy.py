@@ -1,12 +1,16 @@
 # Copyright (c) 2024, Core Initiative and contributors
 # For license information, please see license.txt
 
+from itertools import accumulate
+
 import frappe
 from dateutil.parser import parse
-from datetime import timedelta, datetime
-from inn.helper.daterange import daterange
+from datetime import timedelta, datetime, date
+from inn.helper.export import send_spooled_file, spooled_file, stream_csv
 
 FORMAT_DATE = "%Y-%m-%d"
+# export computes this many days at once, so memory stays flat for multi-year ranges
+EXPORT_CHUNK_DAYS = 92
 
 
 def execute(filters=None):
@@ -43,46 +47,101 @@ def get_column(start_date: datetime, date_length: datetime):
     return column
 
 
+def get_occupancy(start_date: date, end_date: date) -> dict[str, list[int]]:
+    """Occupied rooms per room type for every day of [start_date, end_date].
+
+    Bookings are grouped by (room_type, start, end) in SQL, each group adds its count at its first
+    day offset and removes it after its last one (difference array), a cumulative sum gives the per-day count.
+    """
+    days = (end_date - start_date).days + 1
+    bookings = frappe.db.sql('''
+        select tir.room_type, tirb.start, tirb.end, count(*)
+        from `tabInn Room Booking` tirb left join `tabInn Room` tir
+        on tirb.room_id = tir.name
+        where tirb.status != 'Canceled'
+        and tirb.end > %s and tirb.start <= %s
+        group by tir.room_type, tirb.start, tirb.end
+    ''', (start_date, end_date))
+
+    difference = {}
+    for room_type, start, end, count in bookings:
+        diff = difference.get(room_type)
+        if diff is None:
+            diff = difference[room_type] = [0] * (days + 1)
+        diff[max((start - start_date).days, 0)] += count
+        diff[min((end - start_date).days, days)] -= count
+
+    return {room_type: list(accumulate(diff[:days])) for room_type, diff in difference.items()}
+
+
+def get_total_room() -> dict[str, int]:
+    return dict(frappe.db.sql("select room_type, count(*) from `tabInn Room` group by room_type"))
+
+
 def get_data(start_date: datetime, end_date: datetime, delta_time):
-    query = f'''
-    select tirb.name, tir.room_type, start, end, status
-    from `tabInn Room Booking` tirb left join `tabInn Room` tir
-    on tirb.room_id = tir.name
-    where status != 'Canceled'
-    and end > '{start_date.date()}' and start < '{end_date.date()}'
-    '''
-
-    all_booking = frappe.db.sql(query, as_dict=1)
-
-    result = {}
-    for booking in all_booking:
-        if booking.room_type not in result:
-            result[booking.room_type] = {
-                "type":  booking.room_type,
-            }
-            for date in daterange(start_date, end_date + timedelta(days=1)):
-                date = date.strftime(FORMAT_DATE)
-                result[booking.room_type][date] = 0
-
-        cur = result[booking.room_type]
-
-        for date in daterange(booking.start, booking.end):
-            date = date.strftime(FORMAT_DATE)
-            if date not in cur:
-                continue
-            cur[date] += 1
+    start_date = start_date.date()
+    end_date = end_date.date()
+    dates = [(start_date + timedelta(days=day)).strftime(FORMAT_DATE) for day in range(delta_time.days + 1)]
+
+    occupancy = get_occupancy(start_date, end_date)
+    total_room = get_total_room()
 
     transposed = []
-    for booking in result:
-        if "total" not in result[booking]:
-            result[booking]["total"] = frappe.db.count(
-                "Inn Room", {"room_type": booking}, cache=True)
+    for room_type, occupied in occupancy.items():
+        total = total_room.get(room_type, 0)
+        row = {"type": room_type, "total": total}
+        # strings are only built here, at the output boundary
+        row.update(zip(dates, (f"{count} / {total}" for count in occupied)))
+        transposed.append(row)
 
-        for key in result[booking]:
-            if key == "type" or key == "total":
-                continue
-            result[booking][key] = f"{result[booking][key]} / {result[booking]['total']}"
+    return transposed
 
-        transposed.append(result[booking])
 
-    return transposed
+def iter_occupancy_rows(start_date: date, end_date: date):
+    """Yield (date, {room_type: occupied}) for every day, computing EXPORT_CHUNK_DAYS days at a time."""
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=EXPORT_CHUNK_DAYS - 1), end_date)
+        occupancy = get_occupancy(chunk_start, chunk_end)
+        for day in range((chunk_end - chunk_start).days + 1):
+            yield chunk_start + timedelta(days=day), {room_type: occupied[day] for room_type, occupied in occupancy.items()}
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+@frappe.whitelist()
+def export_room_occupancy(start_date, end_date, file_format="CSV"):
+    """Download the occupancy of a long range, one line per day and one column per room type.
+
+    Days are computed EXPORT_CHUNK_DAYS at a time into a spooled temporary file (XLSX through a write-only
+    workbook) which is then streamed to the client, memory stays flat for multi-year ranges.
+    """
+    frappe.has_permission("Inn Room Booking", throw=True)
+    start_date = parse(start_date).date()
+    end_date = parse(end_date).date()
+    if start_date >= end_date:
+        raise ValueError("end date cannot before start date")
+
+    total_room = get_total_room()
+    room_types = sorted(total_room, key=lambda room_type: room_type or "")
+    header = ["Date"] + [room_type or "" for room_type in room_types]
+
+    def to_line(day, occupied):
+        return [day.strftime(FORMAT_DATE)] + [
+            f"{occupied.get(room_type, 0)} / {total_room[room_type]}" for room_type in room_types]
+
+    filename = f"room_occupancy_{start_date}_{end_date}"
+    rows = (to_line(day, occupied) for day, occupied in iter_occupancy_rows(start_date, end_date))
+    if file_format != "XLSX":
+        return stream_csv(filename + ".csv", header, rows)
+
+    from openpyxl import Workbook
+
+    content = spooled_file()
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Room Occupancy")
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(content)
+    return send_spooled_file(content, filename + ".xlsx",
+                             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
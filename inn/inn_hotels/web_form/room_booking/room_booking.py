@@ -1,5 +1,4 @@
 from datetime import timedelta, date, datetime
-from inn.helper import daterange
 import operator
 import frappe
 
@@ -31,37 +30,49 @@ class InnRoomBookingChoice:
 				 
 
 
-def tup_key_gen(row):
-	return (row[1], row[2], row[3])
+# available rooms answer for the same (start, end, rooms) is shared by every visitor for this many seconds
+AVAILABILITY_CACHE_TTL = 60
+AVAILABILITY_CACHE_KEY = "inn_guest_booking_availability"
+RATE_TABLE_CACHE_KEY = "inn_guest_booking_rate_table"
 
 
-def get_rate(available_room, num_of_room: int, num_of_night: int) -> list:
-
+def get_guest_booking_group():
 	default_group_guest = "Guest Booking Group"
 	setting_group_guest = frappe.db.get_value(doctype="Inn Hotels Setting", fieldname="guest_booking_group")
 	if setting_group_guest != None:
 		default_group_guest = setting_group_guest
+	return default_group_guest
 
-	result = []
 
-	# prevent multiple query with same filter
-	room_types = set()
-	for ii in available_room:
-		room_types.add(ii[0])
-		
-
-	for room_type in room_types:
-		prices = frappe.db.get_list(ignore_permissions=True, doctype="Inn Room Rate", filters={"customer_group": default_group_guest, "room_type": room_type}, fields=["final_total_rate_amount", "final_breakfast_rate_amount"])
-		if len(prices) == 0:
-			continue
-
-		for price in prices:
-			for jj in available_room:
-				if jj[0] == room_type:
-					elem = InnRoomBookingChoice(jj)
-					elem.add_rate(price)
-					elem.adjust_price_with_day_and_room(num_of_room, num_of_night)
-					result.append(elem)
+def get_rate_table(customer_group: str) -> dict:
+	"""
+	:return dict of room_type to list of (final_total_rate_amount, final_breakfast_rate_amount) of the customer group,
+	cached until an Inn Room Rate changes
+	"""
+	rate_table = frappe.cache().hget(RATE_TABLE_CACHE_KEY, customer_group)
+	if rate_table is None:
+		rate_table = {}
+		for rate in frappe.get_all("Inn Room Rate", filters={"customer_group": customer_group},
+								   fields=["room_type", "final_total_rate_amount", "final_breakfast_rate_amount"]):
+			rate_table.setdefault(rate.room_type, []).append((rate.final_total_rate_amount, rate.final_breakfast_rate_amount))
+		frappe.cache().hset(RATE_TABLE_CACHE_KEY, customer_group, rate_table)
+	return rate_table
+
+
+def clear_rate_table_cache():
+	frappe.cache().delete_value(RATE_TABLE_CACHE_KEY)
+
+
+def get_rate(available_room, num_of_room: int, num_of_night: int) -> list:
+	rate_table = get_rate_table(get_guest_booking_group())
+
+	result = []
+	for room in available_room:
+		for final_total_rate_amount, final_breakfast_rate_amount in rate_table.get(room[0], []):
+			elem = InnRoomBookingChoice(room)
+			elem.add_rate({"final_total_rate_amount": final_total_rate_amount, "final_breakfast_rate_amount": final_breakfast_rate_amount})
+			elem.adjust_price_with_day_and_room(num_of_room, num_of_night)
+			result.append(elem)
 
 	return sorted(result, key = operator.itemgetter("room_type", "bed_type", "allow_smoke"))
 	
@@ -79,46 +90,42 @@ def get_available_room_and_rate(start_date, end_date, num_room):
 	if type(num_room) == str:
 		num_room = int(num_room)
 
-	# get number of room with same room type and bed type
-	default_availability = frappe.db.sql(
-		'SELECT count(*), room_type, bed_type, allow_smoke '
-		'from `tabInn Room` group by room_type, bed_type, allow_smoke'
-		)
-	available_room = {}
-	for ii in default_availability:
-		room_key = tup_key_gen(ii)
-		available_room[room_key] = ii[0]
-
-	start_date = datetime.strptime(start_date, "%Y-%m-%d")
-	end_date = datetime.strptime(end_date, "%Y-%m-%d")
-	num_night = end_date - start_date
-	for curr_date in daterange(start_date, end_date):
-		used_availability = frappe.db.sql(
-			"select count(*), room_type, bed_type, allow_smoke from `tabInn Room` as ir "
-			"join `tabInn Room Booking` as irb on irb.room_id = ir.name where status not in ('Finished', 'Canceled') "
-			"and irb.start <= %(date)s and irb.end > %(date)s group by bed_type, room_type, allow_smoke"
-		, values={"date":curr_date}, as_dict=0)
-
-		# reduce room number because being used in this date
-		unusable_room = {}
-		for ii in used_availability:
-			room_key = tup_key_gen(ii)
-			unusable_room[room_key] = ii[0]
-
-		# check if jumlah tipe kamar yang tersedia memenuhi jumlah kamar yang diminta
-		not_enough_quantity = []
-		for ii in available_room:
-			kamar_sisa = available_room[ii]
-			if ii in unusable_room:
-				kamar_sisa -= unusable_room[ii]
-			if kamar_sisa < int(num_room):
-				not_enough_quantity.append(ii)
-
-		for ii in not_enough_quantity:
-			available_room.pop(ii)
-
-	result = get_rate(available_room, num_room, num_night.days)
+	start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+	end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+
+	cache_key = "{0}|{1}|{2}".format(start_date, end_date, num_room)
+	result = frappe.cache().get_value(AVAILABILITY_CACHE_KEY + ":" + cache_key)
+	if result is not None:
+		return result
+
+	available_room = get_available_room(start_date, end_date, num_room)
+	result = get_rate(available_room, num_room, (end_date - start_date).days)
 	result = convert_json(result)
 
+	frappe.cache().set_value(AVAILABILITY_CACHE_KEY + ":" + cache_key, result, expires_in_sec=AVAILABILITY_CACHE_TTL)
 	return result
 
+
+def get_available_room(start_date: date, end_date: date, num_room: int) -> list:
+	"""
+	:return list of (room_type, bed_type, allow_smoke) having at least num_room rooms free on every night of [start_date, end_date)
+
+	one aggregate over the room-night index: the busiest night of the range decides how many rooms of a kind are left.
+	"""
+	rooms = frappe.db.sql(
+		"select ir.room_type, ir.bed_type, ir.allow_smoke, count(*) - coalesce(max(used.used_room), 0) "
+		"from `tabInn Room` as ir "
+		"left join ("
+		"	select used_night.room_type, used_night.bed_type, used_night.allow_smoke, max(used_night.used_room) as used_room "
+		"	from ("
+		"		select r.room_type, r.bed_type, r.allow_smoke, irn.date, count(*) as used_room "
+		"		from `tabInn Room Night` as irn join `tabInn Room` as r on r.name = irn.room_id "
+		"		where irn.date >= %(start)s and irn.date < %(end)s and irn.status in ('Booked', 'Stayed') "
+		"		group by r.room_type, r.bed_type, r.allow_smoke, irn.date"
+		"	) as used_night "
+		"	group by used_night.room_type, used_night.bed_type, used_night.allow_smoke"
+		") as used on used.room_type <=> ir.room_type and used.bed_type <=> ir.bed_type and used.allow_smoke <=> ir.allow_smoke "
+		"group by ir.room_type, ir.bed_type, ir.allow_smoke",
+		values={"start": start_date, "end": end_date})
+
+	return [(room_type, bed_type, allow_smoke) for room_type, bed_type, allow_smoke, remaining in rooms if remaining >= num_room]
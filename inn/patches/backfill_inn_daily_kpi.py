@@ -0,0 +1,19 @@
+import frappe
+from frappe.utils import add_days
+from inn.inn_hotels.doctype.inn_audit_log.inn_audit_log import get_last_audit_date
+from inn.inn_hotels.doctype.inn_daily_kpi.inn_daily_kpi import backfill_daily_kpi
+
+
+def execute():
+    # MTD / YTD of the Daily Flash Report read stored facts, backfill every closed day of the current fiscal year
+    from erpnext.accounts.utils import get_fiscal_year
+
+    frappe.reload_doc("inn_hotels", "doctype", "inn_daily_kpi")
+    audit_date = get_last_audit_date()
+    if not audit_date:
+        return
+
+    # the current audit date is not closed yet, its facts are computed on the fly
+    last_closed_date = add_days(audit_date, -1)
+    fiscal_year_start = get_fiscal_year(last_closed_date)[1]
+    backfill_daily_kpi(fiscal_year_start, last_closed_date)
@@ -0,0 +1,8 @@
+import frappe
+from inn.inn_hotels.doctype.inn_gl_monthly_balance.inn_gl_monthly_balance import rebuild_gl_monthly_balance
+
+
+def execute():
+    # the P&L report now reads closed months from the GL rollup, backfill it from every existing GL Entry
+    frappe.reload_doc("inn_hotels", "doctype", "inn_gl_monthly_balance")
+    rebuild_gl_monthly_balance()
@@ -0,0 +1,8 @@
+import frappe
+from inn.inn_hotels.doctype.inn_room_night.inn_room_night import rebuild_room_nights
+
+
+def execute():
+    # availability lookups now read the room-night index, backfill it from every existing booking
+    frappe.reload_doc("inn_hotels", "doctype", "inn_room_night")
+    rebuild_room_nights()
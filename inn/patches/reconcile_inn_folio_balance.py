@@ -0,0 +1,8 @@
+import frappe
+from inn.inn_hotels.doctype.inn_folio.inn_folio import reconcile_folio_balances
+
+
+def execute():
+    # folio totals are now maintained incrementally, start every folio from its actual transaction sum
+    frappe.reload_doc("inn_hotels", "doctype", "inn_folio")
+    reconcile_folio_balances(only_open=False)